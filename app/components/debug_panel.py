@@ -0,0 +1,59 @@
+import streamlit as st
+from app.services.profiler import recent_profiles
+from app.security_components.check_therapy import therapy_tier_stats
+from app.services.admission import admission_stats
+from app.services.llm_scheduler import scheduler_stats
+from app.services.summary_service import summary_stats
+
+
+def debug_panel(profile):
+    """Pannello di debug con le misure dell'ultima esecuzione della pagina (PROFILING=1)."""
+    with st.expander(f"🛠️ Profilazione: {profile.page}"):
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Tempo pagina", f"{profile.wall_ms:.1f} ms")
+        col2.metric("Query SQL", profile.sql_statements, help=f"{profile.sql_ms:.1f} ms nel database")
+        col3.metric("Righe ORM", profile.rows_loaded)
+        col4.metric("Dati caricati", f"{profile.bytes_loaded / 1024:.1f} KB")
+
+        if profile.components:
+            st.markdown("**Componenti**")
+            st.table([
+                {"componente": name, "chiamate": count, "totale ms": round(total, 2)}
+                for name, (count, total) in sorted(profile.components.items(), key=lambda c: -c[1][1])
+            ])
+
+        hotspots = profile.hotspots()
+        if hotspots:
+            st.markdown(f"**Hot spot CPU** ({profile.total_samples} campioni)")
+            st.table([
+                {"funzione": func, "% self": round(self_pct, 1), "% cumulativo": round(cum_pct, 1)}
+                for func, self_pct, cum_pct in hotspots
+            ])
+
+        history = [p for p in recent_profiles() if p.page == profile.page][-10:]
+        if len(history) > 1:
+            st.markdown("**Ultime esecuzioni**")
+            st.line_chart({"ms": [p.wall_ms for p in history], "query SQL": [p.sql_statements for p in history]})
+
+        tiers = therapy_tier_stats()
+        if tiers:
+            st.markdown("**Decisioni terapia per livello (processo)**")
+            st.table([{"livello": tier, "decisioni": count} for tier, count in sorted(tiers.items())])
+
+        llm = scheduler_stats()
+        if llm:
+            st.markdown("**Scheduler LLM (processo)**")
+            col1, col2 = st.columns(2)
+            col1.metric("Chiamate in coda", sum(llm["in_coda"].values()), help=str(llm["in_coda"] or "nessuna"))
+            col2.metric("Chiamate in corso", sum(llm["in_corso"].values()), help=str(llm["in_corso"] or "nessuna"))
+            st.table([{"classe": name, **values} for name, values in llm["classi"].items()])
+
+        admission = admission_stats()
+        if admission:
+            st.markdown("**Controllo di ammissione (processo)**")
+            st.table([{"azione/ruolo": name, **values} for name, values in admission.items()])
+
+        summaries = summary_stats()
+        if summaries:
+            st.markdown("**Aggiornamento riassunti (processo)**")
+            st.table([{"contatore": k, "valore": v} for k, v in sorted(summaries.items())])
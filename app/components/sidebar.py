@@ -1,12 +1,25 @@
 import streamlit as st
 import os, time
-def sidebar(user):
-# Percorso del file CSS
-    css_path = os.path.join("app", "page_styles", "sidebar.css")
+from functools import lru_cache
+from app.config import PROFILING
+from app.services.chat_history import forget_chat_history
+from app.services.generation_tasks import cancel_generation
+from app.services.session_state import session_memory_report
+from app.services.profiler import profile_component, profiled_component
+
+
+@lru_cache(maxsize=None)
+def _read_css(name):
+    # letto una volta per processo invece che a ogni rerun
+    with open(os.path.join("app", "page_styles", name)) as f:
+        return f.read()
 
-    # Carica il contenuto e applica lo stile
-    with open(css_path) as f:
-        st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+
+@profiled_component("sidebar")
+def sidebar(user):
+    # Applica lo stile
+    with profile_component("sidebar.css"):
+        st.markdown(f"<style>{_read_css('sidebar.css')}</style>", unsafe_allow_html=True)
 
     # --- SIDEBAR ---
     with st.sidebar:
@@ -36,6 +49,9 @@ def sidebar(user):
 
         for label, page in sidebar_items:
             if st.button(label, key=f"btn_{page}", use_container_width=True):
+                if page != st.session_state.get("current_page"):
+                    # uscendo dalla chat la risposta in generazione non serve più
+                    cancel_generation(st.session_state)
                 st.session_state.current_page = page
                 st.rerun()
 
@@ -44,8 +60,22 @@ def sidebar(user):
             st.session_state.logged_in = False
             st.session_state.user = None
             st.session_state.show_register = False
+            st.session_state.selected_paziente = None
             st.query_params.clear()
-            st.session_state.chat_history = []
+            cancel_generation(st.session_state)
+            # la cronologia resta salvata: al prossimo accesso viene ricaricata
+            forget_chat_history(st.session_state)
+            st.session_state.pop("chat_older_shown", None)
+            st.session_state.pop("chat_context", None)
             st.success("Logout effettuato con successo!")
             time.sleep(1)
-            st.rerun()
\ No newline at end of file
+            st.rerun()
+
+        # --- Report memoria della sessione (PROFILING=1, calcolato solo su richiesta) ---
+        if PROFILING:
+            with st.expander("🧠 Memoria sessione"):
+                if st.button("Misura", key="btn_session_memory"):
+                    total, entries = session_memory_report(st.session_state)
+                    st.caption(f"Totale stimato: {total / 1024:.1f} KB")
+                    for key, size in entries[:10]:
+                        st.caption(f"{key}: {size / 1024:.1f} KB")
@@ -10,11 +10,151 @@ POSTGRES_URL = os.getenv("POSTGRES_URL")
 # Ollama
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL")
 
+# ChromaDB (cartella radice dei vectorstore dei pazienti)
+CHROMA_DIR = os.getenv("CHROMA_DIR", "chroma_db")
+# "per_patient": una cartella Chroma per paziente; "shared": unica collection filtrata per paziente
+VECTORSTORE_LAYOUT = os.getenv("VECTORSTORE_LAYOUT", "per_patient")
+# Modello di embedding ("fake:<dim>" = embedding deterministici per test di carico)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "intfloat/multilingual-e5-large")
+# Parametri HNSW della collection condivisa
+CHROMA_HNSW_M = int(os.getenv("CHROMA_HNSW_M", "32"))
+CHROMA_HNSW_CONSTRUCTION_EF = int(os.getenv("CHROMA_HNSW_CONSTRUCTION_EF", "200"))
+CHROMA_HNSW_SEARCH_EF = int(os.getenv("CHROMA_HNSW_SEARCH_EF", "64"))
+
+# Backend vettoriale nel layout per paziente: "auto" usa lo store compatto (NumPy, memory map)
+# finché il paziente ha al massimo COMPACT_MAX_CHUNKS chunk, poi Chroma; "chroma" solo Chroma
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "auto")
+COMPACT_MAX_CHUNKS = int(os.getenv("COMPACT_MAX_CHUNKS", "256"))
+COMPACT_DTYPE = os.getenv("COMPACT_DTYPE", "float16")
+# Store compatti tenuti in memoria (LRU, numero di pazienti) e secondi dopo cui i file di una
+# generazione superata possono essere cancellati (lettori di altri processi ancora in corso)
+COMPACT_CACHE_SIZE = int(os.getenv("COMPACT_CACHE_SIZE", "256"))
+COMPACT_GC_GRACE = float(os.getenv("COMPACT_GC_GRACE", "300"))
+
+# Budget di latenza (secondi): ogni chiamata LLM riceve il tempo residuo della richiesta,
+# limitato al tetto della propria fase; esaurito il budget si applica il fallback del controllo
+CHAT_LATENCY_BUDGET = float(os.getenv("CHAT_LATENCY_BUDGET", "120"))
+UPLOAD_LATENCY_BUDGET = float(os.getenv("UPLOAD_LATENCY_BUDGET", "300"))
+GUARD_LLM_TIMEOUT = float(os.getenv("GUARD_LLM_TIMEOUT", "15"))
+THERAPY_LLM_TIMEOUT = float(os.getenv("THERAPY_LLM_TIMEOUT", "15"))
+VALIDATION_CHUNK_TIMEOUT = float(os.getenv("VALIDATION_CHUNK_TIMEOUT", "60"))
+LLM_MIN_TIMEOUT = float(os.getenv("LLM_MIN_TIMEOUT", "1"))
+
+# Conversazione col modello riusata tra domande successive sugli stessi pazienti
+# (il prefill dei turni precedenti resta nella cache di Ollama)
+CHAT_CONTEXT_REUSE = os.getenv("CHAT_CONTEXT_REUSE", "1") == "1"
+CHAT_CONTEXT_MAX_TURNS = int(os.getenv("CHAT_CONTEXT_MAX_TURNS", "6"))
+CHAT_CONTEXT_MAX_CHARS = int(os.getenv("CHAT_CONTEXT_MAX_CHARS", "12000"))
+
+# Generazione della risposta in background: ogni quanti secondi si aggiorna l'area chat
+# e dopo quanti secondi senza aggiornamenti (scheda chiusa) il turno viene annullato
+CHAT_REFRESH_INTERVAL = float(os.getenv("CHAT_REFRESH_INTERVAL", "0.5"))
+CHAT_ABANDON_AFTER = float(os.getenv("CHAT_ABANDON_AFTER", "20"))
+
+# Cronologia chat salvata su Postgres: messaggi sempre mostrati e messaggi per pagina
+# quando si chiede di vedere quelli precedenti
+CHAT_HISTORY_RECENT = int(os.getenv("CHAT_HISTORY_RECENT", "20"))
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "10"))
+
+# Riassunti clinici per paziente, aggiornati in background a ogni documento caricato
+# (testo del documento inviato al modello a pezzi di SUMMARY_MAX_DOC_CHARS caratteri)
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "1") == "1"
+SUMMARY_MAX_DOC_CHARS = int(os.getenv("SUMMARY_MAX_DOC_CHARS", "6000"))
+SUMMARY_LLM_TIMEOUT = float(os.getenv("SUMMARY_LLM_TIMEOUT", "300"))
+SUMMARY_QUEUE_SIZE = int(os.getenv("SUMMARY_QUEUE_SIZE", "1000"))
+
+# Domande di coorte (stessa domanda su tutti gli assistiti del medico): pazienti elaborati
+# in parallelo e budget complessivo in secondi
+COHORT_CONCURRENCY = int(os.getenv("COHORT_CONCURRENCY", "4"))
+COHORT_LATENCY_BUDGET = float(os.getenv("COHORT_LATENCY_BUDGET", "600"))
+
+# Scheduler davanti a Ollama: slot concorrenti per modello (es. "mistral=1,llama-guard3:1b=4",
+# gli altri modelli usano LLM_DEFAULT_CONCURRENCY) e secondi di attesa dopo cui una richiesta
+# sale di una classe di priorità, così la validazione in background non resta ferma per sempre
+LLM_SCHEDULER_ENABLED = os.getenv("LLM_SCHEDULER_ENABLED", "1") == "1"
+LLM_DEFAULT_CONCURRENCY = int(os.getenv("LLM_DEFAULT_CONCURRENCY", "2"))
+LLM_MODEL_CONCURRENCY = os.getenv("LLM_MODEL_CONCURRENCY", "")
+LLM_SCHEDULER_AGING = float(os.getenv("LLM_SCHEDULER_AGING", "30"))
+
+# Controllo di ammissione a token bucket: "azione:ruolo=richieste/secondi" separati da virgole
+# (azioni chat, upload, validazione; ruolo Medico, Paziente o * per tutti). ADMISSION_USER_LIMITS
+# vale per ogni utente, ADMISSION_ROLE_LIMITS per tutti gli utenti del ruolo insieme
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_USER_LIMITS = os.getenv(
+    "ADMISSION_USER_LIMITS",
+    "chat:Medico=10/60,chat:Paziente=6/60,upload:Medico=30/300,upload:Paziente=10/300,validazione:*=120/60",
+)
+ADMISSION_ROLE_LIMITS = os.getenv("ADMISSION_ROLE_LIMITS", "chat:Paziente=120/60,upload:Paziente=60/300")
+
+# Estrazione del testo dai PDF (process pool per i documenti lunghi)
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGE_TIMEOUT = float(os.getenv("PDF_PAGE_TIMEOUT", "20"))
+PDF_MAX_TEXT_CHARS = int(os.getenv("PDF_MAX_TEXT_CHARS", "5000000"))
+PDF_WORKER_MEMORY_MB = int(os.getenv("PDF_WORKER_MEMORY_MB", "1024"))
+
+# Upload: embedding del documento calcolati in parallelo alla validazione (in thread dedicati)
+# e scritti nel vectorstore solo se il documento è valido
+UPLOAD_STAGED_INDEXING = os.getenv("UPLOAD_STAGED_INDEXING", "1") == "1"
+UPLOAD_STAGING_WORKERS = int(os.getenv("UPLOAD_STAGING_WORKERS", "2"))
+
+# Servizio di retrieval condiviso (vuoto = embedding e Chroma in questo processo).
+# Esempi: http://127.0.0.1:8765 oppure unix:///tmp/mynurseai-retrieval.sock
+RETRIEVAL_SERVICE_URL = os.getenv("RETRIEVAL_SERVICE_URL", "")
+RETRIEVAL_SERVICE_TIMEOUT = float(os.getenv("RETRIEVAL_SERVICE_TIMEOUT", "30"))
+
+# Limite di tempo per ogni ricerca regex dei filtri di sicurezza su input utente e documenti,
+# in secondi ogni 100.000 caratteri; superato il limite l'input è trattato come sospetto (0 = nessun limite)
+REGEX_TIMEOUT = float(os.getenv("REGEX_TIMEOUT", "0.25"))
+
+# Registro di audit delle richieste (scritto in background a blocchi)
+AUDIT_LOG_ENABLED = os.getenv("AUDIT_LOG_ENABLED", "1") == "1"
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))
+# Coda piena: "block" attende AUDIT_BLOCK_TIMEOUT secondi e poi scrive in modo sincrono, "drop" scarta
+AUDIT_BACKPRESSURE = os.getenv("AUDIT_BACKPRESSURE", "block")
+AUDIT_BLOCK_TIMEOUT = float(os.getenv("AUDIT_BLOCK_TIMEOUT", "0.5"))
+
 # Ambiente
 ENV = os.getenv("ENV", "development")
+APP_RELEASE = os.getenv("APP_RELEASE", "dev")
+
+# Profilazione delle pagine (opt-in)
+PROFILING = os.getenv("PROFILING", "0") == "1"
+PROFILING_DIR = os.getenv("PROFILING_DIR", "profiling")
 
 if not POSTGRES_URL:
     raise RuntimeError("POSTGRES_URL non è impostata")
 
+if VECTORSTORE_LAYOUT not in ("per_patient", "shared"):
+    raise RuntimeError("VECTORSTORE_LAYOUT deve essere 'per_patient' o 'shared'")
+
+if VECTOR_BACKEND not in ("auto", "chroma"):
+    raise RuntimeError("VECTOR_BACKEND deve essere 'auto' o 'chroma'")
+
+if COMPACT_DTYPE not in ("float16", "int8"):
+    raise RuntimeError("COMPACT_DTYPE deve essere 'float16' o 'int8'")
+
+if COMPACT_CACHE_SIZE < 1:
+    raise RuntimeError("COMPACT_CACHE_SIZE deve essere almeno 1")
+
+if AUDIT_BACKPRESSURE not in ("block", "drop"):
+    raise RuntimeError("AUDIT_BACKPRESSURE deve essere 'block' o 'drop'")
+
+if LLM_DEFAULT_CONCURRENCY < 1:
+    raise RuntimeError("LLM_DEFAULT_CONCURRENCY deve essere almeno 1")
+
+if CHAT_HISTORY_RECENT < 1 or CHAT_HISTORY_PAGE_SIZE < 1:
+    raise RuntimeError("CHAT_HISTORY_RECENT e CHAT_HISTORY_PAGE_SIZE devono essere almeno 1")
+
+if SUMMARY_MAX_DOC_CHARS < 1000:
+    raise RuntimeError("SUMMARY_MAX_DOC_CHARS deve essere almeno 1000")
+
+if UPLOAD_STAGING_WORKERS < 1:
+    raise RuntimeError("UPLOAD_STAGING_WORKERS deve essere almeno 1")
+
+if COHORT_CONCURRENCY < 1:
+    raise RuntimeError("COHORT_CONCURRENCY deve essere almeno 1")
+
 if not OLLAMA_BASE_URL:
     raise RuntimeError("OLLAMA_BASE_URL non è impostata")
@@ -1,13 +1,9 @@
-from chromadb import Client
-from chromadb.config import Settings
+import chromadb
 
 def get_chroma_client(persist_directory="./chroma_db"):
     """
-    Restituisce un client Chroma aggiornato.
+    Restituisce un client Chroma persistente.
     persist_directory è la cartella dove salvare i dati del DB vettoriale.
+    Le impostazioni "duckdb+parquet" non sono più supportate da chromadb >= 0.4.
     """
-    client = Client(Settings(
-        chroma_db_impl="duckdb+parquet",
-        persist_directory=persist_directory
-    ))
-    return client
+    return chromadb.PersistentClient(path=persist_directory)
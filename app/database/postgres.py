@@ -1,3 +1,5 @@
+import threading
+
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -6,3 +8,23 @@ from app.config import POSTGRES_URL
 engine = create_engine(POSTGRES_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+
+_initialized = False
+_init_lock = threading.Lock()
+
+
+def init_db() -> None:
+    """
+    Crea le tabelle mancanti di tutti i modelli (checkfirst: quelle esistenti non vengono toccate).
+    Viene chiamata all'avvio dalla pagina di login e dagli script che usano il database, non
+    dai servizi; le chiamate successive alla prima nello stesso processo non fanno nulla.
+    """
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        # import locali: i modelli importano Base da questo modulo
+        from app.models import audit_log, chat_message, doc, patient_summary, user, validation_verdict  # noqa: F401
+
+        Base.metadata.create_all(bind=engine)
+        _initialized = True
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, DateTime, Float, Integer, JSON, String, Text
+from app.database.postgres import Base
+
+class AuditLog(Base):
+    __tablename__ = "audit_log"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime, nullable=False, index=True)
+    user_email = Column(String, nullable=True, index=True)
+    role = Column(String, nullable=True)
+    pazienti = Column(JSON, nullable=True)          # email dei pazienti coinvolti
+    query_redacted = Column(Text, nullable=True)    # domanda con i PII già oscurati
+    stages = Column(JSON, nullable=True)            # fase -> millisecondi
+    verdicts = Column(JSON, nullable=True)          # esiti dei controlli di sicurezza
+    total_ms = Column(Float, nullable=True)
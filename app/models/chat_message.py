@@ -0,0 +1,15 @@
+from sqlalchemy import Column, DateTime, Index, Integer, String, Text
+from app.database.postgres import Base
+
+class ChatMessage(Base):
+    """Messaggio della cronologia chat. La tabella è solo in append: i messaggi non vengono modificati."""
+    __tablename__ = "chat_messages"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_email = Column(String, nullable=False)
+    role = Column(String, nullable=False)           # "user" o "bot"
+    content = Column(Text, nullable=False)          # come mostrato in chat (PII già oscurati)
+    created_at = Column(DateTime, nullable=False)
+
+    # paginazione per chiave: ultimi messaggi dell'utente con id minore dell'ultimo mostrato
+    __table_args__ = (Index("ix_chat_messages_user_id", "user_email", "id"),)
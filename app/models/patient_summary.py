@@ -0,0 +1,12 @@
+from sqlalchemy import Column, DateTime, JSON, String, Text
+from app.database.postgres import Base
+
+class PatientSummary(Base):
+    __tablename__ = "patient_summaries"
+
+    paziente_email = Column(String, primary_key=True)
+    summary = Column(Text, nullable=False, default="")
+    doc_ids = Column(JSON, nullable=False, default=list)      # documenti già integrati nel riassunto
+    pii_terms = Column(JSON, nullable=False, default=list)    # stringhe PII presenti nel riassunto
+    model = Column(String, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
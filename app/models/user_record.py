@@ -0,0 +1,29 @@
+class UserRecord:
+    """
+    Copia leggera e staccata dalla sessione SQLAlchemy di un User,
+    da conservare in st.session_state al posto dell'istanza ORM.
+    """
+    __slots__ = (
+        "username", "email", "role", "nome", "cognome", "via", "numero_civico",
+        "citta", "cap", "data_nascita", "sesso", "medicoAssociato",
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_user(cls, user) -> "UserRecord":
+        """Copia i campi del profilo (esclusa la password) da un User o da un altro record."""
+        if user is None or isinstance(user, cls):
+            return user
+        return cls(**{name: getattr(user, name) for name in cls.__slots__})
+
+    def __eq__(self, other):
+        return isinstance(other, UserRecord) and self.email == other.email
+
+    def __hash__(self):
+        return hash(self.email)
+
+    def __repr__(self):
+        return f"UserRecord(email={self.email!r}, role={self.role!r})"
@@ -0,0 +1,11 @@
+from sqlalchemy import Boolean, Column, DateTime, String, Text
+from app.database.postgres import Base
+
+class ValidationVerdict(Base):
+    __tablename__ = "validation_verdicts"
+
+    sha256 = Column(String(64), primary_key=True)
+    validator_version = Column(String, nullable=False)
+    valid = Column(Boolean, nullable=False)
+    message = Column(Text, nullable=False, default="")
+    created_at = Column(DateTime, nullable=False)
@@ -1,8 +1,10 @@
 import streamlit as st
 from app.components.sidebar import sidebar
 from app.pages_custom.show_pazienti import show_pazienti
+from app.services.profiler import profiled_page
 
 
+@profiled_page("area_personale")
 def area_personale(user, db):
     # --- Protezione accesso ---
     if "logged_in" not in st.session_state or not st.session_state.logged_in:
@@ -1,289 +1,184 @@
 import streamlit as st
-import os, difflib
-import ollama
-from ollama import chat
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from sqlalchemy.orm import Session
 from app.components.sidebar import sidebar
-from app.models.user import User
-from app.security_components.check_therapy import is_therapy_related
-from app.security_components.PII_obfuscation import obscure_pii
-from app.security_components.prompt_sanitizer import sanitize_user_prompt
-from app.config import OLLAMA_BASE_URL
-
-
-ollama.base_url =  OLLAMA_BASE_URL
-class OllamaWrapper:
-    def __init__(self, model_name):
-        self.model_name = model_name
-
-    def __call__(self, prompt):
-        resp = chat(
-            model=self.model_name,
-            messages=[{"role": "user", "content": prompt}],
-            stream=False
-        )
-        return [{"generated_text": resp["message"]["content"]}]
-
-    def reset(self):
-        pass
-
-
-@st.cache_resource
-def load_model():
-    return OllamaWrapper(model_name="mistral")
-
-
-def load_vectorstore(email_paziente):
-    persist_dir = os.path.join("chroma_db", email_paziente)
-    if not os.path.exists(persist_dir):
-        return None
-    embeddings = HuggingFaceEmbeddings(
-        model_name="intfloat/multilingual-e5-large",
-        encode_kwargs={"normalize_embeddings": True}
-    )
-    vectorstore = Chroma(
-        persist_directory=persist_dir,
-        embedding_function=embeddings,
-        collection_name="docs"
-    )
-    return vectorstore
-
-
-def get_pazienti_del_medico(email_medico: str, db: Session):
-    return db.query(User).filter(User.medicoAssociato == email_medico).all()
-
-
-def build_rag_prompt(query, retrieved_docs, pazienti_coinvolti=None, contains_therapy: bool = False):
-    context = "\n\n".join(retrieved_docs) if retrieved_docs else "(Nessun documento rilevante trovato.)"
-    patient_info = f"\nPazienti coinvolti: {pazienti_coinvolti}." if pazienti_coinvolti else ""
-
-    if contains_therapy:
-        therapy_instruction = (
-            "Nei documenti forniti ci sono informazioni su terapie o trattamenti. "
-            "Se rispondi citando una terapia, riporta esclusivamente quanto presente nei documenti "
-            "e indica chiaramente la fonte o il referto da cui proviene l'informazione."
-        )
+from app.config import CHAT_REFRESH_INTERVAL
+from app.services.admission import RateLimited
+from app.services.chat_context import get_chat_context
+from app.services.chat_history import OLDER_PAGE_SIZE, get_chat_history
+from app.services.chat_service import (  # noqa: F401 (riesportati per compatibilità)
+    OllamaWrapper,
+    answer_question,
+    build_rag_prompt,
+    extract_clinical_event,
+    get_pazienti_del_medico,
+    identify_multiple_pazienti_in_query,
+    load_model,
+)
+from app.services.cohort_service import summary, table
+from app.services.generation_tasks import (
+    STATE_KEY,
+    get_cohort_task,
+    get_generation_task,
+    start_cohort,
+    start_generation,
+)
+from app.services.profiler import profile_component, profiled_page
+
+CANCELLED_MESSAGE = "⏹️ Risposta interrotta."
+CHAT_MODE = "💬 Domanda sui pazienti citati"
+COHORT_MODE = "📊 Domanda su tutti gli assistiti"
+
+
+def render_chat_turn(role, msg):
+    if role == "user":
+        st.markdown(f"🧑‍⚕️ **Tu:** {msg}")
     else:
-        therapy_instruction = (
-            "ATTENZIONE: nei documenti forniti non risultano informazioni su terapie o farmaci. "
-            "Non proporre né inventare terapie, farmaci, dosaggi o prescrizioni. "
-            "Limita la risposta a informazioni diagnostiche, descrittive o di follow-up presenti nel contesto."
-        )
-
-    prompt = f"""
-            Sei un infermiere virtuale che assiste un medico. Rispondi in modo chiaro, professionale e conservativo.
-            {patient_info}
-
-            {therapy_instruction}
-
-            Contesto (da usare esclusivamente per rispondere; non aggiungere informazioni esterne):
-            {context}
+        st.markdown(f"🤖 **MyNurseAI:** {msg}")
 
-            Domanda del medico/paziente:
-            {query}
 
-            Istruzioni di formato:
-            - Rispondi solo con informazioni presenti nel contesto.
-            - Se non trovi informazioni pertinenti, rispondi esplicitando che nei documenti non sono presenti dati utili.
-            - Non includere consigli farmacologici o terapie se non esplicitamente presenti nei documenti.
-            - Se citi parti dei documenti, indica brevemente la loro fonte (es. "Da referto del DD/MM/YYYY").
+def _finish(task, history):
+    """Porta in cronologia il turno concluso (il record di audit lo scrive già il task)."""
+    st.session_state.pop(STATE_KEY, None)
+    if task.error is not None:
+        st.session_state.chat_error = f"Errore durante la generazione della risposta: {task.error}"
+        return
+    result = task.result
+    history.extend([("user", result.user_message),
+                    ("bot", CANCELLED_MESSAGE if task.cancelled else result.response)])
+    if result.warning and not task.cancelled:
+        # mostrato dopo il rerun, sopra la cronologia
+        st.session_state.chat_warning = result.warning
 
-            Risposta:
-"""
-    return prompt
 
-
-def identify_multiple_pazienti_in_query(query, pazienti):
-    query_lower = query.lower()
-    found = []
-
-    for p in pazienti:
-        fullname = f"{p.nome.lower()} {p.cognome.lower()}"
-        if fullname in query_lower:
-            found.append(p)
-
-    # Fuzzy search aggiuntiva
-    if not found:
-        names = [f"{p.nome.lower()} {p.cognome.lower()}" for p in pazienti]
-        match = difflib.get_close_matches(query_lower, names, n=2, cutoff=0.6)
-        for m in match:
-            for p in pazienti:
-                if f"{p.nome.lower()} {p.cognome.lower()}" == m:
-                    found.append(p)
-
-    return list(set(found))
-
-
-def extract_clinical_event(query: str):
+def _chat_area(user_email):
     """
-    Estrae le keyword cliniche principali dalla query, invece di tutta la frase.
-    Restituisce una lista di keyword o eventi clinici.
+    Cronologia e risposta in corso. Mentre un turno è in generazione è l'unica parte
+    della pagina che si aggiorna (fragment): sidebar, elenco pazienti e resto della
+    pagina non vengono rieseguiti a ogni token. Della cronologia si mostrano solo gli
+    ultimi messaggi; i precedenti vengono letti dal database a pagine, su richiesta.
     """
-    q = query.lower()
-    keywords = ["visita", "controllo", "referto", "esame", "ecografia", "analisi", "terapia", "farmacologica",
-                "farmaco"]
+    history = get_chat_history(st.session_state, user_email)
+    task = get_generation_task(st.session_state)
+    if task is not None and task.done:
+        _finish(task, history)
+        # un solo rerun completo a fine turno, per fermare l'aggiornamento periodico
+        st.rerun()
 
-    events = []
-    for word in keywords:
-        if word in q:
-            events.append(word)
-    return events if events else None
+    # --- Messaggi più vecchi: caricati dal database solo su richiesta ---
+    older_shown = min(st.session_state.get("chat_older_shown", 0), history.paged_out)
+    if older_shown < history.paged_out:
+        if st.button(f"⬆️ Mostra messaggi precedenti ({history.paged_out - older_shown})"):
+            older_shown = min(older_shown + OLDER_PAGE_SIZE, history.paged_out)
+    st.session_state.chat_older_shown = older_shown
+
+    with profile_component("cronologia chat"):
+        for role, msg in history.older(older_shown):
+            render_chat_turn(role, msg)
+        for role, msg in history:
+            render_chat_turn(role, msg)
+
+    if task is not None:
+        task.touch()
+        render_chat_turn("user", task.question if task.result is None else task.result.user_message)
+        if task.preview:
+            render_chat_turn("bot", task.preview + " ▌")
+        else:
+            st.caption("L'infermiere sta cercando nei documenti...")
+        if st.button("⏹️ Interrompi", key="chat_cancel"):
+            task.cancel()
+
+
+def _cohort_area():
+    """Avanzamento e tabella (parziale) della domanda di coorte; si aggiorna da sola finché è in corso."""
+    task = get_cohort_task(st.session_state)
+    if task is None:
+        return
+    if task.done and st.session_state.get("cohort_polling"):
+        # un rerun completo a fine elaborazione, per fermare l'aggiornamento periodico
+        st.rerun()
+    task.touch()
+
+    rows = list(task.rows)
+    st.markdown(f"**Domanda:** {task.query_redacted or task.question}")
+    st.progress(len(rows) / task.total if task.total else 1.0,
+                text=f"{len(rows)} di {task.total} pazienti elaborati")
+    counts = summary(rows)
+    if counts:
+        st.caption(" · ".join(f"{esito}: {n}" for esito, n in counts.items()))
+    if rows:
+        st.dataframe(table(rows), hide_index=True, use_container_width=True)
+
+    if task.error is not None:
+        st.error(f"Errore durante la domanda di coorte: {task.error}")
+    elif task.done and task.cancelled:
+        st.info("⏹️ Elaborazione interrotta: la tabella contiene i risultati parziali.")
+    elif not task.done and st.button("⏹️ Interrompi", key="cohort_cancel"):
+        task.cancel()
+
+
+def _cohort_page(db, user):
+    with profile_component("query pazienti"):
+        pazienti = get_pazienti_del_medico(user.email, db)
+    if not pazienti:
+        st.info("Non ci sono pazienti associati a questo medico.")
+        return
+
+    labels = {f"{p.nome} {p.cognome} — {p.email}": p for p in pazienti}
+    scelti = st.multiselect("Limita ai pazienti (vuoto = tutti gli assistiti):", list(labels), key="cohort_filter")
+    question = st.text_input("Domanda da porre per ogni paziente:", value="", key="cohort_input",
+                             placeholder="Es. Ha un'ecografia in attesa di esecuzione?")
+
+    if st.button("📊 Chiedi a tutti"):
+        if not question.strip():
+            st.warning("Inserisci una domanda prima di inviare.")
+        else:
+            coorte = [labels[label] for label in scelti] or pazienti
+            try:
+                start_cohort(st.session_state, user, coorte, question)
+            except RateLimited as e:
+                st.warning(str(e))
+
+    task = get_cohort_task(st.session_state)
+    running = task is not None and not task.done
+    st.session_state.cohort_polling = running
+    st.fragment(_cohort_area, run_every=CHAT_REFRESH_INTERVAL if running else None)()
 
 
+@profiled_page("ask_chatbot")
 def ask_chatbot(db, user):
     sidebar(user)
 
     st.title("💬 Chat con il tuo infermiere virtuale")
 
-    chatbot = load_model()
-
     if user.role == "Medico":
-        pazienti = get_pazienti_del_medico(user.email, db)
-    else:
-        pazienti = [user]
-
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
+        mode = st.radio("Modalità", [CHAT_MODE, COHORT_MODE], horizontal=True, key="chat_mode",
+                        label_visibility="collapsed")
+        if mode == COHORT_MODE:
+            _cohort_page(db, user)
+            return
 
-    for role, msg in st.session_state.chat_history:
-        if role == "user":
-            st.markdown(f"🧑‍⚕️ **Tu:** {msg}")
-        else:
-            st.markdown(f"🤖 **MyNurseAI:** {msg}")
+    for key, show in (("chat_warning", st.warning), ("chat_error", st.error)):
+        message = st.session_state.pop(key, None)
+        if message:
+            show(message)
 
     user_input = st.text_input("Scrivi la tua domanda:", value="", key="chat_input")
 
     if st.button("💬 Invia"):
         if not user_input.strip():
             st.warning("Inserisci un messaggio prima di inviare.")
-            return
-
-        processed_input = obscure_pii(user_input)
-        sanitized_input = sanitize_user_prompt(processed_input)
-
-        if user.role == "Paziente":
-            if sanitized_input == "error":
-                st.session_state.chat_history.append(("user", user_input))
-                response = "⚠️ Il messaggio contiene istruzioni non consentite o sospette. Riformula la domanda."
-                st.session_state.chat_history.append(("bot", response))
-                return
-
-        if sanitized_input == "warning":
-            st.warning("⚠️ Il messaggio potrebbe contenere contenuti sospetti. Procedi con cautela.")
-
-        # continua con la generazione della risposta usando sanitized_input
-        st.session_state.chat_history.append(("user", processed_input))
-
-        with st.spinner("L'infermiere sta cercando nei documenti..."):
-            response = None
-
+        else:
             if user.role == "Medico":
-                selected_pazienti = identify_multiple_pazienti_in_query(processed_input, pazienti)
-
-                if not selected_pazienti:
-                    response = (
-                        "Non ho trovato riferimenti chiari a pazienti tra i tuoi assistiti. "
-                        "Specificami il nome completo del paziente o dei pazienti a cui ti riferisci."
-                    )
-                    st.session_state.chat_history.append(("bot", response))
-                    return
-
-                all_docs = []
-                pazienti_con_vectorstore = []
-
-                for p in selected_pazienti:
-                    vs = load_vectorstore(p.email)
-                    if vs is None:
-                        continue
-
-                    pazienti_con_vectorstore.append(p)
-                    retriever = vs.as_retriever(search_kwargs={"k": 3})
-                    docs = retriever.invoke(sanitized_input)
-                    all_docs.extend(docs)
-
-                if not pazienti_con_vectorstore:
-                    response = "Non ho trovato documenti clinici per nessuno dei pazienti menzionati."
-                    st.session_state.chat_history.append(("bot", response))
-                    return
-
-                retrieved_texts = [d.page_content for d in all_docs]
-                context = "\n\n".join(retrieved_texts)
-
-                contains_therapy = is_therapy_related(context)
-
-                event_requested = extract_clinical_event(processed_input)
-
-                if event_requested:
-                    found_in_context = any(any(ev in doc.lower() for ev in event_requested) for doc in retrieved_texts)
-
-                    if not found_in_context:
-                        response = (
-                            f"📄 Nei documenti disponibili non risultano informazioni relative a '{event_requested}'. "
-                            "Non posso fornirti dettagli su questo evento clinico."
-                        )
-                        st.session_state.chat_history.append(("bot", response))
-                        st.rerun()
-                        return
-
-                pazienti_nomi = ", ".join([f"{p.nome} {p.cognome}" for p in pazienti_con_vectorstore])
-                rag_prompt = build_rag_prompt(processed_input,
-                                              retrieved_texts,
-                                              pazienti_coinvolti=pazienti_nomi,
-                                              contains_therapy=contains_therapy)
-
-                raw_response = chatbot(rag_prompt)[0]["generated_text"]
-                response = obscure_pii(raw_response)
-
-                query_is_therapy = is_therapy_related(sanitized_input)
-
-                if query_is_therapy and not contains_therapy:
-                    response = (
-                        "⚠️ Nei documenti recuperati non sono presenti indicazioni terapeutiche. "
-                        "Posso fornirti solo informazioni cliniche generali, non terapie."
-                    )
-
-            else:  # Se paziente
-                paziente_email = user.email
-                vectorstore = load_vectorstore(paziente_email)
-
-                if vectorstore is None:
-                    response = "Non ho trovato informazioni nei tuoi documenti."
-                else:
-                    retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
-                    docs = retriever.invoke(processed_input)
-                    retrieved_texts = [d.page_content for d in docs]
-                    context = "\n\n".join(retrieved_texts)
-                    contains_therapy = is_therapy_related(context)
-
-                    event_requested = extract_clinical_event(processed_input)
-                    if event_requested:
-                        found_in_context = any(
-                            event in doc.lower() for event in event_requested for doc in retrieved_texts)
-                        if not found_in_context:
-                            response = (
-                                f"📄 Nei documenti presenti non risultano informazioni relative a '{event_requested}'. "
-                                "Non posso fornirti dettagli su questo evento clinico."
-                            )
-                            st.session_state.chat_history.append(("bot", response))
-                            st.rerun()
-                            return
-
-                    if not retrieved_texts:
-                        response = "Non ho trovato informazioni utili nei tuoi documenti per rispondere alla domanda."
-                    else:
-                        rag_prompt = build_rag_prompt(processed_input, retrieved_texts,
-                                                      contains_therapy=contains_therapy)
-                        raw_response = chatbot(rag_prompt)[0]["generated_text"]
-                        response = obscure_pii(raw_response)
-                        query_is_therapy = is_therapy_related(processed_input)
-                        if query_is_therapy and not contains_therapy:
-                            response = (
-                                "⚠️ Nei documenti consultati non sono presenti indicazioni terapeutiche. "
-                                "Posso riportare solo informazioni cliniche generali relative al caso, "
-                                "ma non dettagli su trattamenti o farmaci."
-                            )
-
-        st.session_state.chat_history.append(("bot", response))
-        st.rerun()
+                with profile_component("query pazienti"):
+                    # solo all'invio: i rerun della chat non interrogano più il database
+                    pazienti = get_pazienti_del_medico(user.email, db)
+            else:
+                pazienti = [user]
+            # le domande successive sugli stessi pazienti proseguono la conversazione col modello;
+            # un turno ancora in corso viene annullato
+            try:
+                start_generation(st.session_state, user, pazienti, user_input, get_chat_context(st.session_state))
+            except RateLimited as e:
+                st.warning(str(e))
+
+    running = get_generation_task(st.session_state) is not None
+    st.fragment(_chat_area, run_every=CHAT_REFRESH_INTERVAL if running else None)(user.email)
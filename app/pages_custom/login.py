@@ -1,11 +1,16 @@
 import time
 import streamlit as st
+from app.database.postgres import init_db
 from app.models.user import User
+from app.models.user_record import UserRecord
 from app.services.auth_service import verify_password
 from app.pages_custom.registrazione import register_page
 from app.pages_custom.area_personale import area_personale
 
 def login_page(db):
+    # --- Tabelle del database (solo alla prima esecuzione del processo) ---
+    init_db()
+
     # --- Inizializza lo stato ---
     if "show_register" not in st.session_state:
         st.session_state.show_register = False
@@ -23,7 +28,7 @@ def login_page(db):
         user = db.query(User).filter(User.email == email_param).first()
         if user:
             st.session_state.logged_in = True
-            st.session_state.user = user
+            st.session_state.user = UserRecord.from_user(user)
             st.rerun()
 
     # --- Se loggato, mostra area personale ---
@@ -70,7 +75,7 @@ def login_page(db):
 
         # ✅ Login riuscito
         st.session_state.logged_in = True
-        st.session_state.user = user
+        st.session_state.user = UserRecord.from_user(user)
 
         # ✅ Nuovo modo per impostare i query params
         st.query_params["email"] = user.email
@@ -1,14 +1,18 @@
 import streamlit as st
 from app.components.sidebar import sidebar
 from app.models.doc import Doc
+from app.services.profiler import profile_component, profiled_page
 
+
+@profiled_page("show_docs")
 def show_docs(db, user):
     sidebar(user)
 
     st.title(f"📄 Documenti di {user.nome} {user.cognome}")
 
     # --- Lista documenti ---
-    docs = db.query(Doc).filter(Doc.paziente_email == user.email).all()
+    with profile_component("query documenti"):
+        docs = db.query(Doc).filter(Doc.paziente_email == user.email).all()
     if not docs:
         st.info("Non ci sono documenti caricati per questo paziente.")
         return
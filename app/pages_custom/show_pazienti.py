@@ -2,17 +2,22 @@ import streamlit as st
 
 from app.components.sidebar import sidebar
 from app.models.user import User
+from app.models.user_record import UserRecord
+from app.services.profiler import profile_component, profiled_page
 
+
+@profiled_page("show_pazienti")
 def show_pazienti(db, user):
     sidebar(user)
 
     st.title("🧍‍♂️ Pazienti associati")
     st.markdown(f"### Lista dei pazienti associati a: **{user.username}**")
 
-    pazienti = db.query(User).filter(
-        User.medicoAssociato == user.email,
-        User.role == "Paziente"
-    ).all()
+    with profile_component("query pazienti"):
+        pazienti = db.query(User).filter(
+            User.medicoAssociato == user.email,
+            User.role == "Paziente"
+        ).all()
 
     if not pazienti:
         st.info("Non ci sono pazienti associati a questo medico.")
@@ -29,7 +34,7 @@ def show_pazienti(db, user):
         with col2:
             if st.button("📤", key=f"upload_{p.email}", help="Vai ai documenti del paziente"):
                 st.session_state.current_page = "upload_docs"
-                st.session_state.selected_paziente = p
+                st.session_state.selected_paziente = UserRecord.from_user(p)
                 st.rerun()
 
         if i < len(pazienti) - 1:
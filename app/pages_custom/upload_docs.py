@@ -1,21 +1,12 @@
 import streamlit as st
 from app.components.sidebar import sidebar
-import io
-import os
-from PyPDF2 import PdfReader
 from app.models.doc import Doc
-
-# Import corretto in base alla versione di LangChain
-try:
-    from langchain.text_splitters import CharacterTextSplitter
-except ModuleNotFoundError:
-    from langchain.text_splitter import CharacterTextSplitter
-
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from app.security_components.doc_validation import validate_pdf_content
+from app.services.admission import ACTION_UPLOAD, RateLimited, admit
+from app.services.upload_service import ingest_document
+from app.services.profiler import profile_component, profiled_page
 
 
+@profiled_page("upload_docs")
 def upload_docs(db, user):
     sidebar(user)
 
@@ -32,22 +23,6 @@ def upload_docs(db, user):
     if patient_flag_key not in st.session_state:
         st.session_state[patient_flag_key] = False
 
-    # --- Cartella paziente per ChromaDB ---
-    persist_dir = os.path.join("chroma_db", p.email)
-    os.makedirs(persist_dir, exist_ok=True)
-
-    # --- Carica o crea vectorstore ---
-    embeddings = HuggingFaceEmbeddings(
-        model_name="intfloat/multilingual-e5-large",
-        encode_kwargs={"normalize_embeddings": True}
-    )
-
-    vectorstore = Chroma(
-        persist_directory=persist_dir,
-        embedding_function=embeddings,
-        collection_name="docs"
-    )
-
     # --- Upload PDF ---
     uploaded_file = st.file_uploader("Carica un nuovo documento", type=["pdf"])
     if uploaded_file is not None:
@@ -61,42 +36,28 @@ def upload_docs(db, user):
 
         st.session_state[processing_key] = True
         try:
+            admit(ACTION_UPLOAD, user)
             file_bytes = uploaded_file.read()
 
-            # --- VALIDAZIONE PDF ---
-            valid, message = validate_pdf_content(file_bytes)
-            if not valid:
-                st.error(f"Upload rifiutato: {message}")
+            # --- Validazione, salvataggio su PostgreSQL e indicizzazione su ChromaDB ---
+            with profile_component("upload"):
+                result = ingest_document(db, p.email, uploaded_file.name, file_bytes, uploader=user)
+            if not result.valid:
+                st.error(f"Upload rifiutato: {result.message}")
                 st.session_state[processing_key] = False
                 return
 
-            # Salva su PostgreSQL
-            new_doc = Doc(
-                filename=uploaded_file.name,
-                paziente_email=p.email,
-                file_data=file_bytes
-            )
-            db.add(new_doc)
-            db.commit()
             st.success(f"Documento '{uploaded_file.name}' caricato con successo!")
 
-            # Salva su ChromaDB
-            try:
-                reader = PdfReader(io.BytesIO(file_bytes))
-                text = "".join([page.extract_text() or "" for page in reader.pages])
-
-                text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
-                chunks = text_splitter.split_text(text)
-
-                if chunks:
-                    vectorstore.add_texts(texts=chunks)
-                    vectorstore.persist()
-                    st.success(f"Documento '{uploaded_file.name}' indicizzato su ChromaDB!")
-                else:
-                    st.warning("Il PDF non contiene testo estraibile per l'indicizzazione.")
+            if result.index_error:
+                st.error(f"Errore durante il salvataggio su ChromaDB: {result.index_error}")
+            elif result.n_chunks:
+                st.success(f"Documento '{uploaded_file.name}' indicizzato su ChromaDB!")
+            else:
+                st.warning("Il PDF non contiene testo estraibile per l'indicizzazione.")
 
-            except Exception as e:
-                st.error(f"Errore durante il salvataggio su ChromaDB: {e}")
+        except RateLimited as e:
+            st.warning(str(e))
 
         except Exception as e:
             st.error(f"Errore durante l'upload: {e}")
@@ -105,7 +66,8 @@ def upload_docs(db, user):
             st.session_state[processing_key] = False
 
     # --- Lista documenti ---
-    docs = db.query(Doc).filter(Doc.paziente_email == p.email).all()
+    with profile_component("query documenti"):
+        docs = db.query(Doc).filter(Doc.paziente_email == p.email).all()
     if not docs:
         st.info("Non ci sono documenti caricati per questo paziente.")
         return
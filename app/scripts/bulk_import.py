@@ -0,0 +1,353 @@
+"""
+Import massivo di referti PDF.
+
+Uso (dalla radice del progetto):
+
+    # una sottocartella per paziente: referti/<paziente_email>/*.pdf
+    python -m app.scripts.bulk_import --dir referti/
+
+    # manifest CSV con colonne filename,paziente_email
+    python -m app.scripts.bulk_import --manifest manifest.csv
+
+Estrazione e validazione girano in un process pool, gli embedding vengono
+calcolati a blocchi grandi e ogni vectorstore paziente viene scritto una sola
+volta per blocco. I file già elaborati sono registrati nel file di stato, per
+cui un import interrotto può essere ripreso rilanciando lo stesso comando.
+Le chiamate LLM della validazione rispettano il limite "validazione" del controllo
+di ammissione una volta per tutto l'import, non una per worker.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from app.database.postgres import SessionLocal, init_db
+from app.models.doc import Doc
+from app.config import ADMISSION_ENABLED, ADMISSION_ROLE_LIMITS, ADMISSION_USER_LIMITS
+from app.models.user import User
+from app.security_components.doc_validation import validate_pdf_content
+from app.security_components.pii_index import pii_metadata
+from app.services import admission
+from app.services.deadline import BudgetExceeded, Deadline
+from app.services.index_versions import building_spec
+from app.services.pdf_extraction import extract_text
+from app.services.vectorstore_service import add_chunks, chunk_ids, embed_texts, split_text
+
+DEFAULT_STATE_FILE = ".bulk_import_state.jsonl"
+
+
+def collect_jobs_from_dir(root: str) -> List[Tuple[str, str]]:
+    """Restituisce le coppie (percorso, paziente_email) da root/<email>/*.pdf"""
+    jobs = []
+    for email in sorted(os.listdir(root)):
+        patient_dir = os.path.join(root, email)
+        if not os.path.isdir(patient_dir):
+            continue
+        for name in sorted(os.listdir(patient_dir)):
+            if name.lower().endswith(".pdf"):
+                jobs.append((os.path.join(patient_dir, name), email))
+    return jobs
+
+
+def collect_jobs_from_manifest(manifest_path: str) -> List[Tuple[str, str]]:
+    """Legge un CSV filename,paziente_email (percorsi relativi al manifest)"""
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = []
+    with open(manifest_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            path = row["filename"].strip()
+            if not os.path.isabs(path):
+                path = os.path.join(base_dir, path)
+            jobs.append((path, row["paziente_email"].strip()))
+    return jobs
+
+
+def load_state(state_path: str) -> Set[str]:
+    """Hash dei file già importati o scartati in esecuzioni precedenti."""
+    done = set()
+    if not os.path.exists(state_path):
+        return done
+    with open(state_path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entry = json.loads(line)
+                done.add(f"{entry['paziente_email']}:{entry['sha256']}")
+    return done
+
+
+class SharedRateLimit:
+    """
+    Token bucket in memoria condivisa tra i worker dell'import, per le chiamate di
+    validazione: con N worker il modello riceve comunque al massimo il ritmo configurato,
+    mentre un AdmissionController per processo lo moltiplicherebbe per N.
+    Ha l'interfaccia usata da admission.wait_turn; le altre azioni non sono limitate.
+    """
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self._lock = multiprocessing.Lock()
+        # token disponibili e istante dell'ultimo aggiornamento (time.monotonic è comune ai processi)
+        self._state = multiprocessing.RawArray("d", [float(capacity), time.monotonic()])
+
+    def _try_take(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(self.capacity, self._state[0] + (now - self._state[1]) * self.rate)
+            self._state[1] = now
+            if tokens >= 1:
+                self._state[0] = tokens - 1
+                return 0.0
+            self._state[0] = tokens
+            return (1 - tokens) / self.rate
+
+    def wait_turn(self, action: str, user: str, role: Optional[str], deadline: Optional[Deadline] = None) -> float:
+        if action != admission.ACTION_VALIDATION:
+            return 0.0
+        started = time.monotonic()
+        while True:
+            wait = self._try_take()
+            if wait == 0:
+                return time.monotonic() - started
+            if deadline is not None and wait > deadline.remaining():
+                raise BudgetExceeded(f"{action}: troppe richieste, token disponibile tra {wait:.1f} s")
+            time.sleep(wait)
+
+    def stats(self) -> dict:
+        return {}
+
+
+def validation_rate_limit() -> Optional[SharedRateLimit]:
+    """Limite condiviso per la validazione dei worker (utente anonimo), None se non configurato."""
+    if not ADMISSION_ENABLED:
+        return None
+    found = [admission.AdmissionController._limit(admission.parse_rate_limits(spec), admission.ACTION_VALIDATION, None)
+             for spec in (ADMISSION_USER_LIMITS, ADMISSION_ROLE_LIMITS)]
+    limits = [limit for limit in found if limit]
+    if not limits:
+        return None
+    # il più restrittivo tra limite per utente e per ruolo
+    capacity, period = min(limits, key=lambda limit: limit[0] / limit[1])
+    return SharedRateLimit(capacity, period)
+
+
+def _init_worker(rate_limit: Optional[SharedRateLimit]) -> None:
+    if rate_limit is not None:
+        admission.set_controller(rate_limit)
+
+
+def _extract_and_validate(job: Tuple[str, str, bool]) -> dict:
+    """Worker del process pool: legge, valida ed estrae i chunk di un PDF (con i relativi PII)."""
+    path, email, validate = job
+    result = {"path": path, "paziente_email": email, "sha256": None, "status": "ok", "message": "",
+              "chunks": [], "pii": []}
+    try:
+        with open(path, "rb") as f:
+            file_bytes = f.read()
+        result["sha256"] = hashlib.sha256(file_bytes).hexdigest()
+
+        if validate:
+            valid, message = validate_pdf_content(file_bytes)
+            if not valid:
+                result["status"] = "rejected"
+                result["message"] = message
+                return result
+
+        result["chunks"] = split_text(extract_text(file_bytes))
+        result["pii"] = pii_metadata(result["chunks"])
+    except Exception as e:
+        result["status"] = "error"
+        result["message"] = str(e)
+    return result
+
+
+class BulkImporter:
+    def __init__(self, db, state_path: str, embed_batch: int, progress_every: int):
+        self.db = db
+        self.state_path = state_path
+        self.embed_batch = embed_batch
+        self.progress_every = progress_every
+        self.pending: List[Tuple[str, List[dict]]] = []
+        self.pending_chunks = 0
+        self.stats = {"file": 0, "importati": 0, "scartati": 0, "errori": 0, "chunk": 0}
+        self.started = time.perf_counter()
+
+    def _record(self, entries: List[dict]) -> None:
+        with open(self.state_path, "a", encoding="utf-8") as f:
+            for e in entries:
+                f.write(json.dumps({
+                    "paziente_email": e["paziente_email"],
+                    "sha256": e["sha256"],
+                    "path": e["path"],
+                    "status": e["status"],
+                    "message": e["message"]
+                }) + "\n")
+
+    def report(self, final: bool = False) -> None:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        s = self.stats
+        print(
+            f"[bulk_import] {s['file']} file ({s['importati']} importati, {s['scartati']} scartati, "
+            f"{s['errori']} errori) | {s['file'] / elapsed:.1f} file/s, {s['chunk'] / elapsed:.1f} chunk/s"
+            + (f" | totale {elapsed:.1f}s" if final else ""),
+            flush=True
+        )
+
+    def handle(self, result: dict) -> None:
+        """Riceve i risultati dei worker, già raggruppati per paziente."""
+        self.stats["file"] += 1
+        if result["status"] != "ok":
+            key = "scartati" if result["status"] == "rejected" else "errori"
+            self.stats[key] += 1
+            print(f"  ✗ {result['path']}: {result['message']}", file=sys.stderr)
+            if result["sha256"]:
+                self._record([result])
+        else:
+            email = result["paziente_email"]
+            if not self.pending or self.pending[-1][0] != email:
+                self.pending.append((email, []))
+            self.pending[-1][1].append(result)
+            self.pending_chunks += len(result["chunks"])
+            # anche a metà di un paziente: un paziente con migliaia di PDF non resta tutto in memoria
+            # e un'interruzione perde al massimo un blocco
+            if self.pending_chunks >= self.embed_batch:
+                self.flush()
+
+        if self.stats["file"] % self.progress_every == 0:
+            self.report()
+
+    def flush(self) -> None:
+        """Calcola in un colpo gli embedding del blocco e scrive ogni paziente una volta."""
+        if not self.pending:
+            return
+        all_chunks = [c for _, results in self.pending for r in results for c in r["chunks"]]
+        vectors = embed_texts(all_chunks, batch_size=self.embed_batch) if all_chunks else []
+
+        offset = 0
+        for email, results in self.pending:
+            docs = []
+            for r in results:
+                with open(r["path"], "rb") as f:
+                    docs.append(Doc(filename=os.path.basename(r["path"]), paziente_email=email, file_data=f.read()))
+            self.db.add_all(docs)
+            self.db.flush()
+
+            texts, ids, metadatas = [], [], []
+            for r, doc in zip(results, docs):
+                n = len(r["chunks"])
+                texts.extend(r["chunks"])
+                ids.extend(chunk_ids(r["sha256"], n))
+                metadatas.extend([{"doc_id": doc.id, "filename": doc.filename, **pii} for pii in r["pii"]])
+            add_chunks(email, texts, ids=ids, metadatas=metadatas, vectors=vectors[offset:offset + len(texts)])
+            offset += len(texts)
+
+            self.db.commit()
+            self._record(results)
+            self.stats["importati"] += len(results)
+            self.stats["chunk"] += len(texts)
+
+        self.pending = []
+        self.pending_chunks = 0
+
+
+def _filter_jobs(jobs: List[Tuple[str, str]], db, done: Set[str],
+                 skipped: Counter) -> Iterator[Tuple[str, str]]:
+    """
+    Scarta i pazienti inesistenti e i file già importati, riconosciuti dallo SHA-256 del
+    contenuto (file di stato o documento già presente con lo stesso nome e lo stesso
+    contenuto). Un file con il nome di un documento esistente ma contenuto diverso viene
+    importato. In skipped vengono contati i file scartati per motivo.
+    """
+    emails = sorted({email for _, email in jobs})
+    pazienti = {
+        u.email for u in db.query(User.email).filter(User.email.in_(emails), User.role == "Paziente")
+    }
+    existing: Dict[Tuple[str, str], List[int]] = {}
+    for doc_id, email, filename in db.query(Doc.id, Doc.paziente_email, Doc.filename).filter(
+            Doc.paziente_email.in_(emails)):
+        existing.setdefault((email, filename), []).append(doc_id)
+    existing_hashes: Dict[Tuple[str, str], Set[str]] = {}
+
+    for path, email in jobs:
+        if email not in pazienti:
+            print(f"  ✗ {path}: paziente '{email}' inesistente", file=sys.stderr)
+            skipped["paziente inesistente"] += 1
+            continue
+        with open(path, "rb") as f:
+            sha = hashlib.sha256(f.read()).hexdigest()
+        if f"{email}:{sha}" in done:
+            skipped["già importati"] += 1
+            continue
+        key = (email, os.path.basename(path))
+        if key in existing:
+            # solo per i nomi già presenti si leggono i PDF salvati per confrontarne il contenuto
+            if key not in existing_hashes:
+                existing_hashes[key] = {
+                    hashlib.sha256(data).hexdigest()
+                    for (data,) in db.query(Doc.file_data).filter(Doc.id.in_(existing[key]))
+                }
+            if sha in existing_hashes[key]:
+                skipped["già presenti"] += 1
+                continue
+            skipped["stesso nome, contenuto diverso (importati)"] += 1
+        yield path, email
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Import massivo di referti PDF per paziente.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dir", help="cartella con una sottocartella per paziente_email")
+    source.add_argument("--manifest", help="CSV con colonne filename,paziente_email")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="processi per estrazione e validazione")
+    parser.add_argument("--embed-batch", type=int, default=512, help="chunk per blocco di embedding")
+    parser.add_argument("--state", default=DEFAULT_STATE_FILE, help="file di stato per la ripresa")
+    parser.add_argument("--no-validation", action="store_true", help="salta validate_pdf_content")
+    parser.add_argument("--progress-every", type=int, default=25, help="file tra due report di avanzamento")
+    args = parser.parse_args(argv)
+
+    if building_spec() is not None:
+        print("[bulk_import] re-indexing in corso: i nuovi documenti entreranno nella nuova versione "
+              "con il passaggio di recupero finale del re-indexer.")
+
+    jobs = collect_jobs_from_dir(args.dir) if args.dir else collect_jobs_from_manifest(args.manifest)
+    jobs.sort(key=lambda j: j[1])
+
+    init_db()
+    db = SessionLocal()
+    try:
+        skipped = Counter()
+        todo = list(_filter_jobs(jobs, db, load_state(args.state), skipped))
+        print(f"[bulk_import] {len(todo)} file da importare ({len(jobs) - len(todo)} già presenti o saltati)")
+        for reason, n in sorted(skipped.items()):
+            print(f"  - {reason}: {n}")
+        if not todo:
+            return 0
+
+        importer = BulkImporter(db, args.state, args.embed_batch, args.progress_every)
+        validate = not args.no_validation
+        rate_limit = validation_rate_limit() if validate else None
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(rate_limit,)) as pool:
+            # map preserva l'ordine: i risultati arrivano raggruppati per paziente
+            for result in pool.map(_extract_and_validate, [(p, e, validate) for p, e in todo], chunksize=4):
+                importer.handle(result)
+        importer.flush()
+        importer.report(final=True)
+        return 0
+    except KeyboardInterrupt:
+        db.rollback()
+        print("\n[bulk_import] interrotto: rilancia lo stesso comando per riprendere.", file=sys.stderr)
+        return 130
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+Confronto tra due dump di profilazione (es. due release).
+
+Uso (dalla radice del progetto):
+
+    python -m app.scripts.compare_profiles profiling/profile_1.4.jsonl profiling/profile_1.5.jsonl
+
+Per ogni pagina riporta la mediana di tempo, query SQL e dati caricati e la
+variazione percentuale tra il primo e il secondo file.
+"""
+import argparse
+import json
+import statistics
+import sys
+from collections import defaultdict
+
+
+def load(path: str) -> dict:
+    by_page = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                by_page[entry["page"]].append(entry)
+    return by_page
+
+
+def summarize(entries: list) -> dict:
+    return {
+        "wall_ms": statistics.median(e["wall_ms"] for e in entries),
+        "sql": statistics.median(e["sql"]["statements"] for e in entries),
+        "kb": statistics.median(e["sql"]["bytes_loaded"] for e in entries) / 1024,
+        "n": len(entries),
+    }
+
+
+def _delta(old: float, new: float) -> str:
+    if not old:
+        return "   n/d"
+    return f"{(new - old) / old * 100:+6.1f}%"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Confronta due dump di profilazione delle pagine.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args(argv)
+
+    base, cand = load(args.baseline), load(args.candidate)
+    print(f"{'pagina':<16}{'ms':>10}{'Δ':>9}{'query':>8}{'Δ':>9}{'KB':>10}{'Δ':>9}{'campioni':>10}")
+    for page in sorted(set(base) | set(cand)):
+        if page not in base or page not in cand:
+            print(f"{page:<16}  presente solo in {'candidate' if page in cand else 'baseline'}")
+            continue
+        b, c = summarize(base[page]), summarize(cand[page])
+        print(f"{page:<16}{c['wall_ms']:>10.1f}{_delta(b['wall_ms'], c['wall_ms']):>9}"
+              f"{c['sql']:>8.0f}{_delta(b['sql'], c['sql']):>9}"
+              f"{c['kb']:>10.1f}{_delta(b['kb'], c['kb']):>9}{b['n']:>5}/{c['n']:<4}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+Migrazione dal layout per paziente (chroma_db/<email> e gli store compatti in
+chroma_db/_compact/<email>) alla collection condivisa.
+
+Uso (dalla radice del progetto):
+
+    python -m app.scripts.migrate_vectorstore            # copia e verifica
+    python -m app.scripts.migrate_vectorstore --delete-source
+
+Gli embedding vengono copiati così come sono (nessun ricalcolo); ogni chunk
+riceve il metadato paziente_email e un id prefissato dall'email. Rilanciare il
+comando è sicuro: la scrittura è una upsert. Dopo la migrazione impostare
+VECTORSTORE_LAYOUT=shared.
+
+Per default lavora sulla versione attiva dell'indice (chroma_db/_versions/<v> dopo un
+re-indexing, chroma_db per la versione legacy) e non parte se un re-indexing è in corso.
+"""
+import argparse
+import os
+import shutil
+import sys
+
+import chromadb
+
+from app.services.compact_store import COMPACT_DIR_NAME, CompactStore
+from app.services.index_versions import MANIFEST_NAME, VERSIONS_DIR_NAME, active_spec, building_spec
+from app.services.vectorstore_service import COLLECTION_NAME, SHARED_DIR_NAME, get_shared_collection
+
+PAGE_SIZE = 1000
+
+
+# voci della radice che non sono vectorstore di pazienti
+NOT_PATIENT_DIRS = {SHARED_DIR_NAME, COMPACT_DIR_NAME, VERSIONS_DIR_NAME, MANIFEST_NAME}
+
+
+def iter_patient_dirs(root: str):
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if name in NOT_PATIENT_DIRS or name.startswith("_") or name.endswith(".tmp"):
+            continue
+        if os.path.isdir(path):
+            yield name, path
+
+
+def iter_compact_stores(root: str):
+    compact_root = os.path.join(root, COMPACT_DIR_NAME)
+    if not os.path.isdir(compact_root):
+        return
+    for name in sorted(os.listdir(compact_root)):
+        store = CompactStore(name, root)
+        if store.exists():
+            yield name, store
+
+
+def migrate_compact(email: str, store: CompactStore, shared) -> int:
+    """Copia nella collection condivisa i chunk di un paziente tenuti nello store compatto."""
+    ids, vectors, documents, metadatas = store.entries()
+    if not ids:
+        return 0
+    metadatas = [dict(m or {}, paziente_email=email) for m in metadatas]
+    shared.upsert(
+        ids=[f"{email}:{i}" for i in ids],
+        embeddings=vectors.tolist(),
+        documents=documents,
+        metadatas=metadatas
+    )
+    return len(ids)
+
+
+def migrate_patient(email: str, path: str, shared) -> int:
+    """Copia tutti i chunk di un paziente nella collection condivisa. Ritorna il numero di chunk."""
+    client = chromadb.PersistentClient(path=path)
+    try:
+        source = client.get_collection(COLLECTION_NAME)
+    except Exception:
+        return 0
+
+    copied = 0
+    offset = 0
+    while True:
+        page = source.get(limit=PAGE_SIZE, offset=offset, include=["embeddings", "documents", "metadatas"])
+        if not page["ids"]:
+            break
+        metadatas = [dict(m or {}) for m in page["metadatas"]]
+        for m in metadatas:
+            m["paziente_email"] = email
+        shared.upsert(
+            ids=[f"{email}:{i}" for i in page["ids"]],
+            embeddings=[list(e) for e in page["embeddings"]],
+            documents=page["documents"],
+            metadatas=metadatas
+        )
+        copied += len(page["ids"])
+        offset += len(page["ids"])
+    return copied
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Migra i vectorstore per paziente nella collection condivisa.")
+    parser.add_argument("--root", default=None,
+                        help="cartella radice di ChromaDB (default: quella della versione attiva dell'indice)")
+    parser.add_argument("--delete-source", action="store_true",
+                        help="rimuove chroma_db/<email> dopo una copia verificata")
+    args = parser.parse_args(argv)
+
+    building = building_spec()
+    if building is not None:
+        # la versione in costruzione riceve scritture e verrà promossa: migrare ora perderebbe dati
+        print(f"[migrate_vectorstore] re-indexing in corso (versione {building.version}): "
+              f"riprovare a re-indexing concluso o annullato", file=sys.stderr)
+        return 2
+    if args.root is None:
+        args.root = active_spec().root
+    print(f"[migrate_vectorstore] radice: {args.root}")
+
+    shared = get_shared_collection(args.root)
+    total = 0
+    failed = []
+    sources = [(email, path, migrate_patient) for email, path in iter_patient_dirs(args.root)]
+    sources += [(email, store, migrate_compact) for email, store in iter_compact_stores(args.root)]
+    for email, source, migrate in sources:
+        copied = migrate(email, source, shared)
+        in_shared = len(shared.get(where={"paziente_email": email}, include=[])["ids"])
+        if in_shared < copied:
+            failed.append(email)
+            print(f"  ✗ {email}: copiati {copied} chunk ma la collection condivisa ne contiene {in_shared}",
+                  file=sys.stderr)
+            continue
+
+        total += copied
+        print(f"  ✓ {email}: {copied} chunk")
+        if args.delete_source:
+            if isinstance(source, CompactStore):
+                source.drop()
+            else:
+                shutil.rmtree(source)
+
+    print(f"[migrate_vectorstore] {total} chunk migrati, {len(failed)} pazienti con errori")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
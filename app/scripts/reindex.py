@@ -0,0 +1,220 @@
+"""
+Re-indexing blue/green dei vectorstore a partire dai PDF salvati su Postgres.
+
+Uso (dalla radice del progetto):
+
+    python -m app.scripts.reindex --status
+    python -m app.scripts.reindex --embedding-model intfloat/multilingual-e5-large --chunk-size 800 --chunk-overlap 100
+    python -m app.scripts.reindex --chunk-size 800 --workers 2 --docs-per-sec 4 --gc-delay 300
+    python -m app.scripts.reindex --abort
+
+La nuova versione viene costruita in chroma_db/_versions/<versione> mentre le
+query continuano a essere servite dalla versione attiva; durante la
+costruzione gli upload scrivono in entrambe. Al termine il manifest viene
+sostituito atomicamente e, dopo --gc-delay secondi, la versione precedente
+viene cancellata. Se interrotto, rilanciare lo stesso comando riprende la
+costruzione dai pazienti non ancora completati.
+"""
+import argparse
+import hashlib
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from app.database.postgres import SessionLocal, init_db
+from app.models.doc import Doc
+from app.services.index_versions import (
+    IndexSpec,
+    abort_build,
+    active_spec,
+    building_spec,
+    garbage_collect,
+    promote,
+    start_build,
+)
+from app.services.pdf_extraction import extract_text
+from app.services.vectorstore_service import index_document
+
+DONE_FILE = "_done.txt"
+
+
+class Throttle:
+    """Limita il ritmo complessivo dei documenti elaborati (condiviso tra i thread)."""
+
+    def __init__(self, per_second: float):
+        self.interval = 1.0 / per_second if per_second > 0 else 0.0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Reindexer:
+    def __init__(self, spec: IndexSpec, workers: int, docs_per_sec: float):
+        self.spec = spec
+        self.workers = workers
+        self.throttle = Throttle(docs_per_sec)
+        self.done_path = os.path.join(spec.root, DONE_FILE)
+        self.lock = threading.Lock()
+        self.indexed_docs = 0
+        self.started = time.perf_counter()
+
+    def _done_patients(self) -> set:
+        if not os.path.exists(self.done_path):
+            return set()
+        with open(self.done_path, encoding="utf-8") as f:
+            return {line.strip() for line in f if line.strip()}
+
+    def _mark_done(self, email: str) -> None:
+        with self.lock:
+            with open(self.done_path, "a", encoding="utf-8") as f:
+                f.write(email + "\n")
+
+    def index_docs(self, doc_ids: List[int]) -> None:
+        """Ricostruisce i documenti indicati nella nuova versione (una sessione per thread)."""
+        db = SessionLocal()
+        try:
+            for doc_id in doc_ids:
+                self.throttle.wait()
+                doc = db.get(Doc, doc_id)
+                if doc is None:
+                    continue
+                text = extract_text(doc.file_data)
+                index_document(
+                    doc.paziente_email,
+                    text,
+                    content_hash=hashlib.sha256(doc.file_data).hexdigest(),
+                    metadata={"doc_id": doc.id, "filename": doc.filename},
+                    specs=[self.spec]
+                )
+                db.expunge(doc)
+                with self.lock:
+                    self.indexed_docs += 1
+        finally:
+            db.close()
+
+    def _rebuild_patient(self, email: str, doc_ids: List[int]) -> None:
+        try:
+            self.index_docs(doc_ids)
+            self._mark_done(email)
+        except Exception as e:
+            print(f"  ✗ {email}: {e}", file=sys.stderr)
+            raise
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        print(f"  ✓ {email}: {len(doc_ids)} documenti ({self.indexed_docs / elapsed:.1f} doc/s)", flush=True)
+
+    def run(self) -> None:
+        os.makedirs(self.spec.root, exist_ok=True)
+        db = SessionLocal()
+        try:
+            rows = db.query(Doc.id, Doc.paziente_email).order_by(Doc.id).all()
+        finally:
+            db.close()
+
+        last_id = rows[-1].id if rows else 0
+        by_patient: Dict[str, List[int]] = {}
+        for row in rows:
+            by_patient.setdefault(row.paziente_email, []).append(row.id)
+
+        done = self._done_patients()
+        todo = {email: ids for email, ids in by_patient.items() if email not in done}
+        print(f"[reindex] versione {self.spec.version}: {len(todo)} pazienti da ricostruire "
+              f"({len(done)} già completati)")
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for future in [pool.submit(self._rebuild_patient, e, ids) for e, ids in todo.items()]:
+                future.result()
+
+        # recupero dei documenti arrivati durante la costruzione (es. import massivi)
+        while True:
+            db = SessionLocal()
+            try:
+                new_ids = [r.id for r in db.query(Doc.id).filter(Doc.id > last_id).order_by(Doc.id)]
+            finally:
+                db.close()
+            if not new_ids:
+                break
+            print(f"[reindex] recupero di {len(new_ids)} documenti caricati durante la costruzione")
+            self.index_docs(new_ids)
+            last_id = new_ids[-1]
+
+
+def print_status() -> None:
+    active = active_spec()
+    building = building_spec()
+    print(f"attiva:         {active.version} ({active.embedding_model}, "
+          f"chunk {active.chunk_size}/{active.chunk_overlap})")
+    if building:
+        print(f"in costruzione: {building.version} ({building.embedding_model}, "
+              f"chunk {building.chunk_size}/{building.chunk_overlap})")
+
+
+def main(argv=None) -> int:
+    current = active_spec()
+    parser = argparse.ArgumentParser(description="Re-indexing versionato dei vectorstore.")
+    parser.add_argument("--embedding-model", default=current.embedding_model)
+    parser.add_argument("--chunk-size", type=int, default=current.chunk_size)
+    parser.add_argument("--chunk-overlap", type=int, default=current.chunk_overlap)
+    parser.add_argument("--workers", type=int, default=2, help="pazienti ricostruiti in parallelo")
+    parser.add_argument("--docs-per-sec", type=float, default=0, help="limite di documenti/s (0 = nessuno)")
+    parser.add_argument("--gc-delay", type=float, default=60,
+                        help="secondi di attesa prima di cancellare la versione ritirata")
+    parser.add_argument("--keep-old", action="store_true", help="non cancellare la versione ritirata")
+    parser.add_argument("--force", action="store_true", help="ricostruisce anche con parametri invariati")
+    parser.add_argument("--status", action="store_true")
+    parser.add_argument("--abort", action="store_true", help="annulla il re-indexing in corso")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        print_status()
+        return 0
+
+    if args.abort:
+        aborted = abort_build()
+        if aborted:
+            garbage_collect(aborted)
+            print(f"[reindex] costruzione {aborted.version} annullata")
+        return 0
+
+    target = IndexSpec.new(args.embedding_model, args.chunk_size, args.chunk_overlap)
+    building = building_spec()
+    if building is not None:
+        if not building.same_params(target):
+            print(f"[reindex] è già in corso la costruzione di {building.version} con parametri diversi: "
+                  "usa --abort prima di avviarne un'altra.", file=sys.stderr)
+            return 1
+        target = building
+        print(f"[reindex] ripresa della costruzione {target.version}")
+    elif target.same_params(current) and not args.force:
+        print("[reindex] i parametri coincidono con la versione attiva: niente da fare (usa --force).")
+        return 0
+    else:
+        start_build(target)
+
+    init_db()
+    Reindexer(target, args.workers, args.docs_per_sec).run()
+
+    retired = promote(target)
+    print(f"[reindex] versione attiva: {target.version} (ritirata {retired.version})")
+
+    if not args.keep_old:
+        # attesa per le richieste ancora in corso sulla versione precedente
+        time.sleep(args.gc_delay)
+        garbage_collect(retired)
+        print(f"[reindex] versione {retired.version} cancellata")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
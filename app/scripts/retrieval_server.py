@@ -0,0 +1,245 @@
+"""
+Servizio di retrieval condiviso tra più processi Streamlit sulla stessa macchina.
+
+Il servizio carica una sola volta il modello di embedding, possiede i vectorstore
+Chroma (nessun altro processo li apre in scrittura) e raggruppa in un unico batch
+gli embedding richiesti in contemporanea da chiamanti diversi.
+
+Uso (dalla radice del progetto):
+
+    python -m app.scripts.retrieval_server --port 8765
+    python -m app.scripts.retrieval_server --socket /tmp/mynurseai-retrieval.sock
+
+Nei processi dell'app impostare RETRIEVAL_SERVICE_URL=http://127.0.0.1:8765
+(oppure unix:///tmp/mynurseai-retrieval.sock). Gli script batch (bulk_import,
+reindex) scrivono invece direttamente: vanno lanciati con il servizio fermo
+oppure sulla versione in costruzione.
+"""
+import argparse
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Sequence
+
+from app.services.index_versions import IndexSpec
+from app.services.vectorstore_service import (
+    EMBED_BATCH_SIZE,
+    current_spec,
+    get_embeddings,
+    has_vectorstore,
+    index_document_with,
+    search,
+)
+
+MAX_WAIT_MS = 5.0
+
+
+class _EmbedRequest:
+    __slots__ = ("texts", "model_name", "vectors", "error", "done")
+
+    def __init__(self, texts: List[str], model_name: str):
+        self.texts = texts
+        self.model_name = model_name
+        self.vectors = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class EmbeddingBatcher:
+    """
+    Raccoglie le richieste di embedding che arrivano entro max_wait_ms e le calcola insieme.
+    Query e chunk finiscono nello stesso batch: i modelli usati (e5 senza prefissi, embedding
+    deterministici) calcolano embed_query come embed_documents su un solo testo.
+    """
+
+    def __init__(self, max_batch: int = EMBED_BATCH_SIZE, max_wait_ms: float = MAX_WAIT_MS):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+        threading.Thread(target=self._loop, name="embedding-batcher", daemon=True).start()
+
+    def embed(self, texts: Sequence[str], model_name: str) -> List[List[float]]:
+        if not texts:
+            return []
+        request = _EmbedRequest(list(texts), model_name)
+        with self._cond:
+            self._pending.append(request)
+            self._cond.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.vectors
+
+    def _pending_texts(self, model_name: str) -> int:
+        return sum(len(r.texts) for r in self._pending if r.model_name == model_name)
+
+    def _take_batch(self) -> List[_EmbedRequest]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            model_name = self._pending[0].model_name
+            deadline = time.monotonic() + self.max_wait
+            while self._pending_texts(model_name) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch, size, kept = [], 0, deque()
+            while self._pending:
+                request = self._pending.popleft()
+                if request.model_name == model_name and (not batch or size + len(request.texts) <= self.max_batch):
+                    batch.append(request)
+                    size += len(request.texts)
+                else:
+                    kept.append(request)
+            self._pending.extendleft(reversed(kept))
+            return batch
+
+    def _loop(self):
+        while True:
+            batch = self._take_batch()
+            texts = [t for r in batch for t in r.texts]
+            try:
+                vectors = get_embeddings(batch[0].model_name).embed_documents(texts)
+            except Exception as e:
+                for r in batch:
+                    r.error = e
+                    r.done.set()
+                continue
+
+            self.batches += 1
+            self.requests += len(batch)
+            self.texts += len(texts)
+            offset = 0
+            for r in batch:
+                r.vectors = vectors[offset:offset + len(r.texts)]
+                offset += len(r.texts)
+                r.done.set()
+
+
+def make_handler(batcher: EmbeddingBatcher):
+    def embed_for_spec(texts: Sequence[str], spec: IndexSpec) -> List[List[float]]:
+        return batcher.embed(texts, spec.embedding_model)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def address_string(self):
+            # sui socket Unix client_address è una stringa vuota
+            return self.client_address[0] if self.client_address else "unix"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, payload, status=200):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != "/health":
+                return self._send({"error": "percorso sconosciuto"}, 404)
+            spec = current_spec()
+            self._send({
+                "status": "ok",
+                "index_version": spec.version,
+                "embedding_model": spec.embedding_model,
+                "batches": batcher.batches,
+                "requests": batcher.requests,
+                "texts": batcher.texts,
+            })
+
+        def do_POST(self):
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                req = json.loads(self.rfile.read(length) or b"{}")
+
+                if self.path == "/retrieve":
+                    spec = current_spec()
+                    if not has_vectorstore(req["email"], spec):
+                        return self._send({"documents": None})
+                    vector = batcher.embed([req["query"]], spec.embedding_model)[0]
+                    docs = search(req["email"], vector, int(req.get("k", 3)), spec) or []
+                    return self._send({"documents": [
+                        {"page_content": d.page_content, "metadata": d.metadata} for d in docs
+                    ]})
+
+                if self.path == "/index":
+                    n_chunks = index_document_with(
+                        req["email"], req["text"], req["content_hash"], req.get("metadata") or {},
+                        embed=embed_for_spec
+                    )
+                    return self._send({"n_chunks": n_chunks})
+
+                if self.path == "/embed":
+                    vectors = batcher.embed(req["texts"], current_spec().embedding_model)
+                    return self._send({"vectors": vectors})
+
+                self._send({"error": "percorso sconosciuto"}, 404)
+            except KeyError as e:
+                self._send({"error": f"campo mancante: {e}"}, 400)
+            except Exception as e:
+                print(f"[retrieval] errore su {self.path}: {e}", file=sys.stderr)
+                self._send({"error": str(e)}, 500)
+
+    return Handler
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Servizio di embedding e retrieval condiviso")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", default=None, help="ascolta su un socket Unix invece che su TCP")
+    parser.add_argument("--max-batch", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS,
+                        help="attesa massima per riempire un batch di embedding")
+    args = parser.parse_args()
+
+    batcher = EmbeddingBatcher(args.max_batch, args.max_wait_ms)
+    spec = current_spec()
+    # carica il modello prima di accettare richieste
+    get_embeddings(spec.embedding_model)
+    handler = make_handler(batcher)
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = ThreadingUnixHTTPServer(args.socket, handler)
+        os.chmod(args.socket, 0o660)
+        where = f"unix://{args.socket}"
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), handler)
+        server.daemon_threads = True
+        where = f"http://{args.host}:{args.port}"
+
+    print(f"[retrieval] in ascolto su {where} (modello {spec.embedding_model}, indice {spec.version})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
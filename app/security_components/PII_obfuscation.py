@@ -1,6 +1,8 @@
 from presidio_analyzer import AnalyzerEngine, PatternRecognizer, Pattern
 from presidio_anonymizer import AnonymizerEngine, OperatorConfig
 
+from app.security_components.pii_patterns import PATTERNS
+
 # Inizializza i motori
 analyzer = AnalyzerEngine()
 anonymizer = AnonymizerEngine()
@@ -8,99 +10,55 @@ anonymizer = AnonymizerEngine()
 # --- Riconoscitori custom ---
 
 # Codice Fiscale (Italia)
-cf_pattern = Pattern(
-    "CodiceFiscale",
-    r"\b([A-Z]{6}\d{2}[A-Z]\d{2}[A-Z]\d{3}[A-Z])\b",
-    0.8)
+cf_pattern = Pattern("CodiceFiscale", *PATTERNS["CodiceFiscale"])
 cf_recognizer = PatternRecognizer(supported_entity="IT_TAX_CODE", patterns=[cf_pattern])
 
 # Carta di credito
-cc_pattern = Pattern("CreditCard", r"\b(?:\d[ -]*?){13,16}\b", 0.85)
+cc_pattern = Pattern("CreditCard", *PATTERNS["CreditCard"])
 cc_recognizer = PatternRecognizer(supported_entity="CREDIT_CARD", patterns=[cc_pattern])
 
 # Numero di telefono (italiano o internazionale)
-phone_pattern = Pattern(
-    "PhoneNumber",
-    r"(?:(?:\+?39)?\s?)?(?:3\d{2}|0\d{1,3})[\s./-]?\d{5,8}\b",
-    0.85
-)
+phone_pattern = Pattern("PhoneNumber", *PATTERNS["PhoneNumber"])
 phone_recognizer = PatternRecognizer(supported_entity="PHONE_NUMBER", patterns=[phone_pattern])
 
 # Indirizzi di casa (parole chiave tipiche italiane)
-home_address_pattern = Pattern(
-    "HomeAddress",
-    r"\b(?:Via|Viale|Piazza|Corso|Largo|Strada|Contrada)\s+[A-Z][a-zàèéìòù’'\- ]+\s*(?:\d{1,3})?\b",
-    0.75
-)
+home_address_pattern = Pattern("HomeAddress", *PATTERNS["HomeAddress"])
 home_address_recognizer = PatternRecognizer(supported_entity="HOME_ADDRESS", patterns=[home_address_pattern])
 
-iban_pattern = Pattern(
-    "IBAN_Tolerant",
-    # country + check digits poi sequenza di gruppi che possono contenere lettere, cifre o placeholder
-    r"\b[A-Z]{2}\d{2}(?:[A-Z0-9\[\]\(\)\s\-/]{4,}){3,}\b",
-    0.75
-)
+iban_pattern = Pattern("IBAN_Tolerant", *PATTERNS["IBAN_Tolerant"])
 iban_recognizer = PatternRecognizer(supported_entity="IBAN", patterns=[iban_pattern])
 
 # Numero di passaporto (formato EU)
-passport_pattern = Pattern(
-    "Passport",
-    r"\b[A-Z]{2}\d{6,9}\b",
-    0.8
-)
+passport_pattern = Pattern("Passport", *PATTERNS["Passport"])
 passport_recognizer = PatternRecognizer(supported_entity="PASSPORT", patterns=[passport_pattern])
 
 # Numero di patente (formato italiano semplificato)
-license_pattern = Pattern(
-    "DrivingLicense",
-    r"\b[A-Z]{1,2}\d{5,10}\b",
-    0.7
-)
+license_pattern = Pattern("DrivingLicense", *PATTERNS["DrivingLicense"])
 license_recognizer = PatternRecognizer(supported_entity="DRIVING_LICENSE", patterns=[license_pattern])
 
 # Email
-email_pattern = Pattern(
-    "EmailAddress",
-    r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b",
-    0.9
-)
+email_pattern = Pattern("EmailAddress", *PATTERNS["EmailAddress"])
 email_recognizer = PatternRecognizer(supported_entity="EMAIL_ADDRESS", patterns=[email_pattern])
 
 # Password o segreti (keyword + simboli)
-password_pattern = Pattern(
-    "PasswordKeyword",
-    r"(?i)\b(?:password|pwd|pass|pw|passphrase)\b[:=\s]*([^\s,;.:()]{6,})",
-    0.95
-)
+password_pattern = Pattern("PasswordKeyword", *PATTERNS["PasswordKeyword"])
 password_recognizer = PatternRecognizer(supported_entity="AUTH_SECRET", patterns=[password_pattern])
 
 # Pattern entropy-ish standalone (almeno 6 char, almeno una lettera, una cifra e un simbolo)
-password_entropy_pattern = Pattern(
-    "PasswordEntropyRobust",
-    r'(?<!\w)(?=.{6,})(?=.*[A-Za-z])(?=.*\d)(?=.*[^A-Za-z0-9])[A-Za-z\d[^A-Za-z0-9]]{6,}\b',
-    0.90
-)
+password_entropy_pattern = Pattern("PasswordEntropyRobust", *PATTERNS["PasswordEntropyRobust"])
 password_entropy_recognizer = PatternRecognizer(
     supported_entity="AUTH_SECRET",
     patterns=[password_entropy_pattern]
 )
 
-cvv_pattern = Pattern(
-    "CardSecurityCode",
-    r"(?i)\b(?:cvv|cvc|codice[ ]di[ ]sicurezza|codice[ ]a[ ]tre[ ]cifre|codice[ ]a[ ]3[ ]cifre|security[ ]code|codice)\b[^\d]{0,6}(\d{3,4})\b",
-    0.97
-)
+cvv_pattern = Pattern("CardSecurityCode", *PATTERNS["CardSecurityCode"])
 cvv_recognizer = PatternRecognizer(
     supported_entity="CREDIT_CARD_SECURITY_CODE",
     patterns=[cvv_pattern]
 )
 
 # --- Expiry (scadenza carta) rilevata in contesto ---
-expiry_pattern = Pattern(
-    "CardExpiry",
-    r"(?i)\b(?:scad(?:enza)?|exp|expiry|valid(?:\s*thru)?)\b.{0,20}?([0-3]?\d[/\-][0-9]{2,4})\b",
-    0.95
-)
+expiry_pattern = Pattern("CardExpiry", *PATTERNS["CardExpiry"])
 expiry_recognizer = PatternRecognizer(
     supported_entity="CREDIT_CARD_EXPIRY",
     patterns=[expiry_pattern]
@@ -124,36 +82,48 @@ custom_recognizers = [
 for rec in custom_recognizers:
     analyzer.registry.add_recognizer(rec)
 
-# --- Funzione principale ---
-def obscure_pii(text: str) -> str:
+# Entità considerate sensibili
+SENSITIVE_ENTITIES = {
+    "CREDIT_CARD",
+    "IT_TAX_CODE",
+    "PHONE_NUMBER",
+    "HOME_ADDRESS",
+    "EMAIL_ADDRESS",
+    "IBAN",
+    "PASSPORT",
+    "DRIVING_LICENSE",
+    "AUTH_SECRET",
+    "CREDIT_CARD_SECURITY_CODE",
+    "CREDIT_CARD_EXPIRY"
+}
+
+REDACTED_PLACEHOLDER = "[DATI PERSONALI RIMOSSI]"
+
+
+def analyze_pii(text: str):
+    """Restituisce solo le entità sensibili trovate nel testo."""
     # Analizza il testo (usa 'en' per compatibilità, regex sono linguisticamente indipendenti)
     results = analyzer.analyze(text=text, language="en")
+    return [r for r in results if r.entity_type in SENSITIVE_ENTITIES]
+
 
-    # Entità considerate sensibili
-    sensitive_entities = {
-        "CREDIT_CARD",
-        "IT_TAX_CODE",
-        "PHONE_NUMBER",
-        "HOME_ADDRESS",
-        "EMAIL_ADDRESS",
-        "IBAN",
-        "PASSPORT",
-        "DRIVING_LICENSE",
-        "AUTH_SECRET",
-        "CREDIT_CARD_SECURITY_CODE",
-        "CREDIT_CARD_EXPIRY"
-    }
-
-    # Filtra solo le entità da oscurare
-    filtered = [r for r in results if r.entity_type in sensitive_entities]
+def obscure_pii_with_terms(text: str):
+    """Come obscure_pii, ma restituisce anche le stringhe PII trovate."""
+    filtered = analyze_pii(text)
 
     # Esegui l'anonimizzazione
     anonymized = anonymizer.anonymize(
         text=text,
         analyzer_results=filtered,
         operators={
-            "DEFAULT": OperatorConfig("replace", {"new_value": "[DATI PERSONALI RIMOSSI]"})
+            "DEFAULT": OperatorConfig("replace", {"new_value": REDACTED_PLACEHOLDER})
         }
     )
 
-    return anonymized.text
+    terms = sorted({text[r.start:r.end] for r in filtered})
+    return anonymized.text, terms
+
+
+# --- Funzione principale ---
+def obscure_pii(text: str) -> str:
+    return obscure_pii_with_terms(text)[0]
@@ -1,7 +1,29 @@
-from ollama import chat
+import threading
+from collections import Counter
+from typing import Optional
+from app.config import THERAPY_LLM_TIMEOUT
+from app.services.deadline import Deadline
+from app.services.llm_client import chat
+from app.services.llm_scheduler import PRIORITY_GUARD
+from app.security_components.therapy_lexicon import match_therapy
 
+# Decisioni prese da ciascun livello (lessico o LLM)
+_tier_counts = Counter()
+_tier_lock = threading.Lock()
 
-def is_therapy_related(text: str) -> bool:
+
+def _count(tier: str) -> None:
+    with _tier_lock:
+        _tier_counts[tier] += 1
+
+
+def therapy_tier_stats() -> dict:
+    """Contatori delle decisioni per livello: lexicon_terapia, lexicon_non_terapia, llm."""
+    with _tier_lock:
+        return dict(_tier_counts)
+
+
+def classify_therapy_with_llm(text: str, deadline: Optional[Deadline] = None) -> bool:
     few_shot_prompt = f"""
     Sei un assistente clinico. Devi stabilire se il testo fornito
     contiene riferimenti a TERAPIE, TRATTAMENTI o FARMACI.
@@ -19,9 +41,26 @@ def is_therapy_related(text: str) -> bool:
     resp = chat(
         model="medllama2",
         messages=[{"role": "user", "content": few_shot_prompt}],
-        stream=False
+        stream=False,
+        timeout=THERAPY_LLM_TIMEOUT,
+        deadline=deadline,
+        priority=PRIORITY_GUARD
     )
 
     output = resp["message"]["content"].strip().lower()
     return "terapia" in output and "non" not in output
 
+
+def is_therapy_related(text: str, deadline: Optional[Deadline] = None) -> bool:
+    """
+    Stabilisce se il testo riguarda terapie: decide il lessico terapeutico quando è netto,
+    medllama2 solo per i testi ambigui. Se il modello non risponde entro il budget
+    solleva BudgetExceeded: il fallback dipende da come il chiamante usa l'esito.
+    """
+    decision, confidence, reason = match_therapy(text)
+    if decision is not None:
+        _count("lexicon_terapia" if decision else "lexicon_non_terapia")
+        return decision
+
+    _count("llm")
+    return classify_therapy_with_llm(text, deadline)
@@ -1,10 +1,39 @@
 import re
 import math, json
-import io
-import subprocess
-from PyPDF2 import PdfReader
-from typing import Tuple, List
+import random
+import zlib
+from typing import Tuple, List, Optional
 from statistics import mean
+from app.config import VALIDATION_CHUNK_TIMEOUT
+from app.security_components import safe_regex
+from app.security_components.medical_lexicon import classify_locally
+from app.services.admission import ACTION_VALIDATION, wait_turn
+from app.services.deadline import BudgetExceeded, Deadline
+from app.services.llm_client import chat
+from app.services.llm_scheduler import PRIORITY_BACKGROUND
+from app.services.pdf_extraction import iter_pages
+
+# Versione del validatore: va incrementata a ogni modifica di euristiche, soglie o prompt,
+# così i verdetti salvati nella cache di validazione non vengono più riusati
+VALIDATOR_VERSION = "3"
+CLASSIFIER_MODEL = "mistral"
+BUDGET_MESSAGE = "Validazione non completata nel tempo disponibile: riprova a caricare il documento più tardi."
+EXTRACTION_INCOMPLETE_MESSAGE = ("Non è stato possibile leggere tutto il testo del PDF (pagine illeggibili, "
+                                 "troppo lente o testo oltre il limite): il documento non può essere verificato.")
+REGEX_TIMEOUT_MESSAGE = "Analisi del testo interrotta: contenuto anomalo o costruito per rallentare i controlli.\n"
+
+# Euristiche sul testo estratto (con limite di tempo, vedi safe_regex)
+EMBEDDED_CODE_RE = safe_regex.compile(r"(?i)(<script|javascript:|eval\(|base64,|import )", name="validazione:codice")
+NON_BASE64_RE = safe_regex.compile(r"[^A-Za-z0-9+/=]", name="validazione:normalizzazione")
+BASE64_RE = safe_regex.compile(r"(?:[A-Za-z0-9+/]{80,}={0,2})", name="validazione:base64")
+WHITESPACE_RE = safe_regex.compile(r"\s+", name="validazione:spazi")
+LETTER_RE = safe_regex.compile(r"[A-Za-z]", name="validazione:lettere")
+REPORT_LINE_RE = safe_regex.compile(
+    r"\b(g\/dl|mmol\/l|mg\/dl|u\/l||valori|esame|referto|diagnosi|terapia|farmacologica|farmaco|controllo)\b",
+    re.IGNORECASE, name="validazione:righe_referto")
+CODE_SYMBOL_RE = safe_regex.compile(r"[{}<>;=()/\\]", name="validazione:simboli")
+CODE_KEYWORD_RE = safe_regex.compile(r"\b(import|def|class|printf|var|function)\b", re.IGNORECASE,
+                                     name="validazione:parole_codice")
 
 def chunk_text(text: str, max_chunk_length: int = 1500) -> List[str]:
     """Divide il testo in chunk di lunghezza max_chunk_length (in parole)"""
@@ -15,8 +44,8 @@ def chunk_text(text: str, max_chunk_length: int = 1500) -> List[str]:
         chunks.append(chunk)
     return chunks
 
-def classify_chunk_with_ollama(text_chunk: str) -> Tuple[bool, str, float, str]:
-    """Classifica un singolo chunk usando Ollama/Mistral e JSON output"""
+def classify_chunk_with_ollama(text_chunk: str, deadline: Optional[Deadline] = None) -> Tuple[bool, str, float, str]:
+    """Classifica un singolo chunk usando Ollama/Mistral e JSON output (BudgetExceeded se il budget è esaurito)"""
     prompt = f"""
         Sei un classificatore di documenti clinici. Determina se il testo è MEDICO o NON_MEDICO.
         Classifica come MEDICO solo se il documento ha scopo clinico principale.
@@ -29,17 +58,17 @@ def classify_chunk_with_ollama(text_chunk: str) -> Tuple[bool, str, float, str]:
         {text_chunk}
         """
     try:
-        result = subprocess.run(
-            ["ollama", "run", "mistral"],
-            input=prompt.encode("utf-8"),
-            capture_output=True,
-            timeout=60
+        # limite di chiamate per utente: si attende il turno, nel budget della richiesta
+        wait_turn(ACTION_VALIDATION, deadline)
+        result = chat(
+            model=CLASSIFIER_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            timeout=VALIDATION_CHUNK_TIMEOUT,
+            deadline=deadline,
+            priority=PRIORITY_BACKGROUND
         )
 
-        if result.returncode != 0:
-            raise RuntimeError(result.stderr.decode())
-
-        raw_output = result.stdout.decode().strip()
+        raw_output = result["message"]["content"].strip()
 
         # parsing JSON
         parsed = None
@@ -48,9 +77,10 @@ def classify_chunk_with_ollama(text_chunk: str) -> Tuple[bool, str, float, str]:
             if isinstance(parsed, list) and len(parsed) > 0:
                 parsed = parsed[0]
         except Exception:
-            m = re.search(r"\{.*\}", raw_output, flags=re.DOTALL)
-            if m:
-                parsed = json.loads(m.group(0))
+            # dal primo "{" all'ultimo "}" (come r"\{.*\}" in DOTALL, senza backtracking)
+            start, end = raw_output.find("{"), raw_output.rfind("}")
+            if start != -1 and end > start:
+                parsed = json.loads(raw_output[start:end + 1])
 
         if parsed is None:
             return False, "non medico", 0.0, "Parsing JSON fallito"
@@ -66,24 +96,72 @@ def classify_chunk_with_ollama(text_chunk: str) -> Tuple[bool, str, float, str]:
         else:
             return False, "non medico", confidence, reason
 
+    except BudgetExceeded:
+        raise
     except Exception as e:
         print("⚠️ Errore classificazione chunk:", e)
         return False, "errore Ollama", 0.0, str(e)
 
-def classify_with_chunks(text: str, chunk_size: int = 1500) -> Tuple[bool, str, float]:
+def _majority_decided(medico: int, non_medico: int, remaining: int) -> bool:
+    """Vero se i chunk rimanenti non possono più cambiare l'esito del voto (pareggio = MEDICO)."""
+    return medico >= non_medico + remaining or non_medico > medico + remaining
+
+
+def classify_with_chunks(text: str, chunk_size: int = 1500, cascade: bool = True,
+                         stats: Optional[dict] = None,
+                         deadline: Optional[Deadline] = None) -> Tuple[bool, str, float]:
     """
     Classifica un documento lungo suddividendolo in chunk.
     Ritorna la classificazione finale basata su majority voting.
+
+    Con cascade=True i chunk netti vengono decisi dal lessico medico locale; quelli
+    ambigui vanno a Ollama in ordine campionato e la classificazione si ferma appena
+    la maggioranza non può più cambiare. In stats (se passato) vengono accumulati
+    i contatori llm_calls, llm_errors, local_decisions, skipped_chunks e budget_exhausted.
+    Se il budget di deadline si esaurisce prima della decisione solleva BudgetExceeded.
     """
     chunks = chunk_text(text, max_chunk_length=chunk_size)
     results = []
 
     print(f"\nDocumento diviso in {len(chunks)} chunk")
 
-    for i, chunk in enumerate(chunks, start=1):
-        print(f"\n=== Chunk {i} ===")
-        is_medical, label, confidence, reason = classify_chunk_with_ollama(chunk)
-        results.append((is_medical, label, confidence, reason))
+    if cascade:
+        ambiguous = []
+        for i, chunk in enumerate(chunks):
+            local_label, local_conf = classify_locally(chunk)
+            if local_label is None:
+                ambiguous.append(i)
+            else:
+                results.append((local_label, "medico" if local_label else "non medico", local_conf, "lessico"))
+        # ordine campionato ma riproducibile: lo stesso documento segue sempre lo stesso ordine
+        random.Random(zlib.crc32(text.encode("utf-8"))).shuffle(ambiguous)
+    else:
+        ambiguous = list(range(len(chunks)))
+
+    llm_calls = 0
+    budget_exhausted = False
+    try:
+        for pos, i in enumerate(ambiguous):
+            medico_count = sum(1 for r in results if r[0])
+            if cascade and _majority_decided(medico_count, len(results) - medico_count, len(ambiguous) - pos):
+                print(f"\nMaggioranza già decisa: {len(ambiguous) - pos} chunk non inviati al modello")
+                break
+            print(f"\n=== Chunk {i + 1} ===")
+            try:
+                is_medical, label, confidence, reason = classify_chunk_with_ollama(chunks[i], deadline)
+            except BudgetExceeded:
+                budget_exhausted = True
+                print(f"\nBudget di validazione esaurito dopo {llm_calls} chiamate al modello")
+                raise
+            results.append((is_medical, label, confidence, reason))
+            llm_calls += 1
+    finally:
+        if stats is not None:
+            stats["llm_calls"] = stats.get("llm_calls", 0) + llm_calls
+            stats["llm_errors"] = stats.get("llm_errors", 0) + sum(1 for r in results if r[1] == "errore Ollama")
+            stats["local_decisions"] = stats.get("local_decisions", 0) + len(chunks) - len(ambiguous)
+            stats["skipped_chunks"] = stats.get("skipped_chunks", 0) + len(chunks) - len(results)
+            stats["budget_exhausted"] = stats.get("budget_exhausted", 0) + int(budget_exhausted)
 
     # majority voting sulle etichette
     medico_count = sum(1 for r in results if r[0])
@@ -106,40 +184,70 @@ def shannon_entropy(s: str) -> float:
     return -sum(p * math.log(p, 2) for p in prob)
 
 
-def check_pdf_structure(pdf_bytes: bytes) -> tuple[bool, str]:
-    """Controlla che il PDF non contenga oggetti sospetti."""
+def extraction_incomplete(stats: Optional[dict]) -> bool:
+    """Vero se l'estrazione ha saltato pagine o troncato il testo: i controlli non vedrebbero tutto."""
+    return bool(stats and (stats.get("skipped_pages") or stats.get("truncated")))
+
+
+def extract_checked_pages(pdf_bytes: bytes, stats: Optional[dict] = None) -> Tuple[List[str], Optional[str]]:
+    """
+    Estrae le pagine man mano che sono pronte (iter_pages) e controlla ciascuna appena
+    arriva: alla prima pagina con codice embedded, o saltata dall'estrazione, si ferma
+    senza estrarre il resto. Ritorna (pagine, motivo del rifiuto o None); stats riceve
+    i contatori dell'estrazione.
+    """
+    stats = {} if stats is None else stats
+    pages: List[str] = []
+    pages_iter = iter_pages(pdf_bytes, stats=stats)
     try:
-        reader = PdfReader(io.BytesIO(pdf_bytes))
-        for page in reader.pages:
-            raw = page.extract_text() or ""
-            if re.search(r"(?i)(<script|javascript:|eval\(|base64,|import )", raw):
+        for raw in pages_iter:
+            pages.append(raw)
+            if extraction_incomplete(stats):
+                return pages, EXTRACTION_INCOMPLETE_MESSAGE
+            if EMBEDDED_CODE_RE.search(raw):
+                return pages, "Trovato contenuto sospetto o codice embedded nel PDF."
+    except safe_regex.RegexTimeout:
+        return pages, REGEX_TIMEOUT_MESSAGE
+    finally:
+        # annulla le pagine ancora in estrazione
+        pages_iter.close()
+    if extraction_incomplete(stats):
+        return pages, EXTRACTION_INCOMPLETE_MESSAGE
+    return pages, None
+
+
+def check_pdf_structure(pdf_bytes: bytes, pages_texts: Optional[List[str]] = None) -> tuple[bool, str]:
+    """Controlla che il PDF non contenga oggetti sospetti (riusa il testo delle pagine se già estratto)."""
+    try:
+        if pages_texts is None:
+            _, rejection = extract_checked_pages(pdf_bytes)
+            return rejection is None, rejection or ""
+        for raw in pages_texts:
+            if EMBEDDED_CODE_RE.search(raw):
                 return False, "Trovato contenuto sospetto o codice embedded nel PDF."
         return True, ""
+    except safe_regex.RegexTimeout:
+        return False, REGEX_TIMEOUT_MESSAGE
     except Exception as e:
         return False, f"Errore nella lettura del PDF: {e}"
 
 
-def validate_pdf_content(pdf_bytes: bytes) -> tuple[bool, str]:
+def _alpha_ratio(s: str) -> float:
+    """Percentuale di lettere in una stringa."""
+    if not s:
+        return 0.0
+    letters = len(LETTER_RE.findall(s))
+    return letters / max(1, len(s))
+
+
+def heuristic_checks(text: str, pdf_bytes: bytes, pages_texts: List[str]) -> Tuple[List[str], float]:
     """
-    Analizza il contenuto del PDF per individuare testo sospetto o codificato.
+    Controlli euristici sul testo estratto (lunghezza, codice embedded, Base64, entropia,
+    righe simili a codice). Ritorna (errori, punteggio di sospetto). Le regex hanno un limite
+    di tempo: se una ricerca lo supera il testo è trattato come sospetto.
     """
-    def alpha_ratio(s: str) -> float:
-        """Percentuale di lettere in una stringa."""
-        if not s:
-            return 0.0
-        letters = len(re.findall(r"[A-Za-z]", s))
-        return letters / max(1, len(s))
-
     errors = []
     suspicion_score = 0.0
-    SCORE_THRESHOLD = 2.2
-
-    # --- estrazione testo grezzo ---
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    pages_texts = [page.extract_text() or "" for page in reader.pages]
-    text = "\n".join(pages_texts)
-
-
 
     # --- controllo base sulla lunghezza ---
     if len(text.strip()) < 300:
@@ -147,84 +255,118 @@ def validate_pdf_content(pdf_bytes: bytes) -> tuple[bool, str]:
         suspicion_score += 0.6
 
     # --- controllo struttura ---
-    struct_ok, struct_msg = check_pdf_structure(pdf_bytes)
+    struct_ok, struct_msg = check_pdf_structure(pdf_bytes, pages_texts)
     if not struct_ok:
         errors.append(struct_msg)
         suspicion_score += 0.9
 
-    # --- normalizzazione ---
-    alnum = re.sub(r"[^A-Za-z0-9+/=]", "", text)
-
-    # --- rilevamento Base64 ---
-    base64_matches = list(re.finditer(r"(?:[A-Za-z0-9+/]{80,}={0,2})", alnum))
-    base64_flag = False
-    for m in base64_matches:
-        chunk = m.group(0)
-        if shannon_entropy(chunk) > 4.5:
-            base64_flag = True
-            break
-    if base64_flag:
-        errors.append("Pattern compatibile con Base64 o testo codificato rilevato.\n")
-        suspicion_score += 1.0
-
-    # --- entropia ---
     try:
-        chunks = [text[i:i+200] for i in range(0, len(text), 200)]
-        entropy_vals = [shannon_entropy(c) for c in chunks if len(c) > 50]
-        avg_entropy = mean(entropy_vals) if entropy_vals else 0
-        entropy_total = shannon_entropy(re.sub(r"\s+", "", text)) if text.strip() else 0
-    except Exception:
-        avg_entropy = entropy_total = 0
-
-    if avg_entropy > 5.5 or entropy_total > 5.5:
-        errors.append("Entropia elevata: possibile testo codificato o anomalo.\n")
+        # --- normalizzazione ---
+        alnum = NON_BASE64_RE.sub("", text)
+
+        # --- rilevamento Base64 ---
+        base64_flag = False
+        for m in BASE64_RE.finditer(alnum):
+            chunk = m.group(0)
+            if shannon_entropy(chunk) > 4.5:
+                base64_flag = True
+                break
+        if base64_flag:
+            errors.append("Pattern compatibile con Base64 o testo codificato rilevato.\n")
+            suspicion_score += 1.0
+
+        # --- entropia ---
+        try:
+            chunks = [text[i:i+200] for i in range(0, len(text), 200)]
+            entropy_vals = [shannon_entropy(c) for c in chunks if len(c) > 50]
+            avg_entropy = mean(entropy_vals) if entropy_vals else 0
+            entropy_total = shannon_entropy(WHITESPACE_RE.sub("", text)) if text.strip() else 0
+        except safe_regex.RegexTimeout:
+            raise
+        except Exception:
+            avg_entropy = entropy_total = 0
+
+        if avg_entropy > 5.5 or entropy_total > 5.5:
+            errors.append("Entropia elevata: possibile testo codificato o anomalo.\n")
+            suspicion_score += 1.0
+
+        # --- rilevamento linee di codice ---
+        code_like_lines = 0
+        for line in text.splitlines():
+            line_stripped = line.strip()
+
+            # ignora linee corte o quasi vuote
+            if len(line_stripped) < 10:
+                continue
+
+            # ignora linee con densità alfabetica troppo bassa (probabile numero o tabella)
+            if _alpha_ratio(line_stripped) < 0.35:
+                continue
+
+            # ignora linee tipiche dei referti (es. valori, unità di misura)
+            if REPORT_LINE_RE.search(line_stripped):
+                continue
+
+            # considera "code-like" solo se contiene più pattern di codice insieme
+            symbol_count = len(CODE_SYMBOL_RE.findall(line_stripped))
+            keyword_hits = len(CODE_KEYWORD_RE.findall(line_stripped))
+
+            if symbol_count >= 3 or keyword_hits >= 1:
+                code_like_lines += 1
+
+        # aumenta la soglia per ridurre falsi positivi
+        if code_like_lines > 15:
+            errors.append(f"Rilevate {code_like_lines} righe con pattern simili a codice.\n")
+            suspicion_score += 0.5
+    except safe_regex.RegexTimeout:
+        errors.append(REGEX_TIMEOUT_MESSAGE)
         suspicion_score += 1.0
 
-    # --- rilevamento linee di codice ---
-    code_like_lines = 0
-    for line in text.splitlines():
-        line_stripped = line.strip()
-
-        # ignora linee corte o quasi vuote
-        if len(line_stripped) < 10:
-            continue
-
-        # ignora linee con densità alfabetica troppo bassa (probabile numero o tabella)
-        if alpha_ratio(line_stripped) < 0.35:
-            continue
+    return errors, suspicion_score
 
-        # ignora linee tipiche dei referti (es. valori, unità di misura)
-        if re.search(
-                r"\b(g\/dl|mmol\/l|mg\/dl|u\/l||valori|esame|referto|diagnosi|terapia|farmacologica|farmaco|controllo)\b",
-                line_stripped, re.IGNORECASE):
-            continue
 
-        # considera "code-like" solo se contiene più pattern di codice insieme
-        symbol_count = len(re.findall(r"[{}<>;=()/\\]", line_stripped))
-        keyword_hits = len(re.findall(r"\b(import|def|class|printf|var|function)\b", line_stripped, re.IGNORECASE))
+def validate_pdf_content(pdf_bytes: bytes, stats: Optional[dict] = None,
+                         pages_texts: Optional[List[str]] = None,
+                         deadline: Optional[Deadline] = None) -> tuple[bool, str]:
+    """
+    Analizza il contenuto del PDF per individuare testo sospetto o codificato.
+    stats (se passato) riceve i contatori della classificazione, tra cui llm_errors e budget_exhausted.
+    pages_texts evita una nuova estrazione quando il chiamante ha già il testo delle pagine:
+    in quel caso stats deve contenere i contatori dell'estrazione (skipped_pages, truncated).
+    Se la classificazione non si conclude entro deadline il documento viene rifiutato (BUDGET_MESSAGE).
+    Un testo estratto solo in parte (pagine saltate o troncato) viene rifiutato: una pagina
+    costruita per essere lenta o illeggibile non deve sottrarre il resto ai controlli.
+    """
+    SCORE_THRESHOLD = 2.2
 
-        if symbol_count >= 3 or keyword_hits >= 1:
-            code_like_lines += 1
+    # --- estrazione testo grezzo (in parallelo per pagine sui documenti lunghi, controllata pagina per pagina) ---
+    stats = {} if stats is None else stats
+    if pages_texts is None:
+        pages_texts, rejection = extract_checked_pages(pdf_bytes, stats)
+        if rejection:
+            return False, rejection
+    if extraction_incomplete(stats):
+        return False, EXTRACTION_INCOMPLETE_MESSAGE
+    text = "\n".join(pages_texts)
 
-    # aumenta la soglia per ridurre falsi positivi
-    if code_like_lines > 15:
-        errors.append(f"Rilevate {code_like_lines} righe con pattern simili a codice.\n")
-        suspicion_score += 0.5
+    errors, suspicion_score = heuristic_checks(text, pdf_bytes, pages_texts)
 
     # --- controllo LLM ---
-    if suspicion_score < 1.6:
-        valid, label, conf = classify_with_chunks(text)
+    high_suspicion = suspicion_score >= 1.6
+    try:
+        valid, label, conf = classify_with_chunks(text, stats=stats, deadline=deadline)
         if not valid:
             errors.append("Il documento non appare medico.")
-            suspicion_score += 0.6
-    else:
-        try:
-            valid, label, conf = classify_with_chunks(text)
-            if not valid:
-                errors.append("Il documento non appare medico.")
-                suspicion_score += 0.4
-        except Exception:
-            errors.append("Errore durante la classification LLM.")
+            suspicion_score += 0.4 if high_suspicion else 0.6
+    except BudgetExceeded:
+        # rifiuto conservativo: senza il verdetto del modello il documento non entra
+        errors.append(BUDGET_MESSAGE)
+    except Exception:
+        if not high_suspicion:
+            raise
+        errors.append("Errore durante la classification LLM.")
+        if stats is not None:
+            stats["llm_errors"] = stats.get("llm_errors", 0) + 1
 
     # --- decisione finale ---
     if suspicion_score >= SCORE_THRESHOLD or errors:
@@ -0,0 +1,110 @@
+import math
+import re
+from collections import Counter
+from typing import Optional, Tuple
+
+# Versione del lessico: va incrementata a ogni modifica di termini, pesi o soglie
+LEXICON_VERSION = "2"
+
+# Termini clinici con peso di tipo IDF: più il termine è specifico dei referti, più pesa
+MEDICAL_TERMS = {
+    # struttura del referto
+    "referto": 2.5, "diagnosi": 2.5, "anamnesi": 3.0, "prognosi": 3.0, "epicrisi": 3.5,
+    "dimissione": 2.5, "dimissioni": 2.5, "ricovero": 2.2, "reparto": 1.5, "ambulatorio": 1.8,
+    "ambulatoriale": 2.0, "paziente": 1.2, "medico": 0.8, "dott": 0.8,
+    "esame_obiettivo": 3.0, "quesito_diagnostico": 3.5, "conclusioni_diagnostiche": 3.5,
+    "follow": 1.0, "controllo": 0.8, "visita": 1.0, "specialistica": 1.5, "consulenza": 1.2,
+    # esami e diagnostica
+    "emocromo": 3.5, "glicemia": 3.5, "creatinina": 3.5, "azotemia": 3.5, "transaminasi": 3.5,
+    "colesterolo": 3.0, "trigliceridi": 3.0, "emoglobina": 3.2, "ematocrito": 3.5, "piastrine": 3.2,
+    "leucociti": 3.2, "eritrociti": 3.2, "sodiemia": 3.5, "potassiemia": 3.5, "bilirubina": 3.5,
+    "ecografia": 3.0, "ecografico": 3.0, "radiografia": 3.0, "rx": 2.0, "tac": 2.5, "rmn": 3.0,
+    "risonanza": 2.0, "ecg": 3.0, "elettrocardiogramma": 3.5, "ecocardiogramma": 3.5,
+    "spirometria": 3.5, "biopsia": 3.2, "istologico": 3.2, "mammografia": 3.5, "holter": 3.2,
+    # clinica
+    "ipertensione": 3.0, "diabete": 2.8, "dislipidemia": 3.5, "insufficienza": 2.5, "cardiopatia": 3.2,
+    "bpco": 3.5, "neoplasia": 3.2, "frattura": 2.5, "infezione": 2.2, "febbre": 2.0, "dolore": 1.2,
+    "dispnea": 3.2, "tachicardia": 3.2, "bradicardia": 3.5, "edema": 3.0, "stenosi": 3.2,
+    "pressione_arteriosa": 3.0, "frequenza_cardiaca": 3.0, "saturazione": 2.2, "sintomi": 1.5,
+    "sintomatologia": 2.5, "patologia": 2.0, "patologico": 2.2, "lesione": 2.0, "noduli": 2.5,
+    # terapia
+    "terapia": 2.0, "farmaco": 2.0, "farmacologica": 2.5, "posologia": 3.2, "compresse": 2.8,
+    "somministrazione": 2.5, "dosaggio": 2.5, "prescrizione": 2.0, "mg": 2.2, "ml": 1.0,
+    # unità di misura di laboratorio
+    "mg/dl": 3.5, "mmol/l": 3.5, "g/dl": 3.5, "u/l": 3.0, "mmhg": 3.5, "bpm": 2.5,
+}
+
+# Indicatori di documenti non clinici (contratti, fatture, codice, testi didattici...)
+NON_MEDICAL_TERMS = {
+    "fattura": 3.0, "iva": 2.5, "imponibile": 3.0, "pagamento": 1.8, "bonifico": 2.5, "contratto": 2.5,
+    "clausola": 3.0, "preventivo": 2.5, "ordine": 1.0, "spedizione": 2.0, "prezzo": 1.8, "euro": 1.0,
+    "capitolo": 2.0, "esercizio": 1.5, "esercizi": 2.0, "lezione": 2.0, "corso": 1.0, "slide": 2.5,
+    "import": 2.5, "def": 2.5, "class": 2.0, "function": 2.5, "return": 2.0, "python": 3.0,
+    "javascript": 3.0, "database": 2.0, "software": 2.0, "algoritmo": 2.0, "curriculum": 3.0,
+    "ricetta": 0.5, "ingredienti": 3.0, "romanzo": 3.0, "campionato": 3.0,
+}
+
+# Soglie della probabilità stimata: fuori dall'intervallo la decisione è locale
+CONFIDENT_MEDICAL = 0.85
+CONFIDENT_NON_MEDICAL = 0.15
+MIN_TOKENS = 40
+# Peso minimo dei termini non clinici trovati per decidere NON_MEDICO in locale: l'assenza
+# di termini clinici (specialità o lingue fuori dal lessico) non dice che il testo non è clinico
+MIN_NON_MEDICAL_EVIDENCE = 3.0
+
+_TOKEN_RE = re.compile(r"[a-zàèéìòù]+(?:/[a-z]+)?|\d+")
+
+
+def _tokens(text: str):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _lexicon(text: str) -> Tuple[float, int, float]:
+    """Punteggio normalizzato, numero di token e peso dei termini non clinici trovati."""
+    tokens = _tokens(text)
+    if not tokens:
+        return 0.0, 0, 0.0
+    counts = Counter(tokens)
+    counts.update(f"{a}_{b}" for a, b in zip(tokens, tokens[1:]))
+
+    medical = sum((1 + math.log(counts[t])) * w for t, w in MEDICAL_TERMS.items() if counts.get(t))
+    non_medical = sum((1 + math.log(counts[t])) * w for t, w in NON_MEDICAL_TERMS.items() if counts.get(t))
+    return (medical - 1.5 * non_medical) / math.sqrt(len(tokens)), len(tokens), non_medical
+
+
+def _probability(score: float) -> float:
+    z = max(-30.0, min(30.0, 4.0 * (score - 0.6)))
+    return 1.0 / (1.0 + math.exp(-z))
+
+
+def lexicon_score(text: str) -> Tuple[float, int]:
+    """
+    Punteggio TF-IDF normalizzato (termini clinici meno termini non clinici)
+    e numero di token del testo.
+    """
+    score, n_tokens, _ = _lexicon(text)
+    return score, n_tokens
+
+
+def medical_probability(text: str) -> Tuple[float, int]:
+    """Probabilità stimata che il testo sia clinico (sigmoide del punteggio)."""
+    score, n_tokens = lexicon_score(text)
+    return _probability(score), n_tokens
+
+
+def classify_locally(text: str) -> Tuple[Optional[bool], float]:
+    """
+    Classificatore locale, senza rete. Ritorna (True/False, confidence) nei casi netti,
+    (None, probabilità) quando il testo è ambiguo e serve il modello.
+    NON_MEDICO viene deciso solo se nel testo ci sono termini non clinici: un testo
+    senza termini del lessico va sempre al modello.
+    """
+    score, n_tokens, non_medical = _lexicon(text)
+    p = _probability(score)
+    if n_tokens < MIN_TOKENS:
+        return None, p
+    if p >= CONFIDENT_MEDICAL:
+        return True, min(p, 0.99)
+    if p <= CONFIDENT_NON_MEDICAL and non_medical >= MIN_NON_MEDICAL_EVIDENCE:
+        return False, min(1.0 - p, 0.99)
+    return None, p
@@ -0,0 +1,166 @@
+import json
+from collections import deque
+from functools import lru_cache
+from typing import FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+# Metadato dei chunk con le stringhe PII rilevate all'indicizzazione (lista JSON)
+PII_TERMS_KEY = "pii_terms"
+MIN_TERM_LENGTH = 3
+
+
+def detect_pii_terms(text: str) -> List[str]:
+    """Stringhe PII presenti nel testo (analisi completa, da eseguire una volta all'ingest)."""
+    # import locale: l'analyzer Presidio è pesante e serve solo in indicizzazione
+    from app.security_components.PII_obfuscation import analyze_pii
+    return sorted({text[r.start:r.end] for r in analyze_pii(text)})
+
+
+def pii_metadata(chunks: Sequence[str]) -> List[dict]:
+    """Metadati PII da salvare insieme a ciascun chunk."""
+    return [{PII_TERMS_KEY: json.dumps(detect_pii_terms(chunk), ensure_ascii=False)} for chunk in chunks]
+
+
+def decode_terms(metadata: Optional[dict]) -> Optional[List[str]]:
+    """Termini PII di un chunk, oppure None se il chunk è stato indicizzato senza indice PII."""
+    if not metadata or PII_TERMS_KEY not in metadata:
+        return None
+    return json.loads(metadata[PII_TERMS_KEY])
+
+
+class AhoCorasick:
+    """Automa multi-pattern: trova tutte le occorrenze dei termini in un solo passaggio sul testo."""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out: List[Tuple[int, ...]] = [()]
+
+        for pattern in patterns:
+            if not pattern:
+                continue
+            state = 0
+            for ch in pattern:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                state = nxt
+            self.out[state] = self.out[state] + (len(pattern),)
+
+        # i figli della radice hanno fail = 0; gli altri stati si risolvono in ampiezza
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def find_all(self, text: str) -> List[Tuple[int, int]]:
+        """Tutte le occorrenze (start, end), anche sovrapposte."""
+        matches = []
+        state = 0
+        goto, fail, out = self.goto, self.fail, self.out
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length in out[state]:
+                matches.append((i - length + 1, i + 1))
+        return matches
+
+
+@lru_cache(maxsize=256)
+def _automaton(terms: FrozenSet[str]) -> AhoCorasick:
+    return AhoCorasick(terms)
+
+
+def _is_word_boundary(text: str, start: int, end: int) -> bool:
+    before = text[start - 1] if start > 0 else " "
+    after = text[end] if end < len(text) else " "
+    return not (before.isalnum() and text[start].isalnum()) and not (after.isalnum() and text[end - 1].isalnum())
+
+
+def redact_terms(text: str, terms: Iterable[str], placeholder: str) -> str:
+    """Sostituisce le occorrenze dei termini noti (senza distinzione maiuscole/minuscole)."""
+    keys = frozenset(t.lower() for t in terms if len(t) >= MIN_TERM_LENGTH)
+    if not keys or not text:
+        return text
+
+    haystack = text.lower()
+    if len(haystack) != len(text):
+        # lower() ha cambiato la lunghezza (caratteri Unicode particolari): confronto esatto
+        haystack = text
+        keys = frozenset(t for t in terms if len(t) >= MIN_TERM_LENGTH)
+
+    # scelta leftmost-longest di occorrenze non sovrapposte e allineate alle parole
+    spans = sorted(_automaton(keys).find_all(haystack), key=lambda s: (s[0], -s[1]))
+    pieces, cursor = [], 0
+    for start, end in spans:
+        if start < cursor or not _is_word_boundary(text, start, end):
+            continue
+        pieces.append(text[cursor:start])
+        pieces.append(placeholder)
+        cursor = end
+    pieces.append(text[cursor:])
+    return "".join(pieces)
+
+
+def _known_terms(retrieved_docs: Sequence, query_terms: Iterable[str]) -> Tuple[set, bool]:
+    """Termini PII noti e se serve l'analisi completa (chunk indicizzati senza indice PII)."""
+    terms = set(query_terms)
+    needs_fallback = False
+    for doc in retrieved_docs:
+        doc_terms = decode_terms(getattr(doc, "metadata", None))
+        if doc_terms is None:
+            needs_fallback = True
+        else:
+            terms.update(doc_terms)
+    return terms, needs_fallback
+
+
+def redact_answer(answer: str, retrieved_docs: Sequence, query_terms: Iterable[str] = ()) -> str:
+    """
+    Oscura i PII nella risposta del modello usando i termini già noti: quelli salvati con i
+    chunk recuperati e quelli trovati nella domanda. L'analisi completa con Presidio viene
+    eseguita solo se qualche chunk non ha l'indice PII (documenti indicizzati in passato).
+    """
+    from app.security_components.PII_obfuscation import REDACTED_PLACEHOLDER, obscure_pii
+
+    terms, needs_fallback = _known_terms(retrieved_docs, query_terms)
+    redacted = redact_terms(answer, terms, REDACTED_PLACEHOLDER)
+    if needs_fallback:
+        redacted = obscure_pii(redacted)
+    return redacted
+
+
+class StreamingRedactor:
+    """
+    Anteprima oscurata di una risposta ancora in generazione.
+    Il testo parziale viene oscurato con i termini noti e gli ultimi `holdback` caratteri
+    (la lunghezza del termine più lungo) restano nascosti: un termine non ancora completo
+    non viene quindi mai mostrato a metà. Se qualche chunk non ha l'indice PII l'anteprima
+    è disabilitata, perché l'analisi completa si può fare solo sulla risposta finita.
+    """
+
+    def __init__(self, retrieved_docs: Sequence, query_terms: Iterable[str] = ()):
+        from app.security_components.PII_obfuscation import REDACTED_PLACEHOLDER
+
+        terms, needs_fallback = _known_terms(retrieved_docs, query_terms)
+        self.enabled = not needs_fallback
+        self.placeholder = REDACTED_PLACEHOLDER
+        self.terms = frozenset(t for t in terms if len(t) >= MIN_TERM_LENGTH)
+        self.holdback = max((len(t) for t in self.terms), default=0)
+
+    def preview(self, partial: str) -> Optional[str]:
+        """Parte già mostrabile di partial, oppure None se l'anteprima non è disponibile."""
+        if not self.enabled:
+            return None
+        redacted = redact_terms(partial, self.terms, self.placeholder)
+        return redacted[:max(0, len(redacted) - self.holdback)]
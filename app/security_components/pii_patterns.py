@@ -0,0 +1,70 @@
+"""
+Espressioni regolari dei riconoscitori PII custom (usate da PII_obfuscation con Presidio).
+
+Sono scritte per avere costo lineare anche su input ostili: nessun quantificatore
+annidato illimitato e nessuna ripetizione che possa sovrapporsi a quella successiva
+(le parti variabili hanno un limite di lunghezza). Il benchmark
+benchmarks/bench_regex_redos.py le confronta con le versioni precedenti.
+"""
+
+# Codice Fiscale (Italia)
+CF_REGEX = r"\b([A-Z]{6}\d{2}[A-Z]\d{2}[A-Z]\d{3}[A-Z])\b"
+
+# Carta di credito: 13-16 cifre, separate da al massimo tre spazi o trattini
+# (prima "(?:\d[ -]*?){13,16}": separatori illimitati tra una cifra e l'altra)
+CC_REGEX = r"\b\d(?:[ -]{0,3}\d){12,15}\b"
+
+# Numero di telefono (italiano o internazionale)
+PHONE_REGEX = r"(?:(?:\+?39)?\s?)?(?:3\d{2}|0\d{1,3})[\s./-]?\d{5,8}\b"
+
+# Indirizzi di casa (parole chiave tipiche italiane); nome della via al massimo 60 caratteri
+HOME_ADDRESS_REGEX = (
+    r"\b(?:Via|Viale|Piazza|Corso|Largo|Strada|Contrada)\s{1,5}[A-Z][a-zàèéìòù’'\- ]{1,60}\s{0,5}(?:\d{1,3})?\b"
+)
+
+# IBAN tollerante: country + check digits poi gruppi di lettere, cifre o placeholder.
+# "(?:[...]{4,}){3,}" equivaleva a "[...]{12,}" ma con backtracking quadratico; un IBAN
+# con spazi non supera i 42 caratteri dopo le prime quattro, 60 lascia margine ai placeholder
+IBAN_REGEX = r"\b[A-Z]{2}\d{2}[A-Z0-9\[\]\(\)\s\-/]{12,60}\b"
+
+# Numero di passaporto (formato EU)
+PASSPORT_REGEX = r"\b[A-Z]{2}\d{6,9}\b"
+
+# Numero di patente (formato italiano semplificato)
+LICENSE_REGEX = r"\b[A-Z]{1,2}\d{5,10}\b"
+
+# Email (lunghezze massime da RFC 5321)
+EMAIL_REGEX = r"\b[A-Za-z0-9._%+-]{1,64}@[A-Za-z0-9.-]{1,253}\.[A-Za-z]{2,24}\b"
+
+# Password o segreti (keyword + simboli)
+PASSWORD_REGEX = r"(?i)\b(?:password|pwd|pass|pw|passphrase)\b[:=\s]{0,10}([^\s,;.:()]{6,})"
+
+# Token "ad alta entropia" (6-64 caratteri senza spazi con almeno una lettera, una cifra e un
+# simbolo): i lookahead guardano solo dentro il token invece che fino a fine riga
+PASSWORD_ENTROPY_REGEX = (
+    r"(?<!\S)(?=\S{0,63}[A-Za-z])(?=\S{0,63}\d)(?=\S{0,63}[^A-Za-z0-9\s])\S{6,64}(?!\S)"
+)
+
+CVV_REGEX = (
+    r"(?i)\b(?:cvv|cvc|codice[ ]di[ ]sicurezza|codice[ ]a[ ]tre[ ]cifre|codice[ ]a[ ]3[ ]cifre|"
+    r"security[ ]code|codice)\b[^\d]{0,6}(\d{3,4})\b"
+)
+
+# Scadenza carta rilevata in contesto
+EXPIRY_REGEX = r"(?i)\b(?:scad(?:enza)?|exp|expiry|valid(?:\s*thru)?)\b.{0,20}?([0-3]?\d[/\-][0-9]{2,4})\b"
+
+# nome del pattern -> (regex, score)
+PATTERNS = {
+    "CodiceFiscale": (CF_REGEX, 0.8),
+    "CreditCard": (CC_REGEX, 0.85),
+    "PhoneNumber": (PHONE_REGEX, 0.85),
+    "HomeAddress": (HOME_ADDRESS_REGEX, 0.75),
+    "IBAN_Tolerant": (IBAN_REGEX, 0.75),
+    "Passport": (PASSPORT_REGEX, 0.8),
+    "DrivingLicense": (LICENSE_REGEX, 0.7),
+    "EmailAddress": (EMAIL_REGEX, 0.9),
+    "PasswordKeyword": (PASSWORD_REGEX, 0.95),
+    "PasswordEntropyRobust": (PASSWORD_ENTROPY_REGEX, 0.90),
+    "CardSecurityCode": (CVV_REGEX, 0.97),
+    "CardExpiry": (EXPIRY_REGEX, 0.95),
+}
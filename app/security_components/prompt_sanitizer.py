@@ -1,20 +1,27 @@
 import html
 import unicodedata
 import re
-from ollama import chat, ChatResponse
-from typing import Dict
+from ollama import ChatResponse
+from app.config import GUARD_LLM_TIMEOUT
+from app.security_components import safe_regex
+from app.services.deadline import BudgetExceeded, Deadline
+from app.services.llm_client import chat
+from app.services.llm_scheduler import PRIORITY_GUARD
+from typing import Dict, Optional
 
 # --- Config ---
 MAX_LENGTH = 2000
 HIGH_RISK_THRESHOLD = 0.5  # sopra questo valore -> bloccare
 MEDIUM_RISK_THRESHOLD = 0.3  # sopra questo -> warning
 
+# Pattern a costo lineare: le parti variabili hanno un limite di lunghezza, così un input
+# ostile (es. centinaia di "<script" senza chiusura) non causa backtracking quadratico
 PATTERNS = {
     "script_html": [
-        r"<\s*script.*?>.*?<\s*/\s*script\s*>",
-        r"on\w+\s*=",
-        r"<\s*iframe.*?>",
-        r"<\s*img.*?on\w+\s*=",
+        r"<\s*script[^>]{0,200}>.{0,5000}?<\s*/\s*script\s*>",
+        r"on\w{1,40}\s{0,10}=",
+        r"<\s*iframe[^>]{0,500}>",
+        r"<\s*img\b[^>]{0,500}?on\w{1,40}\s{0,10}=",
     ],
 
     "code_exec": [
@@ -43,7 +50,8 @@ PATTERNS = {
     ],
 }
 
-FLATTENED = [(k, re.compile(p, re.IGNORECASE | re.DOTALL)) for k, ps in PATTERNS.items() for p in ps]
+FLATTENED = [(k, safe_regex.compile(p, re.IGNORECASE | re.DOTALL, name=f"sanificatore:{k}"))
+             for k, ps in PATTERNS.items() for p in ps]
 
 # --- Helpers ---
 def normalize_text(text: str) -> str:
@@ -57,7 +65,12 @@ def normalize_text(text: str) -> str:
 def score_matches(text: str) -> Dict[str, int]:
     counts: Dict[str, int] = {}
     for name, pattern in FLATTENED:
-        if pattern.search(text):
+        try:
+            found = pattern.search(text)
+        except safe_regex.RegexTimeout:
+            # una ricerca troppo lenta indica già un input costruito apposta
+            found = True
+        if found:
             counts[name] = counts.get(name, 0) + 1
     return counts
 
@@ -70,10 +83,10 @@ def long_non_alpha_sequence(text: str, threshold: int = 50) -> bool:
             return True
     return False
 
-def classify_prompt_risk_llm(user_input: str) -> Dict[str, str]:
+def classify_prompt_risk_llm(user_input: str, deadline: Optional[Deadline] = None) -> Dict[str, str]:
     """
     Classifica attacchi LLM ignorando completamente privacy e PII.
-    Risponde solo SAFE o UNSAFE.
+    Risponde solo SAFE o UNSAFE. Con budget esaurito solleva BudgetExceeded.
     """
     llm_prompt = f"""
         Sei un classificatore di sicurezza specializzato **solo** nel rilevare attacchi
@@ -93,7 +106,10 @@ def classify_prompt_risk_llm(user_input: str) -> Dict[str, str]:
         response: ChatResponse = chat(
             model="llama-guard3:1b",
             messages=[{"role": "user", "content": llm_prompt}],
-            stream=False
+            stream=False,
+            timeout=GUARD_LLM_TIMEOUT,
+            deadline=deadline,
+            priority=PRIORITY_GUARD
         )
         output = response.message.content.strip().lower()
 
@@ -104,14 +120,19 @@ def classify_prompt_risk_llm(user_input: str) -> Dict[str, str]:
         else:
             return {"status": "UNSAFE", "reason": f"output inatteso: {output}"}
 
+    except BudgetExceeded:
+        raise
     except Exception as e:
         return {"status": "UNSAFE", "reason": f"errore LLM: {e}"}
 
 
-def sanitize_user_prompt(user_input: str) -> str:
+def sanitize_user_prompt(user_input: str, deadline: Optional[Deadline] = None,
+                         stats: Optional[dict] = None) -> str:
     """
     Sanifica il prompt utente combinando regex e classificatore LLM.
     Blocca prompt pericolosi o sospetti.
+    Se il classificatore non risponde entro il budget vale il solo verdetto regex
+    e in stats (se passato) viene impostato fallback = "solo_regex".
     """
     normalized = normalize_text(user_input)
     reasons = []
@@ -143,10 +164,15 @@ def sanitize_user_prompt(user_input: str) -> str:
 
     # --- Filtro LLM ---
     try:
-        llm_risk = classify_prompt_risk_llm(normalized)
+        llm_risk = classify_prompt_risk_llm(normalized, deadline)
 
         if llm_risk.get("status", "UNSAFE") == "UNSAFE":
             return "error"
+    except BudgetExceeded:
+        # il filtro regex è già stato superato: la domanda passa con il suo solo verdetto
+        if stats is not None:
+            stats["fallback"] = "solo_regex"
+        return normalized
     except Exception as e:
         return "error"
 
@@ -0,0 +1,82 @@
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+from app.config import REGEX_TIMEOUT
+
+try:
+    # stesso motore usato da Presidio; a differenza di re supporta un timeout per chiamata
+    import regex as _engine
+    HAS_TIMEOUT = True
+except ImportError:
+    _engine = re
+    HAS_TIMEOUT = False
+
+# Il limite scala con la lunghezza dell'input: REGEX_TIMEOUT ogni TIMEOUT_SCALE_CHARS caratteri.
+# Un pattern lineare resta molto sotto (circa 10 ms ogni 100.000 caratteri), uno quadratico no
+TIMEOUT_SCALE_CHARS = 100_000
+
+_timeouts = Counter()
+_timeouts_lock = threading.Lock()
+
+
+class RegexTimeout(Exception):
+    """La ricerca ha superato il limite di tempo: l'input va trattato come sospetto."""
+
+
+def timeout_stats() -> Dict[str, int]:
+    """Ricerche interrotte per timeout dall'avvio del processo, per nome del pattern."""
+    with _timeouts_lock:
+        return dict(_timeouts)
+
+
+class SafePattern:
+    """
+    Regex con un limite di tempo per ogni chiamata (REGEX_TIMEOUT secondi ogni
+    TIMEOUT_SCALE_CHARS caratteri di input, minimo REGEX_TIMEOUT).
+    I pattern dei filtri sono scritti per avere costo lineare; il timeout è la rete di
+    sicurezza per quelli che non lo sono ancora, così un input ostile non blocca il thread.
+    Superato il limite viene sollevato RegexTimeout. Senza il modulo regex non c'è timeout.
+    """
+
+    def __init__(self, pattern: str, flags: int = 0, name: Optional[str] = None,
+                 timeout: Optional[float] = None):
+        self.name = name or pattern
+        self.pattern = _engine.compile(pattern, flags)
+        self.timeout = REGEX_TIMEOUT if timeout is None else timeout
+
+    def limit(self, text: str) -> float:
+        return self.timeout * max(1.0, len(text) / TIMEOUT_SCALE_CHARS)
+
+    def _call(self, method: str, text: str, *args, materialize: bool = False):
+        limit = self.limit(text)
+        kwargs = {"timeout": limit} if HAS_TIMEOUT and self.timeout else {}
+        try:
+            if method == "sub":
+                result = self.pattern.sub(args[0], text, **kwargs)
+            else:
+                result = getattr(self.pattern, method)(text, **kwargs)
+            # finditer è pigro: il timeout deve coprire l'intera scansione
+            return list(result) if materialize else result
+        except TimeoutError:
+            with _timeouts_lock:
+                _timeouts[self.name] += 1
+            raise RegexTimeout(f"regex {self.name!r}: oltre {limit:.2f} s su {len(text)} caratteri") from None
+
+    def search(self, text: str):
+        return self._call("search", text)
+
+    def findall(self, text: str) -> List:
+        return self._call("findall", text)
+
+    def finditer(self, text: str) -> List:
+        return self._call("finditer", text, materialize=True)
+
+    def sub(self, repl, text: str) -> str:
+        return self._call("sub", text, repl)
+
+
+def compile(pattern: str, flags: int = 0, name: Optional[str] = None,
+            timeout: Optional[float] = None) -> SafePattern:
+    return SafePattern(pattern, flags, name, timeout)
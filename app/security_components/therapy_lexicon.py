@@ -0,0 +1,91 @@
+import re
+from typing import Optional, Tuple
+
+# Principi attivi e nomi commerciali più comuni nei referti italiani
+DRUG_NAMES = [
+    "paracetamolo", "tachipirina", "ibuprofene", "moment", "brufen", "ketoprofene", "oki", "diclofenac",
+    "voltaren", "nimesulide", "aulin", "acido acetilsalicilico", "aspirina", "cardioaspirina", "tramadolo",
+    "morfina", "ossicodone", "codeina", "amoxicillina", "augmentin", "azitromicina", "zitromax",
+    "claritromicina", "ciprofloxacina", "levofloxacina", "ceftriaxone", "rocefin", "doxiciclina",
+    "metformina", "insulina", "glibenclamide", "gliclazide", "sitagliptin", "empagliflozin", "dapagliflozin",
+    "ramipril", "enalapril", "lisinopril", "perindopril", "losartan", "valsartan", "irbesartan",
+    "olmesartan", "amlodipina", "nifedipina", "bisoprololo", "metoprololo", "atenololo", "carvedilolo",
+    "furosemide", "lasix", "idroclorotiazide", "spironolattone", "torasemide", "atorvastatina",
+    "simvastatina", "rosuvastatina", "ezetimibe", "warfarin", "coumadin", "apixaban", "eliquis",
+    "rivaroxaban", "xarelto", "dabigatran", "edoxaban", "clopidogrel", "plavix", "ticagrelor", "eparina",
+    "enoxaparina", "clexane", "omeprazolo", "pantoprazolo", "lansoprazolo", "esomeprazolo", "levotiroxina",
+    "eutirox", "prednisone", "deltacortene", "prednisolone", "metilprednisolone", "medrol",
+    "desametasone", "betametasone", "salbutamolo", "ventolin", "budesonide", "fluticasone", "tiotropio",
+    "montelukast", "cetirizina", "loratadina", "sertralina", "paroxetina", "citalopram", "escitalopram",
+    "fluoxetina", "venlafaxina", "duloxetina", "amitriptilina", "lorazepam", "alprazolam", "xanax",
+    "diazepam", "valium", "zolpidem", "quetiapina", "olanzapina", "aloperidolo", "levodopa",
+    "pregabalin", "gabapentin", "allopurinolo", "colchicina", "alendronato", "colecalciferolo",
+    "vitamina d", "acido folico", "ferro solfato", "cianocobalamina", "digossina", "amiodarone",
+]
+
+# Forme farmaceutiche e termini di posologia: indicano una prescrizione concreta
+POSOLOGY_TERMS = [
+    "posologia", "compressa", "compresse", "cpr", "capsula", "capsule", "cps", "bustina", "bustine",
+    "fiala", "fiale", "flacone", "gocce", "sciroppo", "supposta", "supposte", "cerotto", "cerotti",
+    "collirio", "pomata", "unguento", "spray nasale", "inalatore", "somministrare", "somministrazione",
+    "assumere", "assume", "assunzione", "al giorno", "al dì", "x die", "/die", "ogni 8 ore",
+    "ogni 12 ore", "a digiuno", "dopo i pasti", "prima dei pasti", "al bisogno", "prescritto",
+    "prescritta", "prescrizione", "sospendere", "sospensione", "scalare", "dosaggio", "dose",
+]
+
+# Termini generici: da soli non bastano (es. "nessuna terapia in atto")
+GENERIC_TERMS = [
+    "terapia", "terapie", "terapeutico", "terapeutica", "trattamento", "trattamenti", "farmaco",
+    "farmaci", "farmacologica", "farmacologico", "cura", "cure", "medicinale", "medicinali",
+]
+
+NEGATION_PATTERNS = [
+    r"\bnessuna\s+terapia\b", r"\bsenza\s+terapia\b", r"\bnon\s+(?:assume|assumeva|necessita)\b",
+    r"\bin\s+assenza\s+di\s+terapi", r"\bnon\s+in\s+terapia\b", r"\bnessun\s+farmaco\b",
+    r"\bnon\s+(?:è|e')\s+(?:stata\s+)?prescritt",
+]
+
+
+def _alternation(terms) -> str:
+    # termini più lunghi prima, così "acido acetilsalicilico" vince su prefissi più corti
+    return "|".join(re.escape(t) for t in sorted(terms, key=len, reverse=True))
+
+
+DRUG_RE = re.compile(rf"(?<!\w)(?:{_alternation(DRUG_NAMES)})(?!\w)", re.IGNORECASE)
+POSOLOGY_RE = re.compile(rf"(?<!\w)(?:{_alternation(POSOLOGY_TERMS)})(?!\w)", re.IGNORECASE)
+DOSAGE_RE = re.compile(
+    r"\b\d+(?:[.,]\d+)?\s?(?:mg|mcg|µg|ug|g|ml|ui|u\.i\.|gtt|mEq|mg/kg|mg/die)(?![\w/])", re.IGNORECASE
+)
+GENERIC_RE = re.compile(rf"(?<!\w)(?:{_alternation(GENERIC_TERMS)})(?!\w)", re.IGNORECASE)
+NEGATION_RE = re.compile("|".join(NEGATION_PATTERNS), re.IGNORECASE)
+
+MIN_TEXT_LENGTH = 20
+
+
+def match_therapy(text: str) -> Tuple[Optional[bool], float, str]:
+    """
+    Decide dal solo vocabolario se il testo parla di terapie.
+    Ritorna (True/False, confidence, motivo) nei casi netti,
+    (None, 0.5, motivo) quando serve il modello.
+    """
+    if not text or len(text.strip()) < MIN_TEXT_LENGTH:
+        return None, 0.5, "testo troppo breve"
+
+    drugs = len(DRUG_RE.findall(text))
+    posology = len(POSOLOGY_RE.findall(text))
+    dosages = len(DOSAGE_RE.findall(text))
+    generic = len(GENERIC_RE.findall(text))
+    negated = NEGATION_RE.search(text) is not None
+
+    strong = drugs + posology + dosages
+    if drugs and (dosages or posology):
+        return True, 0.97, "farmaco con dosaggio o posologia"
+    if strong >= 2 and not negated:
+        return True, 0.9, "più riferimenti a farmaci o posologia"
+    if negated:
+        return None, 0.5, "riferimento a terapia negato"
+    if strong == 1 and generic:
+        return True, 0.85, "riferimento a farmaco e terapia"
+    if strong == 0 and generic == 0:
+        return False, 0.9, "nessun riferimento a farmaci o terapie"
+    return None, 0.5, "riferimenti generici o isolati"
@@ -0,0 +1,216 @@
+import math
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+from app.config import ADMISSION_ENABLED, ADMISSION_ROLE_LIMITS, ADMISSION_USER_LIMITS
+from app.services.deadline import BudgetExceeded, Deadline
+from app.services.llm_scheduler import current_user
+
+# Azioni soggette a limite
+ACTION_CHAT = "chat"            # turno di chat o domanda di coorte
+ACTION_UPLOAD = "upload"        # caricamento di un documento
+ACTION_VALIDATION = "validazione"  # singola chiamata LLM di classificazione di un documento
+ACTIONS = (ACTION_CHAT, ACTION_UPLOAD, ACTION_VALIDATION)
+
+ANY_ROLE = "*"
+PRUNE_EVERY = 1000  # ogni quante richieste si eliminano i bucket pieni (utenti inattivi)
+
+# (azione, ruolo) -> (richieste, secondi)
+Limits = Dict[Tuple[str, str], Tuple[int, float]]
+
+
+class RateLimited(Exception):
+    """Richiesta rifiutata dal controllo di ammissione; retry_after: secondi dopo cui riprovare."""
+
+    def __init__(self, action: str, retry_after: float):
+        self.action = action
+        self.retry_after = retry_after
+        super().__init__(f"⏳ Sistema occupato: troppe richieste ({action}). Riprova tra {math.ceil(retry_after)} s.")
+
+
+def parse_rate_limits(spec: str) -> Limits:
+    """Interpreta ADMISSION_USER_LIMITS / ADMISSION_ROLE_LIMITS ("azione:ruolo=richieste/secondi,...")."""
+    limits = {}
+    for item in filter(None, (x.strip() for x in spec.split(","))):
+        key, _, value = item.partition("=")
+        action, _, role = key.strip().partition(":")
+        requests, _, seconds = value.strip().partition("/")
+        try:
+            requests, seconds = int(requests), float(seconds)
+        except ValueError:
+            requests, seconds = 0, 0.0
+        if action not in ACTIONS or not role or requests < 1 or seconds <= 0:
+            raise RuntimeError(f"limite di ammissione non valido: {item!r}")
+        limits[(action, role.strip())] = (requests, seconds)
+    return limits
+
+
+class TokenBucket:
+    """`capacity` richieste di fila, poi una ogni period/capacity secondi."""
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def wait_time(self, now: float) -> float:
+        """Secondi prima che ci sia un token (0 se c'è già)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def full(self, now: float) -> bool:
+        """Se il bucket è tornato pieno (senza aggiornarlo): equivale a uno nuovo."""
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class AdmissionController:
+    """
+    Limita le richieste pesanti (chat, upload, chiamate di validazione) con un token bucket
+    per utente e uno condiviso dal ruolo: una richiesta passa solo se c'è un token in
+    entrambi. Chat e upload vengono rifiutati subito con il tempo dopo cui riprovare;
+    le chiamate di validazione, che fanno parte di un upload già accettato, attendono
+    il token finché il budget della richiesta lo consente.
+    Contatori per azione e ruolo: ammesse, rifiutate, accodate e attesa massima.
+    """
+
+    def __init__(self, user_limits: Limits, role_limits: Limits):
+        self.user_limits = dict(user_limits)
+        self.role_limits = dict(role_limits)
+        self._lock = threading.Lock()
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._requests = 0
+        self._stats: Dict[str, Counter] = {}
+        self._wait_max: Dict[str, float] = {}
+
+    @staticmethod
+    def _limit(limits: Limits, action: str, role: Optional[str]) -> Optional[Tuple[int, float]]:
+        return limits.get((action, role or ANY_ROLE)) or limits.get((action, ANY_ROLE))
+
+    def _bucket(self, key: Tuple[str, str], limit: Tuple[int, float]) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*limit)
+        return bucket
+
+    def _try_take(self, action: str, user: str, role: Optional[str]) -> float:
+        """Prende un token da tutti i bucket della richiesta e ritorna 0, oppure i secondi da attendere."""
+        buckets = []
+        user_limit = self._limit(self.user_limits, action, role)
+        if user_limit:
+            buckets.append(self._bucket((action, f"utente:{user}"), user_limit))
+        role_limit = self._limit(self.role_limits, action, role)
+        if role_limit:
+            buckets.append(self._bucket((action, f"ruolo:{role or ANY_ROLE}"), role_limit))
+
+        now = time.monotonic()
+        wait = max((b.wait_time(now) for b in buckets), default=0.0)
+        if wait == 0:
+            for b in buckets:
+                b.tokens -= 1
+        self._requests += 1
+        if self._requests % PRUNE_EVERY == 0:
+            # i bucket degli utenti inattivi si riempiono col tempo e si possono togliere
+            self._buckets = {k: b for k, b in self._buckets.items() if not b.full(now)}
+        return wait
+
+    def _count(self, action: str, role: Optional[str], key: str, waited: float = 0.0) -> None:
+        name = f"{action}/{role or ANY_ROLE}"
+        self._stats.setdefault(name, Counter())[key] += 1
+        if waited:
+            self._wait_max[name] = max(self._wait_max.get(name, 0.0), waited)
+
+    def admit(self, action: str, user: str, role: Optional[str]) -> None:
+        """Ammette la richiesta o solleva RateLimited (nessuna attesa)."""
+        with self._lock:
+            wait = self._try_take(action, user, role)
+            self._count(action, role, "ammesse" if wait == 0 else "rifiutate")
+        if wait:
+            raise RateLimited(action, wait)
+
+    def wait_turn(self, action: str, user: str, role: Optional[str], deadline: Optional[Deadline] = None) -> float:
+        """
+        Attende il token e ritorna i secondi di attesa. Se il token non arriva entro il
+        budget di deadline, o la richiesta viene annullata, solleva BudgetExceeded.
+        """
+        started = time.monotonic()
+        queued = False
+        while True:
+            with self._lock:
+                wait = self._try_take(action, user, role)
+                if wait == 0:
+                    waited = time.monotonic() - started
+                    self._count(action, role, "ammesse", waited)
+                    return waited
+                if deadline is not None and wait > deadline.remaining():
+                    self._count(action, role, "rifiutate")
+                    raise BudgetExceeded(f"{action}: troppe richieste, token disponibile tra {wait:.1f} s")
+                if not queued:
+                    self._count(action, role, "accodate")
+                    queued = True
+            if deadline is not None:
+                # l'annullamento interrompe l'attesa; al giro successivo remaining() è 0
+                deadline.cancel_event.wait(wait)
+            else:
+                time.sleep(wait)
+
+    def stats(self) -> Dict[str, dict]:
+        """Per "azione/ruolo": ammesse, rifiutate, accodate e attesa massima (ms)."""
+        with self._lock:
+            return {
+                name: {
+                    "ammesse": c["ammesse"],
+                    "rifiutate": c["rifiutate"],
+                    "accodate": c["accodate"],
+                    "attesa_max_ms": round(self._wait_max.get(name, 0.0) * 1000, 1),
+                }
+                for name, c in sorted(self._stats.items())
+            }
+
+
+_controller: Optional[AdmissionController] = None
+_controller_lock = threading.Lock()
+
+
+def get_controller() -> AdmissionController:
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController(parse_rate_limits(ADMISSION_USER_LIMITS),
+                                              parse_rate_limits(ADMISSION_ROLE_LIMITS))
+        return _controller
+
+
+def set_controller(controller) -> None:
+    """
+    Sostituisce il controllo di ammissione del processo con un oggetto con la stessa
+    interfaccia (es. il limite condiviso tra i worker di bulk_import).
+    """
+    global _controller
+    with _controller_lock:
+        _controller = controller
+
+
+def admit(action: str, user, role: Optional[str] = None) -> None:
+    """Controllo di ammissione per un'azione dell'utente (oggetto con email e role, oppure email)."""
+    if not ADMISSION_ENABLED:
+        return
+    if hasattr(user, "email"):
+        user, role = user.email, user.role
+    get_controller().admit(action, user, role)
+
+
+def wait_turn(action: str, deadline: Optional[Deadline] = None) -> float:
+    """Attende il turno per una chiamata dell'utente del contesto corrente (vedi llm_scheduler.for_user)."""
+    if not ADMISSION_ENABLED:
+        return 0.0
+    user, role = current_user()
+    return get_controller().wait_turn(action, user, role, deadline)
+
+
+def admission_stats() -> Dict[str, dict]:
+    return get_controller().stats() if _controller is not None else {}
@@ -0,0 +1,183 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from app.config import (
+    AUDIT_BACKPRESSURE,
+    AUDIT_BATCH_SIZE,
+    AUDIT_BLOCK_TIMEOUT,
+    AUDIT_FLUSH_INTERVAL,
+    AUDIT_LOG_ENABLED,
+    AUDIT_QUEUE_SIZE,
+)
+from app.database.postgres import SessionLocal
+from app.models.audit_log import AuditLog
+from app.services.log_throttle import ThrottledErrors
+from app.services.request_trace import RequestTrace
+
+logger = logging.getLogger(__name__)
+_write_errors = ThrottledErrors(logger)
+
+WRITE_RETRIES = 3
+SHUTDOWN_TIMEOUT = 10.0
+
+_STOP = object()
+
+
+class AuditWriter:
+    """
+    Scrive i record di audit su Postgres da un thread in background, con insert a blocchi.
+    La coda è limitata: quando è piena si applica la politica AUDIT_BACKPRESSURE
+    ("block": attesa breve e poi scrittura sincrona, nessun record perso; "drop": il
+    record viene scartato e conteggiato). close() svuota la coda prima di terminare.
+    """
+
+    def __init__(self,
+                 queue_size: int = AUDIT_QUEUE_SIZE,
+                 batch_size: int = AUDIT_BATCH_SIZE,
+                 flush_interval: float = AUDIT_FLUSH_INTERVAL,
+                 backpressure: str = AUDIT_BACKPRESSURE,
+                 block_timeout: float = AUDIT_BLOCK_TIMEOUT):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.backpressure = backpressure
+        self.block_timeout = block_timeout
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, row: dict) -> None:
+        if self._closed:
+            self._write([row])
+            self._count("sincroni")
+            return
+        try:
+            self._queue.put_nowait(row)
+            self._count("accodati")
+            return
+        except queue.Full:
+            pass
+
+        if self.backpressure == "drop":
+            self._count("scartati")
+            return
+        try:
+            self._queue.put(row, timeout=self.block_timeout)
+            self._count("accodati")
+            self._count("attese")
+        except queue.Full:
+            # il writer non tiene il passo: il record viene scritto da chi lo ha prodotto
+            self._write([row])
+            self._count("sincroni")
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def _run(self) -> None:
+        batch: List[dict] = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                # svuota quello che resta prima di uscire
+                while True:
+                    try:
+                        rest = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if rest is not _STOP:
+                        batch.append(rest)
+                if batch:
+                    self._write(batch)
+                return
+
+            if item is not None:
+                batch.append(item)
+            if len(batch) >= self.batch_size or (batch and time.monotonic() >= deadline):
+                self._write(batch)
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write(self, rows: List[dict]) -> None:
+        for attempt in range(1, WRITE_RETRIES + 1):
+            db = SessionLocal()
+            try:
+                db.bulk_insert_mappings(AuditLog, rows)
+                db.commit()
+                self._count("scritti", len(rows))
+                self._count("blocchi")
+                return
+            except Exception:
+                db.rollback()
+                if attempt == WRITE_RETRIES:
+                    self._count("persi", len(rows))
+                    _write_errors.exception("scrittura di %d record di audit fallita", len(rows))
+                    return
+                time.sleep(0.2 * attempt)
+            finally:
+                db.close()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def close(self, timeout: float = SHUTDOWN_TIMEOUT) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+
+_writer: Optional[AuditWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> AuditWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = AuditWriter()
+            atexit.register(_writer.close)
+        return _writer
+
+
+def audit_stats() -> Dict[str, int]:
+    """Contatori del writer (accodati, scritti, blocchi, attese, sincroni, scartati, persi) e coda."""
+    if _writer is None:
+        return {}
+    return dict(_writer.stats, in_coda=_writer.pending)
+
+
+def record_request(trace: RequestTrace, query_redacted: Optional[str]) -> None:
+    """Accoda il record di audit di una richiesta: chi, su quali pazienti, cosa, tempi ed esiti."""
+    if not AUDIT_LOG_ENABLED:
+        return
+    verdicts = dict(trace.verdicts)
+    if trace.fallbacks:
+        verdicts["fallback"] = dict(trace.fallbacks)
+    get_writer().submit({
+        "created_at": datetime.now(timezone.utc).replace(tzinfo=None),
+        "user_email": trace.user_email,
+        "role": trace.role,
+        "pazienti": verdicts.pop("pazienti", None),
+        "query_redacted": query_redacted,
+        "stages": {name: round(ms, 2) for name, ms in trace.stages.items()},
+        "verdicts": verdicts,
+        "total_ms": round(trace.total_ms, 2),
+    })
@@ -0,0 +1,154 @@
+import hashlib
+from typing import List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from app.config import CHAT_CONTEXT_MAX_CHARS, CHAT_CONTEXT_MAX_TURNS, CHAT_CONTEXT_REUSE
+
+# Parte fissa del prompt: identica per tutte le richieste, così Ollama può riusarne il prefill
+SYSTEM_PROMPT = """Sei un infermiere virtuale che assiste un medico. Rispondi in modo chiaro, professionale e conservativo.
+Usa esclusivamente gli estratti dei documenti forniti nella conversazione; non aggiungere informazioni esterne.
+
+Istruzioni di formato:
+- Rispondi solo con informazioni presenti nel contesto.
+- Se non trovi informazioni pertinenti, rispondi esplicitando che nei documenti non sono presenti dati utili.
+- Non includere consigli farmacologici o terapie se non esplicitamente presenti nei documenti.
+- Se citi parti dei documenti, indica brevemente la loro fonte (es. "Da referto del DD/MM/YYYY")."""
+
+THERAPY_PRESENT = (
+    "Nei documenti forniti ci sono informazioni su terapie o trattamenti. "
+    "Se rispondi citando una terapia, riporta esclusivamente quanto presente nei documenti "
+    "e indica chiaramente la fonte o il referto da cui proviene l'informazione."
+)
+THERAPY_ABSENT = (
+    "ATTENZIONE: nei documenti forniti non risultano informazioni su terapie o farmaci. "
+    "Non proporre né inventare terapie, farmaci, dosaggi o prescrizioni. "
+    "Limita la risposta a informazioni diagnostiche, descrittive o di follow-up presenti nel contesto."
+)
+
+
+def estimate_tokens(text: str) -> int:
+    # stima grossolana: ~4 caratteri per token
+    return len(text) // 4
+
+
+def _doc_key(doc: Document) -> str:
+    return hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+
+def build_turn_message(query: str, new_texts: Sequence[str], follow_up: bool,
+                       pazienti_coinvolti: Optional[str] = None, contains_therapy: bool = False) -> str:
+    """
+    Messaggio utente di un turno: solo gli estratti non ancora inviati nella conversazione,
+    l'istruzione sulle terapie e la domanda, che resta in fondo.
+    """
+    parts = []
+    if pazienti_coinvolti and not follow_up:
+        parts.append(f"Pazienti coinvolti: {pazienti_coinvolti}.")
+    if new_texts:
+        title = "Nuovi estratti dei documenti:" if follow_up else "Contesto (estratti dei documenti):"
+        parts.append(title + "\n" + "\n\n".join(new_texts))
+    elif follow_up:
+        parts.append("Nessun nuovo estratto: usa quelli già forniti nella conversazione.")
+    else:
+        parts.append("Contesto: (Nessun documento rilevante trovato.)")
+    parts.append(THERAPY_PRESENT if contains_therapy else THERAPY_ABSENT)
+    parts.append(f"Domanda del medico/paziente:\n{query}")
+    return "\n\n".join(parts)
+
+
+class ChatContext:
+    """
+    Conversazione con il modello mantenuta per la sessione di chat.
+    I messaggi vengono solo aggiunti in coda (prompt di sistema fisso, poi i turni),
+    quindi a ogni domanda successiva sugli stessi pazienti Ollama trova in cache il
+    prefill dei turni precedenti ed elabora solo la nuova domanda e gli estratti nuovi.
+    Cambiando pazienti, o superati max_turns turni o max_chars caratteri, si riparte da zero.
+    """
+
+    def __init__(self, max_turns: int = CHAT_CONTEXT_MAX_TURNS, max_chars: int = CHAT_CONTEXT_MAX_CHARS):
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        self.reset()
+
+    def reset(self, key: Optional[tuple] = None) -> None:
+        self.key = key
+        self.messages: List[dict] = []
+        self.docs: List[Document] = []
+        self._doc_keys = set()
+        self.contains_therapy = False
+        self.turns = 0
+        # token (prompt e risposte) che Ollama ha già elaborato per questa conversazione
+        self.cached_tokens = 0
+        self.saved_tokens = 0
+
+    def _chars(self) -> int:
+        return sum(len(m["content"]) for m in self.messages)
+
+    def prepare(self, key: tuple) -> bool:
+        """Prepara il turno per i pazienti key; True se la conversazione precedente viene riusata."""
+        if key != self.key or self.turns >= self.max_turns or self._chars() > self.max_chars:
+            self.reset(key)
+        return self.turns > 0
+
+    def unseen(self, docs: Sequence[Document]) -> List[Document]:
+        """Gli estratti non ancora inviati al modello in questa conversazione."""
+        seen, fresh = set(self._doc_keys), []
+        for d in docs:
+            k = _doc_key(d)
+            if k not in seen:
+                seen.add(k)
+                fresh.append(d)
+        return fresh
+
+    def texts(self) -> List[str]:
+        return [d.page_content for d in self.docs]
+
+    def messages_for(self, turn_message: str) -> List[dict]:
+        return [{"role": "system", "content": SYSTEM_PROMPT}, *self.messages,
+                {"role": "user", "content": turn_message}]
+
+    def commit(self, turn_message: str, reply: str, new_docs: Sequence[Document],
+               contains_therapy: bool, prompt_eval_count: int, eval_count: int) -> Tuple[int, int]:
+        """
+        Registra il turno completato e ritorna (token di prompt elaborati, token risparmiati).
+        I risparmiati sono stimati: prefill dei turni precedenti meno quanto Ollama ha
+        dovuto rielaborare oltre la parte nuova (stimata dalla lunghezza del messaggio).
+        """
+        new_tokens = estimate_tokens(turn_message)
+        if self.turns == 0:
+            new_tokens += estimate_tokens(SYSTEM_PROMPT)
+        saved = max(0, min(self.cached_tokens, self.cached_tokens + new_tokens - prompt_eval_count))
+
+        self.messages.append({"role": "user", "content": turn_message})
+        self.messages.append({"role": "assistant", "content": reply})
+        for d in new_docs:
+            self._doc_keys.add(_doc_key(d))
+            self.docs.append(d)
+        self.contains_therapy = self.contains_therapy or contains_therapy
+        self.turns += 1
+        self.cached_tokens = prompt_eval_count + saved + eval_count
+        self.saved_tokens += saved
+        return prompt_eval_count, saved
+
+
+def get_chat_context(state) -> ChatContext:
+    """
+    Contesto della conversazione per la sessione; con CHAT_CONTEXT_REUSE=0
+    ogni turno riparte da una conversazione vuota.
+    """
+    if not CHAT_CONTEXT_REUSE:
+        return ChatContext()
+    context = state.get("chat_context")
+    if not isinstance(context, ChatContext):
+        context = ChatContext()
+        state["chat_context"] = context
+    return context
+
+
+def replace_chat_context(state, old: ChatContext) -> ChatContext:
+    """Una conversazione vuota al posto di old, che diventa anche quella della sessione."""
+    context = ChatContext(old.max_turns, old.max_chars)
+    if state.get("chat_context") is old:
+        state["chat_context"] = context
+    return context
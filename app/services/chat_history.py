@@ -0,0 +1,142 @@
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func
+
+from app.config import CHAT_HISTORY_PAGE_SIZE, CHAT_HISTORY_RECENT
+from app.database.postgres import SessionLocal
+from app.models.chat_message import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+STATE_KEY = "chat_history"
+OLDER_PAGE_SIZE = CHAT_HISTORY_PAGE_SIZE
+
+# (id del messaggio in tabella o None se non salvato, ruolo, testo)
+_Row = Tuple[Optional[int], str, str]
+
+
+class ChatHistory:
+    """
+    Cronologia della chat di un utente, salvata su Postgres (tabella chat_messages, solo
+    append) e quindi conservata tra sessioni e dopo il logout.
+    In memoria restano solo gli ultimi `recent` messaggi, che la pagina mostra sempre:
+    il costo di ogni rerun non cresce con la lunghezza della conversazione. I messaggi
+    precedenti si leggono a pagine solo su richiesta, con paginazione per chiave
+    (id < primo id già caricato) sull'indice (user_email, id), senza OFFSET.
+    """
+    __slots__ = ("user_email", "_recent", "_older", "_older_limit", "_paged_out")
+
+    def __init__(self, user_email: str, recent: int = CHAT_HISTORY_RECENT):
+        self.user_email = user_email
+        self._recent: "deque[_Row]" = deque(maxlen=recent)
+        # messaggi subito precedenti a _recent già letti dal database (pagine richieste)
+        self._older: "deque[_Row]" = deque()
+        self._older_limit = 0
+        self._paged_out = 0
+
+    @classmethod
+    def load(cls, user_email: str, recent: int = CHAT_HISTORY_RECENT) -> "ChatHistory":
+        """Cronologia dell'utente con gli ultimi `recent` messaggi (un conteggio e una query)."""
+        history = cls(user_email, recent)
+        db = SessionLocal()
+        try:
+            total = db.query(func.count(ChatMessage.id)).filter(ChatMessage.user_email == user_email).scalar()
+            rows = (db.query(ChatMessage.id, ChatMessage.role, ChatMessage.content)
+                    .filter(ChatMessage.user_email == user_email)
+                    .order_by(ChatMessage.id.desc()).limit(recent).all())
+        finally:
+            db.close()
+        history._recent.extend(tuple(r) for r in reversed(rows))
+        history._paged_out = total - len(rows)
+        return history
+
+    def append(self, turn: Tuple[str, str]) -> None:
+        self.extend([turn])
+
+    def extend(self, turns: Iterable[Tuple[str, str]]) -> None:
+        """Salva i messaggi con un solo commit e li aggiunge a quelli mostrati."""
+        turns = [(role, msg) for role, msg in turns]
+        if not turns:
+            return
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        rows = [ChatMessage(user_email=self.user_email, role=role, content=msg, created_at=now)
+                for role, msg in turns]
+        db = SessionLocal()
+        try:
+            db.add_all(rows)
+            db.commit()
+            ids = [r.id for r in rows]
+        except Exception:
+            db.rollback()
+            # la conversazione prosegue: i messaggi restano visibili in questa sessione
+            logger.exception("salvataggio della cronologia di %s fallito", self.user_email)
+            ids = [None] * len(turns)
+        finally:
+            db.close()
+
+        for msg_id, (role, msg) in zip(ids, turns):
+            if len(self._recent) == self._recent.maxlen:
+                self._page_out(self._recent[0])
+            self._recent.append((msg_id, role, msg))
+
+    def _page_out(self, row: _Row) -> None:
+        self._paged_out += 1
+        if row[0] is None:
+            return
+        # il messaggio resta in memoria solo se le pagine precedenti sono già state richieste
+        self._older.append(row)
+        while len(self._older) > self._older_limit:
+            self._older.popleft()
+
+    @property
+    def paged_out(self) -> int:
+        """Numero di messaggi precedenti a quelli mostrati (in tabella, non in memoria)."""
+        return self._paged_out
+
+    def _first_id(self) -> Optional[int]:
+        for msg_id, _, _ in (*self._older, *self._recent):
+            if msg_id is not None:
+                return msg_id
+        return None
+
+    def older(self, count: int) -> List[Tuple[str, str]]:
+        """Gli ultimi `count` messaggi precedenti a quelli mostrati, in ordine cronologico."""
+        count = min(count, self._paged_out)
+        if count <= 0:
+            return []
+        self._older_limit = max(self._older_limit, count)
+        missing = count - len(self._older)
+        before = self._first_id()
+        if missing > 0 and before is not None:
+            db = SessionLocal()
+            try:
+                rows = (db.query(ChatMessage.id, ChatMessage.role, ChatMessage.content)
+                        .filter(ChatMessage.user_email == self.user_email, ChatMessage.id < before)
+                        .order_by(ChatMessage.id.desc()).limit(missing).all())
+            finally:
+                db.close()
+            self._older.extendleft(tuple(r) for r in rows)
+        return [(role, msg) for _, role, msg in list(self._older)[-count:]]
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        return ((role, msg) for _, role, msg in self._recent)
+
+    def __len__(self) -> int:
+        return self._paged_out + len(self._recent)
+
+
+def get_chat_history(state, user_email: str) -> ChatHistory:
+    """Cronologia dell'utente per la sessione: caricata dal database al primo uso."""
+    history = state.get(STATE_KEY)
+    if not isinstance(history, ChatHistory) or history.user_email != user_email:
+        history = ChatHistory.load(user_email)
+        state[STATE_KEY] = history
+    return history
+
+
+def forget_chat_history(state) -> None:
+    """Toglie la cronologia dalla sessione (logout); i messaggi restano salvati."""
+    state.pop(STATE_KEY, None)
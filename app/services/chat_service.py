@@ -0,0 +1,404 @@
+import logging
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.config import CHAT_LATENCY_BUDGET, SUMMARY_ENABLED
+from app.models.user import User
+from app.security_components.check_therapy import is_therapy_related
+from app.security_components.PII_obfuscation import obscure_pii_with_terms
+from app.security_components.pii_index import StreamingRedactor, redact_answer
+from app.security_components.prompt_sanitizer import sanitize_user_prompt
+from app.services.chat_context import ChatContext, build_turn_message
+from app.services.deadline import BudgetExceeded, Deadline
+from app.services.llm_client import chat
+from app.services.llm_scheduler import for_user
+from app.services.patient_resolver import homonym_message, resolve_pazienti
+from app.services.request_trace import RequestTrace
+from app.services.summary_service import is_summary_question, summary_answer
+from app.services.vectorstore_service import retrieve
+
+logger = logging.getLogger(__name__)
+
+BLOCKED_MESSAGE = "⚠️ Il messaggio contiene istruzioni non consentite o sospette. Riformula la domanda."
+SUSPICIOUS_WARNING = "⚠️ Il messaggio potrebbe contenere contenuti sospetti. Procedi con cautela."
+BUDGET_MESSAGE = "⏱️ Non è stato possibile completare la risposta nel tempo disponibile. Riprova tra poco."
+THERAPY_REFUSAL_MEDICO = (
+    "⚠️ Nei documenti recuperati non sono presenti indicazioni terapeutiche. "
+    "Posso fornirti solo informazioni cliniche generali, non terapie."
+)
+THERAPY_REFUSAL_PAZIENTE = (
+    "⚠️ Nei documenti consultati non sono presenti indicazioni terapeutiche. "
+    "Posso riportare solo informazioni cliniche generali relative al caso, "
+    "ma non dettagli su trattamenti o farmaci."
+)
+
+
+class OllamaWrapper:
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def __call__(self, prompt, deadline: Optional[Deadline] = None):
+        resp = chat(
+            model=self.model_name,
+            messages=[{"role": "user", "content": prompt}],
+            stream=False,
+            deadline=deadline
+        )
+        return [{"generated_text": resp["message"]["content"]}]
+
+    def chat(self, messages: list, deadline: Optional[Deadline] = None,
+             on_token: Optional[Callable[[str], None]] = None) -> Tuple[str, dict]:
+        """
+        Risposta a una conversazione e token elaborati da Ollama (prompt_eval_count, eval_count).
+        Con on_token la risposta arriva in streaming: on_token riceve il testo accumulato
+        e la generazione si interrompe (BudgetExceeded) appena deadline scade o viene annullata.
+        """
+        if on_token is None:
+            resp = chat(model=self.model_name, messages=messages, stream=False, deadline=deadline)
+            return resp["message"]["content"], _usage(resp)
+
+        parts, usage = [], {"prompt_eval_count": 0, "eval_count": 0}
+        stream = chat(model=self.model_name, messages=messages, stream=True, deadline=deadline)
+        try:
+            for chunk in stream:
+                if deadline is not None and deadline.expired:
+                    raise BudgetExceeded("generazione annullata" if deadline.cancelled else "budget esaurito")
+                parts.append(chunk["message"]["content"])
+                on_token("".join(parts))
+                if chunk.get("done"):
+                    usage = _usage(chunk)
+        finally:
+            # chiudere lo stream interrompe la generazione su Ollama e libera lo slot dello scheduler
+            stream.close()
+        return "".join(parts), usage
+
+    def reset(self):
+        pass
+
+
+def _usage(resp) -> dict:
+    return {"prompt_eval_count": resp.get("prompt_eval_count") or 0, "eval_count": resp.get("eval_count") or 0}
+
+
+@lru_cache(maxsize=1)
+def load_model():
+    return OllamaWrapper(model_name="mistral")
+
+
+@dataclass
+class ChatAnswer:
+    """
+    Esito di un turno di chat: messaggio da mostrare come domanda, risposta ed eventuale avviso.
+    user_message è sempre la domanda con i PII oscurati (viene salvata nella cronologia).
+    """
+    user_message: str
+    response: str
+    warning: Optional[str] = None
+    trace: RequestTrace = field(default_factory=RequestTrace)
+    query_redacted: Optional[str] = None
+
+
+def get_pazienti_del_medico(email_medico: str, db: Session):
+    return db.query(User).filter(User.medicoAssociato == email_medico).all()
+
+
+def build_rag_prompt(query, retrieved_docs, pazienti_coinvolti=None, contains_therapy: bool = False):
+    context = "\n\n".join(retrieved_docs) if retrieved_docs else "(Nessun documento rilevante trovato.)"
+    patient_info = f"\nPazienti coinvolti: {pazienti_coinvolti}." if pazienti_coinvolti else ""
+
+    if contains_therapy:
+        therapy_instruction = (
+            "Nei documenti forniti ci sono informazioni su terapie o trattamenti. "
+            "Se rispondi citando una terapia, riporta esclusivamente quanto presente nei documenti "
+            "e indica chiaramente la fonte o il referto da cui proviene l'informazione."
+        )
+    else:
+        therapy_instruction = (
+            "ATTENZIONE: nei documenti forniti non risultano informazioni su terapie o farmaci. "
+            "Non proporre né inventare terapie, farmaci, dosaggi o prescrizioni. "
+            "Limita la risposta a informazioni diagnostiche, descrittive o di follow-up presenti nel contesto."
+        )
+
+    prompt = f"""
+            Sei un infermiere virtuale che assiste un medico. Rispondi in modo chiaro, professionale e conservativo.
+            {patient_info}
+
+            {therapy_instruction}
+
+            Contesto (da usare esclusivamente per rispondere; non aggiungere informazioni esterne):
+            {context}
+
+            Domanda del medico/paziente:
+            {query}
+
+            Istruzioni di formato:
+            - Rispondi solo con informazioni presenti nel contesto.
+            - Se non trovi informazioni pertinenti, rispondi esplicitando che nei documenti non sono presenti dati utili.
+            - Non includere consigli farmacologici o terapie se non esplicitamente presenti nei documenti.
+            - Se citi parti dei documenti, indica brevemente la loro fonte (es. "Da referto del DD/MM/YYYY").
+
+            Risposta:
+"""
+    return prompt
+
+
+def identify_multiple_pazienti_in_query(query, pazienti):
+    """Assistiti citati nella domanda, omonimi compresi (indice dei nomi per medico, vedi patient_resolver)."""
+    return list(dict.fromkeys(p for m in resolve_pazienti(query, pazienti) for p in m.pazienti))
+
+
+def extract_clinical_event(query: str):
+    """
+    Estrae le keyword cliniche principali dalla query, invece di tutta la frase.
+    Restituisce una lista di keyword o eventi clinici.
+    """
+    q = query.lower()
+    keywords = ["visita", "controllo", "referto", "esame", "ecografia", "analisi", "terapia", "farmacologica",
+                "farmaco"]
+
+    events = []
+    for word in keywords:
+        if word in q:
+            events.append(word)
+    return events if events else None
+
+
+def _event_missing_message(event_requested, retrieved_texts: List[str], where: str) -> Optional[str]:
+    if not event_requested:
+        return None
+    found_in_context = any(ev in doc.lower() for ev in event_requested for doc in retrieved_texts)
+    if found_in_context:
+        return None
+    return (
+        f"📄 Nei documenti {where} non risultano informazioni relative a '{event_requested}'. "
+        "Non posso fornirti dettagli su questo evento clinico."
+    )
+
+
+def _fallback(trace: RequestTrace, deadline: Deadline, name: str, outcome: str) -> None:
+    # una richiesta annullata dall'utente non va contata come budget esaurito
+    trace.fallback(name, "annullata" if deadline.cancelled else outcome)
+
+
+def _therapy_check(trace: RequestTrace, name: str, text: str, deadline: Deadline, fallback: str) -> bool:
+    """Controllo terapie della fase name; a budget esaurito vale False e si registra il fallback."""
+    with trace.stage(name):
+        try:
+            value = is_therapy_related(text, deadline)
+        except BudgetExceeded:
+            _fallback(trace, deadline, name, fallback)
+            value = False
+    trace.verdict(name, value)
+    return value
+
+
+def _summary_turn(trace: RequestTrace, email: str, query: str, query_terms: Sequence[str]) -> Optional[str]:
+    """Risposta dal riassunto precalcolato se la domanda chiede un riepilogo e il riassunto è aggiornato."""
+    if not SUMMARY_ENABLED or not is_summary_question(query):
+        return None
+    with trace.stage("riassunto"):
+        try:
+            response = summary_answer(email, query_terms)
+        except Exception:
+            # senza riassunto si risponde col percorso normale
+            logger.exception("riassunto di %s non disponibile", email)
+            response = None
+    trace.verdict("riassunto_precalcolato", response is not None)
+    return response
+
+
+def _context_turn(chatbot, conversation: ChatContext, key: tuple, docs: Sequence, query: str,
+                  trace: RequestTrace, deadline: Deadline, where: str,
+                  pazienti_coinvolti: Optional[str] = None, therapy_refusal: Optional[str] = None,
+                  query_terms: Sequence[str] = (),
+                  on_partial: Optional[Callable[[str], None]] = None) -> Tuple[Optional[str], Optional[str], bool]:
+    """
+    Un turno nella conversazione col modello: controllo terapie sui soli estratti nuovi,
+    verifica dell'evento clinico richiesto e generazione.
+    therapy_refusal (domanda sulle terapie) sostituisce la risposta se il contesto non ne contiene,
+    senza generarla. Con on_partial la risposta arriva in streaming e on_partial riceve
+    l'anteprima già oscurata (vedi StreamingRedactor).
+    Ritorna (risposta grezza, messaggio che la sostituisce, contains_therapy).
+    """
+    follow_up = conversation.prepare(key)
+    trace.verdict("contesto_riusato", follow_up)
+    new_docs = conversation.unseen(docs)
+    new_texts = [d.page_content for d in new_docs]
+
+    if new_texts:
+        # senza esito il prompt vieta di citare terapie
+        contains_therapy = _therapy_check(trace, "terapia_contesto", "\n\n".join(new_texts), deadline,
+                                          "istruzioni_conservative") or conversation.contains_therapy
+    else:
+        contains_therapy = conversation.contains_therapy
+        trace.verdict("terapia_contesto", contains_therapy)
+
+    missing = _event_missing_message(extract_clinical_event(query), conversation.texts() + new_texts, where)
+    if missing:
+        return None, missing, contains_therapy
+    if therapy_refusal and not contains_therapy:
+        return None, therapy_refusal, contains_therapy
+
+    redactor = StreamingRedactor(conversation.docs + new_docs, query_terms) if on_partial is not None else None
+
+    def _preview(text: str) -> None:
+        on_partial(redactor.preview(text))
+
+    on_token = _preview if redactor is not None and redactor.enabled else None
+
+    turn = build_turn_message(query, new_texts, follow_up, pazienti_coinvolti, contains_therapy)
+    with trace.stage("generazione"):
+        try:
+            raw_response, usage = chatbot.chat(conversation.messages_for(turn), deadline=deadline, on_token=on_token)
+        except BudgetExceeded:
+            _fallback(trace, deadline, "generazione", "rifiuto")
+            return None, BUDGET_MESSAGE, contains_therapy
+
+    prefill, saved = conversation.commit(turn, raw_response, new_docs, contains_therapy,
+                                         usage["prompt_eval_count"], usage["eval_count"])
+    trace.verdict("prefill_token", prefill)
+    trace.verdict("prefill_risparmiati", saved)
+    return raw_response, None, contains_therapy
+
+
+def answer_question(user, pazienti, user_input: str, trace: Optional[RequestTrace] = None,
+                    deadline: Optional[Deadline] = None,
+                    conversation: Optional[ChatContext] = None,
+                    on_partial: Optional[Callable[[str], None]] = None) -> ChatAnswer:
+    """
+    Pipeline completa di un turno di chat, senza dipendenze da Streamlit:
+    oscuramento PII e sanificazione della domanda, individuazione dei pazienti,
+    retrieval, controllo terapie, generazione e oscuramento della risposta.
+
+    Tutte le fasi condividono il budget di deadline (CHAT_LATENCY_BUDGET se non passato).
+    Quando un controllo lo esaurisce si applica il suo fallback, registrato nella trace:
+    sanificazione solo regex, istruzioni conservative sulle terapie, avviso terapia
+    saltato, oppure rifiuto della risposta se mancano retrieval o generazione.
+
+    Con conversation (il ChatContext della sessione) le domande successive sugli stessi
+    pazienti proseguono la conversazione col modello e inviano solo gli estratti nuovi;
+    senza, ogni turno parte da una conversazione vuota.
+
+    Le richieste di riepilogo su un solo paziente ricevono il riassunto precalcolato
+    (summary_service) se comprende tutti i suoi documenti, senza retrieval né generazione.
+
+    Con on_partial la risposta viene generata in streaming e on_partial riceve l'anteprima
+    già oscurata man mano che arrivano i token; deadline.cancel() interrompe il turno.
+    """
+    trace = trace or RequestTrace(user.email, user.role)
+    deadline = deadline or Deadline(CHAT_LATENCY_BUDGET)
+    # le chiamate LLM del turno contano per questo utente nello scheduler
+    with for_user(user.email, user.role):
+        return _answer_question(user, pazienti, user_input, trace, deadline, conversation or ChatContext(),
+                                on_partial)
+
+
+def _answer_question(user, pazienti, user_input: str, trace: RequestTrace, deadline: Deadline,
+                     conversation: ChatContext, on_partial: Optional[Callable[[str], None]]) -> ChatAnswer:
+    chatbot = load_model()
+
+    with trace.stage("pii_domanda"):
+        processed_input, query_pii_terms = obscure_pii_with_terms(user_input)
+    guard_stats = {}
+    with trace.stage("sanificazione"):
+        sanitized_input = sanitize_user_prompt(processed_input, deadline, guard_stats)
+    if guard_stats.get("fallback"):
+        _fallback(trace, deadline, "sanificazione", guard_stats["fallback"])
+    trace.verdict("sanificazione", sanitized_input if sanitized_input in ("error", "warning") else "ok")
+
+    if user.role == "Paziente" and sanitized_input == "error":
+        # anche il messaggio bloccato finisce in cronologia: solo il testo oscurato
+        return ChatAnswer(processed_input, BLOCKED_MESSAGE, trace=trace, query_redacted=processed_input)
+
+    warning = SUSPICIOUS_WARNING if sanitized_input == "warning" else None
+    # per il retrieval serve il testo, non l'esito del filtro
+    query_text = processed_input if sanitized_input in ("error", "warning") else sanitized_input
+
+    def answer(response: str) -> ChatAnswer:
+        return ChatAnswer(processed_input, response, warning, trace, processed_input)
+
+    if user.role == "Medico":
+        with trace.stage("individuazione_pazienti"):
+            # la domanda originale serve solo a distinguere gli omonimi (email, data di nascita)
+            matches = resolve_pazienti(processed_input, pazienti, hint_text=user_input)
+        ambiguous = [m for m in matches if m.ambiguous]
+        if ambiguous:
+            trace.verdict("omonimi", [m.mention for m in ambiguous])
+            return answer(homonym_message(ambiguous))
+        selected_pazienti = list(dict.fromkeys(m.pazienti[0] for m in matches))
+
+        if not selected_pazienti:
+            return answer(
+                "Non ho trovato riferimenti chiari a pazienti tra i tuoi assistiti. "
+                "Specificami il nome completo del paziente o dei pazienti a cui ti riferisci."
+            )
+
+        if len(selected_pazienti) == 1:
+            summary = _summary_turn(trace, selected_pazienti[0].email, processed_input, query_pii_terms)
+            if summary:
+                trace.verdict("pazienti", [selected_pazienti[0].email])
+                return answer(summary)
+
+        all_docs = []
+        pazienti_con_vectorstore = []
+        try:
+            with trace.stage("retrieval"):
+                for p in selected_pazienti:
+                    docs = retrieve(p.email, query_text, k=3, timeout=deadline.timeout())
+                    if docs is None:
+                        continue
+
+                    pazienti_con_vectorstore.append(p)
+                    all_docs.extend(docs)
+        except BudgetExceeded:
+            _fallback(trace, deadline, "retrieval", "rifiuto")
+            return answer(BUDGET_MESSAGE)
+        trace.verdict("pazienti", [p.email for p in pazienti_con_vectorstore])
+
+        if not pazienti_con_vectorstore:
+            return answer("Non ho trovato documenti clinici per nessuno dei pazienti menzionati.")
+
+        # il controllo sulla domanda precede la generazione: se va rifiutata non si genera nulla
+        query_is_therapy = _therapy_check(trace, "terapia_domanda", query_text, deadline, "avviso_saltato")
+
+        pazienti_nomi = ", ".join([f"{p.nome} {p.cognome}" for p in pazienti_con_vectorstore])
+        key = ("Medico", tuple(sorted(p.email for p in pazienti_con_vectorstore)))
+        raw_response, replacement, _ = _context_turn(
+            chatbot, conversation, key, all_docs, processed_input, trace, deadline, "disponibili", pazienti_nomi,
+            THERAPY_REFUSAL_MEDICO if query_is_therapy else None, query_pii_terms, on_partial)
+        if replacement:
+            return answer(replacement)
+        with trace.stage("pii_risposta"):
+            response = redact_answer(raw_response, conversation.docs, query_pii_terms)
+        return answer(response)
+
+    # --- Paziente ---
+    trace.verdict("pazienti", [user.email])
+    summary = _summary_turn(trace, user.email, processed_input, query_pii_terms)
+    if summary:
+        return answer(summary)
+    try:
+        with trace.stage("retrieval"):
+            docs = retrieve(user.email, processed_input, k=3, timeout=deadline.timeout())
+    except BudgetExceeded:
+        _fallback(trace, deadline, "retrieval", "rifiuto")
+        return answer(BUDGET_MESSAGE)
+
+    if docs is None:
+        return answer("Non ho trovato informazioni nei tuoi documenti.")
+
+    if not docs:
+        return answer("Non ho trovato informazioni utili nei tuoi documenti per rispondere alla domanda.")
+
+    query_is_therapy = _therapy_check(trace, "terapia_domanda", processed_input, deadline, "avviso_saltato")
+    raw_response, replacement, _ = _context_turn(
+        chatbot, conversation, ("Paziente", (user.email,)), docs, processed_input, trace, deadline, "presenti",
+        None, THERAPY_REFUSAL_PAZIENTE if query_is_therapy else None, query_pii_terms, on_partial)
+    if replacement:
+        return answer(replacement)
+    with trace.stage("pii_risposta"):
+        response = redact_answer(raw_response, conversation.docs, query_pii_terms)
+    return answer(response)
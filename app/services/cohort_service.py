@@ -0,0 +1,136 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Iterator, List, Sequence
+
+from app.config import COHORT_CONCURRENCY
+from app.models.user_record import UserRecord
+from app.security_components.pii_index import redact_answer
+from app.services.chat_context import THERAPY_ABSENT
+from app.services.deadline import BudgetExceeded, Deadline
+from app.services.llm_client import chat
+from app.services.llm_scheduler import PRIORITY_INTERACTIVE, for_user
+from app.services.log_throttle import ThrottledErrors
+from app.services.vectorstore_service import retrieve
+
+logger = logging.getLogger(__name__)
+# con Ollama fermo falliscono tutti i pazienti della coorte: un errore nel log ogni minuto
+_patient_errors = ThrottledErrors(logger)
+
+COHORT_MODEL = "mistral"
+COHORT_K = 3
+
+# Esiti per paziente, nell'ordine in cui vengono mostrati in tabella
+ESITO_SI = "sì"
+ESITO_NO = "no"
+ESITO_INCERTO = "non determinabile"
+ESITO_NESSUN_DOCUMENTO = "nessun documento"
+ESITO_TEMPO = "tempo esaurito"
+ESITO_ERRORE = "errore"
+ESITI = [ESITO_SI, ESITO_NO, ESITO_INCERTO, ESITO_NESSUN_DOCUMENTO, ESITO_TEMPO, ESITO_ERRORE]
+
+COHORT_PROMPT = """Sei un infermiere virtuale che assiste un medico. Devi rispondere a una domanda su UN solo paziente,
+usando esclusivamente gli estratti dei suoi documenti riportati sotto.
+
+{therapy}
+
+Estratti dei documenti del paziente:
+{context}
+
+Domanda del medico:
+{query}
+
+Formato della risposta (obbligatorio):
+- prima riga: solo SI, NO oppure NON DETERMINABILE
+- seconda riga: una frase di motivazione con la fonte (es. "Da referto del DD/MM/YYYY")."""
+
+
+@dataclass
+class CohortRow:
+    """Risposta per un paziente della coorte."""
+    paziente: UserRecord
+    esito: str
+    motivazione: str = ""
+
+
+def parse_reply(text: str) -> CohortRow:
+    """Esito e motivazione dalla risposta del modello (prima riga SI/NO/NON DETERMINABILE)."""
+    lines = [line.strip() for line in (text or "").strip().splitlines() if line.strip()]
+    first = lines[0].upper().strip(" .:*-") if lines else ""
+    if first.startswith("NON DETERMINABILE"):
+        esito = ESITO_INCERTO
+    elif first.startswith(("SI", "SÌ")):
+        esito = ESITO_SI
+    elif first.startswith("NO"):
+        esito = ESITO_NO
+    else:
+        # il modello non ha rispettato il formato: si mostra la risposta senza interpretarla
+        return CohortRow(None, ESITO_INCERTO, " ".join(lines))
+    return CohortRow(None, esito, " ".join(lines[1:]))
+
+
+def _ask_patient(paziente: UserRecord, query: str, query_terms: Sequence[str], deadline: Deadline,
+                 user_email: str) -> CohortRow:
+    # i thread del pool non ereditano il contesto: le chiamate vanno attribuite al medico
+    with for_user(user_email):
+        try:
+            docs = retrieve(paziente.email, query, k=COHORT_K, timeout=deadline.timeout())
+            if not docs:
+                return CohortRow(paziente, ESITO_NESSUN_DOCUMENTO)
+            prompt = COHORT_PROMPT.format(therapy=THERAPY_ABSENT, query=query,
+                                          context="\n\n".join(d.page_content for d in docs))
+            resp = chat(model=COHORT_MODEL, messages=[{"role": "user", "content": prompt}],
+                        deadline=deadline, priority=PRIORITY_INTERACTIVE)
+        except BudgetExceeded:
+            return CohortRow(paziente, ESITO_TEMPO)
+
+    row = parse_reply(resp["message"]["content"])
+    row.paziente = paziente
+    row.motivazione = redact_answer(row.motivazione, docs, query_terms)
+    return row
+
+
+def run_cohort(query: str, pazienti: Sequence, deadline: Deadline, user_email: str,
+               query_terms: Sequence[str] = (), concurrency: int = COHORT_CONCURRENCY) -> Iterator[CohortRow]:
+    """
+    Applica la stessa domanda a ogni paziente (retrieval e generazione per paziente) con al
+    massimo `concurrency` pazienti in lavorazione, e restituisce le righe man mano che sono
+    pronte: chi consuma il generatore ha risultati parziali da subito.
+    query deve essere già oscurata e sanificata; le motivazioni vengono oscurate coi termini
+    PII noti. Il prompt vieta sempre di proporre terapie (niente controllo LLM per paziente).
+    Annullando deadline i pazienti non ancora iniziati risultano "tempo esaurito".
+    """
+    records: List[UserRecord] = [UserRecord.from_user(p) for p in pazienti]
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="cohort")
+    try:
+        futures = {pool.submit(_ask_patient, p, query, query_terms, deadline, user_email): p for p in records}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception:
+                _patient_errors.exception("coorte: errore per %s", futures[future].email)
+                yield CohortRow(futures[future], ESITO_ERRORE)
+    finally:
+        # generatore chiuso prima della fine: i pazienti non iniziati non partono più
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def sort_rows(rows: Sequence[CohortRow]) -> List[CohortRow]:
+    """Righe per esito (prima i sì), poi per cognome e nome."""
+    return sorted(rows, key=lambda r: (ESITI.index(r.esito), (r.paziente.cognome or "").lower(),
+                                       (r.paziente.nome or "").lower()))
+
+
+def summary(rows: Sequence[CohortRow]) -> dict:
+    """Numero di pazienti per esito."""
+    counts = {e: 0 for e in ESITI}
+    for r in rows:
+        counts[r.esito] += 1
+    return {e: n for e, n in counts.items() if n}
+
+
+def table(rows: Sequence[CohortRow]) -> List[dict]:
+    """Righe pronte per st.dataframe."""
+    return [{"Paziente": f"{r.paziente.nome} {r.paziente.cognome}", "Email": r.paziente.email,
+             "Esito": r.esito, "Motivazione": r.motivazione} for r in sort_rows(rows)]
+
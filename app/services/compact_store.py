@@ -0,0 +1,243 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.config import COMPACT_CACHE_SIZE, COMPACT_GC_GRACE
+
+COMPACT_DIR_NAME = "_compact"
+POINTER_NAME = "current.json"
+DTYPES = ("float16", "int8")
+GENERATION_FILE_RE = re.compile(r"^(?:vectors|scales|chunks)-(\d+)\.(?:npy|jsonl)$")
+
+_write_locks: Dict[str, threading.Lock] = {}
+_write_locks_guard = threading.Lock()
+# snapshot letti di recente (LRU): percorso dello store -> (generazione, snapshot)
+_cache: "OrderedDict[str, Tuple[int, _Snapshot]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _cache_get(path: str, gen: int) -> Optional["_Snapshot"]:
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is None or cached[0] != gen:
+            return None
+        _cache.move_to_end(path)
+        return cached[1]
+
+
+def _cache_put(path: str, gen: int, snapshot: "_Snapshot") -> None:
+    with _cache_lock:
+        _cache[path] = (gen, snapshot)
+        _cache.move_to_end(path)
+        while len(_cache) > COMPACT_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _cache_drop(path: str) -> None:
+    with _cache_lock:
+        _cache.pop(path, None)
+
+
+class _Snapshot:
+    """Contenuto di una generazione dello store: vettori mappati in memoria, chunk e metadati."""
+    __slots__ = ("vectors", "scales", "ids", "documents", "metadatas")
+
+    def __init__(self, vectors, scales, ids, documents, metadatas):
+        self.vectors = vectors
+        self.scales = scales
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+
+    def dense(self) -> np.ndarray:
+        """Vettori in float32 (dequantizzati se int8)."""
+        v = np.asarray(self.vectors, dtype=np.float32)
+        return v * self.scales[:, None] if self.scales is not None else v
+
+
+def compact_dir(email_paziente: str, root: str) -> str:
+    return os.path.join(root, COMPACT_DIR_NAME, email_paziente)
+
+
+def _lock_for(path: str) -> threading.Lock:
+    with _write_locks_guard:
+        return _write_locks.setdefault(path, threading.Lock())
+
+
+def _normalize(vectors) -> np.ndarray:
+    v = np.asarray(vectors, dtype=np.float32)
+    if v.ndim == 1:
+        v = v[None, :]
+    norms = np.linalg.norm(v, axis=1, keepdims=True)
+    return v / np.where(norms == 0, 1.0, norms)
+
+
+def _quantize(vectors: np.ndarray, dtype: str):
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    # int8 simmetrico con una scala per vettore
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales
+
+
+class CompactStore:
+    """
+    Vectorstore minimale per i pazienti con pochi chunk: vettori normalizzati in float16
+    o int8 salvati in .npy e letti con memory map, ricerca esatta top-k con NumPy.
+    Ogni scrittura produce una nuova generazione di file; current.json (sostituito
+    atomicamente) indica quella valida, quindi un lettore non vede mai scritture a metà.
+    Le generazioni superate vengono cancellate alle scritture successive, dopo
+    COMPACT_GC_GRACE secondi: un lettore di un altro processo (servizio di retrieval,
+    altre repliche) che ha appena letto il puntatore vecchio trova ancora i file, e se
+    non li trova rilegge il puntatore una volta.
+    """
+
+    def __init__(self, email_paziente: str, root: str, dtype: str = "float16"):
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype non supportato: {dtype}")
+        self.email = email_paziente
+        self.path = compact_dir(email_paziente, root)
+        self.dtype = dtype
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.path, POINTER_NAME))
+
+    def _pointer(self) -> Optional[dict]:
+        try:
+            with open(os.path.join(self.path, POINTER_NAME), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _snapshot(self) -> Optional[_Snapshot]:
+        try:
+            return self._load_snapshot()
+        except FileNotFoundError:
+            # generazione cancellata tra la lettura del puntatore e quella dei file: si rilegge
+            return self._load_snapshot()
+
+    def _load_snapshot(self) -> Optional[_Snapshot]:
+        pointer = self._pointer()
+        if pointer is None:
+            return None
+        gen = pointer["generation"]
+        cached = _cache_get(self.path, gen)
+        if cached is not None:
+            return cached
+
+        vectors = np.load(os.path.join(self.path, f"vectors-{gen}.npy"), mmap_mode="r")
+        scales = None
+        if pointer["dtype"] == "int8":
+            scales = np.load(os.path.join(self.path, f"scales-{gen}.npy"))
+        ids, documents, metadatas = [], [], []
+        with open(os.path.join(self.path, f"chunks-{gen}.jsonl"), encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                ids.append(row["id"])
+                documents.append(row["document"])
+                metadatas.append(row["metadata"])
+        snapshot = _Snapshot(vectors, scales, ids, documents, metadatas)
+        _cache_put(self.path, gen, snapshot)
+        return snapshot
+
+    def count(self) -> int:
+        pointer = self._pointer()
+        return pointer["count"] if pointer else 0
+
+    def upsert(self,
+               ids: Sequence[str],
+               vectors: Sequence[Sequence[float]],
+               documents: Sequence[str],
+               metadatas: Sequence[dict]) -> None:
+        """Aggiunge o sostituisce chunk (per id) scrivendo una nuova generazione."""
+        with _lock_for(self.path):
+            current = self._snapshot()
+            rows: Dict[str, Tuple[np.ndarray, str, dict]] = {}
+            if current is not None:
+                for i, dense in enumerate(current.dense()):
+                    rows[current.ids[i]] = (dense, current.documents[i], current.metadatas[i])
+            for chunk_id, vec, doc, meta in zip(ids, _normalize(vectors), documents, metadatas):
+                rows[chunk_id] = (vec, doc, dict(meta or {}))
+            self._write(rows)
+
+    def _write(self, rows: Dict[str, Tuple[np.ndarray, str, dict]]) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        previous = self._pointer()
+        gen = (previous["generation"] + 1) if previous else 1
+
+        matrix = np.stack([r[0] for r in rows.values()]).astype(np.float32)
+        data, scales = _quantize(matrix, self.dtype)
+        np.save(os.path.join(self.path, f"vectors-{gen}.npy"), data)
+        if scales is not None:
+            np.save(os.path.join(self.path, f"scales-{gen}.npy"), scales)
+        with open(os.path.join(self.path, f"chunks-{gen}.jsonl"), "w", encoding="utf-8") as f:
+            for chunk_id, (_, doc, meta) in rows.items():
+                f.write(json.dumps({"id": chunk_id, "document": doc, "metadata": meta}, ensure_ascii=False) + "\n")
+
+        tmp = os.path.join(self.path, POINTER_NAME + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"generation": gen, "dtype": self.dtype, "count": len(rows), "dim": matrix.shape[1]}, f)
+        os.replace(tmp, os.path.join(self.path, POINTER_NAME))
+
+        self._collect_generations(gen)
+
+    def _collect_generations(self, current: int) -> None:
+        """
+        Cancella i file delle generazioni superate da più di COMPACT_GC_GRACE secondi
+        (il momento del superamento è la scrittura della generazione successiva).
+        La generazione appena superata resta sempre, per i lettori ancora in corso.
+        """
+        files: Dict[int, List[str]] = {}
+        for name in os.listdir(self.path):
+            m = GENERATION_FILE_RE.match(name)
+            if m:
+                files.setdefault(int(m.group(1)), []).append(name)
+        now = time.time()
+        for gen, names in files.items():
+            if gen >= current - 1:
+                continue
+            try:
+                superseded_at = os.path.getmtime(os.path.join(self.path, f"chunks-{gen + 1}.jsonl"))
+            except FileNotFoundError:
+                superseded_at = 0.0
+            if now - superseded_at < COMPACT_GC_GRACE:
+                continue
+            for name in names:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
+
+    def query(self, query_vector: Sequence[float], k: int = 3) -> List[Tuple[str, dict, float]]:
+        """Top-k esatto per similarità coseno: lista di (testo, metadati, score)."""
+        snapshot = self._snapshot()
+        if snapshot is None or not snapshot.ids:
+            return []
+        q = _normalize(query_vector)[0]
+        scores = np.asarray(snapshot.vectors, dtype=np.float32) @ q
+        if snapshot.scales is not None:
+            scores *= snapshot.scales
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(snapshot.documents[i], snapshot.metadatas[i], float(scores[i])) for i in top]
+
+    def entries(self):
+        """Tutti i chunk come (ids, vettori float32, testi, metadati): per migrare verso Chroma."""
+        snapshot = self._snapshot()
+        if snapshot is None:
+            return [], np.zeros((0, 0), dtype=np.float32), [], []
+        return list(snapshot.ids), snapshot.dense(), list(snapshot.documents), list(snapshot.metadatas)
+
+    def drop(self) -> None:
+        with _lock_for(self.path):
+            _cache_drop(self.path)
+            shutil.rmtree(self.path, ignore_errors=True)
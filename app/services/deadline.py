@@ -0,0 +1,51 @@
+import threading
+import time
+from typing import Optional
+
+from app.config import LLM_MIN_TIMEOUT
+
+
+class BudgetExceeded(Exception):
+    """Il budget di latenza della richiesta (o della fase) è esaurito."""
+
+
+class Deadline:
+    """
+    Scadenza di una richiesta: ogni fase riceve quello che resta del budget
+    invece di un timeout fisso. cancel() azzera il budget residuo (richiesta
+    annullata dall'utente), così le fasi successive si fermano come a budget esaurito.
+    """
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+        self.cancel_event = threading.Event()
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def remaining(self) -> float:
+        if self.cancel_event.is_set():
+            return 0.0
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: Optional[float] = None) -> float:
+        """
+        Timeout da usare per la prossima chiamata: il budget residuo, limitato a cap.
+        Sotto LLM_MIN_TIMEOUT secondi la chiamata non avrebbe tempo di completarsi
+        e viene sollevato BudgetExceeded senza eseguirla.
+        """
+        if self.cancelled:
+            raise BudgetExceeded("richiesta annullata")
+        remaining = self.remaining()
+        if remaining < LLM_MIN_TIMEOUT:
+            raise BudgetExceeded(f"budget di {self.budget:g} s esaurito")
+        return min(remaining, cap) if cap else remaining
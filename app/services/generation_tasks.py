@@ -0,0 +1,206 @@
+import logging
+import threading
+import time
+from typing import List, Optional
+
+from app.config import CHAT_ABANDON_AFTER, CHAT_LATENCY_BUDGET, COHORT_LATENCY_BUDGET
+from app.models.user_record import UserRecord
+from app.security_components.PII_obfuscation import obscure_pii_with_terms
+from app.security_components.prompt_sanitizer import sanitize_user_prompt
+from app.services.admission import ACTION_CHAT, admit
+from app.services.audit_log import record_request
+from app.services.chat_context import ChatContext, replace_chat_context
+from app.services.chat_service import ChatAnswer, answer_question
+from app.services.cohort_service import CohortRow, run_cohort
+from app.services.deadline import Deadline
+from app.services.request_trace import RequestTrace
+
+logger = logging.getLogger(__name__)
+
+STATE_KEY = "generation_task"
+COHORT_STATE_KEY = "cohort_task"
+
+
+class SessionTask:
+    """
+    Lavoro eseguito in un thread in background e legato alla sessione Streamlit.
+    La pagina non resta bloccata: legge lo stato del task a ogni aggiornamento del
+    proprio fragment e chiama touch(). Il task si interrompe con cancel(), oppure da
+    solo se la pagina smette di aggiornarsi per CHAT_ABANDON_AFTER secondi (scheda
+    chiusa o sessione terminata). Il thread non usa API Streamlit: scrive solo negli
+    attributi del task e accoda il record di audit.
+    """
+    name = "task"
+
+    def __init__(self, user, budget: float):
+        self.user = user
+        self.deadline = Deadline(budget)
+        self.trace = RequestTrace(user.email, user.role)
+        self.error: Optional[BaseException] = None
+        self.last_seen = time.monotonic()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._main, name=self.name, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _main(self) -> None:
+        try:
+            self._run()
+        except Exception as e:
+            self.error = e
+        finally:
+            self._finish()
+            self._done.set()
+
+    def _run(self) -> None:
+        raise NotImplementedError
+
+    def _finish(self) -> None:
+        pass
+
+    def check_abandoned(self) -> None:
+        if CHAT_ABANDON_AFTER and time.monotonic() - self.last_seen > CHAT_ABANDON_AFTER:
+            logger.info("%s di %s: nessun aggiornamento da %g s, annullato", self.name, self.user.email, CHAT_ABANDON_AFTER)
+            self.cancel()
+
+    def touch(self) -> None:
+        self.last_seen = time.monotonic()
+
+    def cancel(self) -> None:
+        self.deadline.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.deadline.cancelled
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+
+class GenerationTask(SessionTask):
+    """Turno di chat in background; `preview` è l'anteprima già oscurata della risposta."""
+    name = "chat-generation"
+
+    def __init__(self, user, pazienti, question: str, conversation: ChatContext):
+        super().__init__(user, CHAT_LATENCY_BUDGET)
+        self.pazienti = pazienti
+        self.question = question
+        self.conversation = conversation
+        self.preview: Optional[str] = None
+        self.result: Optional[ChatAnswer] = None
+
+    def _on_partial(self, preview: str) -> None:
+        self.preview = preview
+        self.check_abandoned()
+
+    def _run(self) -> None:
+        self.result = answer_question(self.user, self.pazienti, self.question, trace=self.trace,
+                                      deadline=self.deadline, conversation=self.conversation,
+                                      on_partial=self._on_partial)
+
+    def _finish(self) -> None:
+        if self.deadline.cancelled:
+            # il turno potrebbe essere entrato nella conversazione senza che l'utente lo veda
+            self.conversation.reset()
+        # registrato qui anche se annullato: retrieval e accesso ai dati ci sono stati comunque
+        record_request(self.trace, self.result.query_redacted if self.result else None)
+
+
+class CohortTask(SessionTask):
+    """
+    Domanda di coorte in background: `rows` cresce man mano che i pazienti vengono
+    elaborati (risultati parziali), `total` è il numero di pazienti della coorte.
+    """
+    name = "cohort"
+
+    def __init__(self, user, pazienti, question: str):
+        super().__init__(user, COHORT_LATENCY_BUDGET)
+        self.pazienti = pazienti
+        self.total = len(pazienti)
+        self.question = question
+        self.query_redacted: Optional[str] = None
+        self.rows: List[CohortRow] = []
+
+    def _run(self) -> None:
+        with self.trace.stage("pii_domanda"):
+            self.query_redacted, query_terms = obscure_pii_with_terms(self.question)
+        guard_stats = {}
+        with self.trace.stage("sanificazione"):
+            sanitized = sanitize_user_prompt(self.query_redacted, self.deadline, guard_stats)
+        if guard_stats.get("fallback"):
+            self.trace.fallback("sanificazione", guard_stats["fallback"])
+        self.trace.verdict("sanificazione", sanitized if sanitized in ("error", "warning") else "ok")
+        query = self.query_redacted if sanitized in ("error", "warning") else sanitized
+        self.trace.verdict("pazienti", [p.email for p in self.pazienti])
+
+        with self.trace.stage("coorte"):
+            rows = run_cohort(query, self.pazienti, self.deadline, self.user.email, query_terms)
+            try:
+                for row in rows:
+                    self.rows.append(row)
+                    self.check_abandoned()
+            finally:
+                rows.close()
+
+    def _finish(self) -> None:
+        self.trace.verdict("coorte_elaborati", len(self.rows))
+        record_request(self.trace, self.query_redacted)
+
+
+def get_generation_task(state) -> Optional[GenerationTask]:
+    task = state.get(STATE_KEY)
+    return task if isinstance(task, GenerationTask) else None
+
+
+def get_cohort_task(state) -> Optional[CohortTask]:
+    task = state.get(COHORT_STATE_KEY)
+    return task if isinstance(task, CohortTask) else None
+
+
+def start_generation(state, user, pazienti, question: str, conversation: ChatContext) -> GenerationTask:
+    """
+    Avvia un turno per la sessione; quello eventualmente ancora in corso viene annullato.
+    Oltre il limite di richieste dell'utente solleva RateLimited (il turno in corso prosegue).
+    """
+    admit(ACTION_CHAT, user)
+    previous = get_generation_task(state)
+    if previous is not None and not previous.done:
+        previous.cancel()
+        # la conversazione è condivisa: si attende che il turno annullato la rilasci;
+        # se è ancora bloccato (stream di Ollama, retrieval) il nuovo turno riparte da una
+        # conversazione vuota invece di scrivere insieme a lui in quella condivisa
+        if not previous.wait(5) and conversation is previous.conversation:
+            conversation = replace_chat_context(state, conversation)
+    # copie staccate dalla sessione SQLAlchemy della pagina, che il thread non deve usare
+    task = GenerationTask(UserRecord.from_user(user), [UserRecord.from_user(p) for p in pazienti],
+                          question, conversation).start()
+    state[STATE_KEY] = task
+    return task
+
+
+def start_cohort(state, user, pazienti, question: str) -> CohortTask:
+    """
+    Avvia una domanda di coorte per la sessione, annullando quella eventualmente in corso.
+    Conta come un turno di chat per il limite di richieste (RateLimited se superato).
+    """
+    admit(ACTION_CHAT, user)
+    previous = get_cohort_task(state)
+    if previous is not None and not previous.done:
+        previous.cancel()
+    task = CohortTask(UserRecord.from_user(user), [UserRecord.from_user(p) for p in pazienti], question).start()
+    state[COHORT_STATE_KEY] = task
+    return task
+
+
+def cancel_generation(state) -> None:
+    """Annulla i lavori in corso della sessione (cambio pagina, logout)."""
+    for key in (STATE_KEY, COHORT_STATE_KEY):
+        task = state.pop(key, None)
+        if isinstance(task, SessionTask) and not task.done:
+            task.cancel()
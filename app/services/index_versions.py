@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+from app.config import CHROMA_DIR, EMBEDDING_MODEL
+
+# Versione implicita dei vectorstore creati prima del versionamento (chroma_db/<email>)
+LEGACY_VERSION = "legacy"
+VERSIONS_DIR_NAME = "_versions"
+MANIFEST_NAME = "_index.json"
+
+DEFAULT_EMBEDDING_MODEL = EMBEDDING_MODEL
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_CHUNK_OVERLAP = 0
+
+_lock = threading.Lock()
+_cache = {"mtime": None, "manifest": None}
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    """Modello di embedding e chunker con cui è stata costruita una versione dell'indice."""
+    embedding_model: str = DEFAULT_EMBEDDING_MODEL
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP
+    version: str = LEGACY_VERSION
+
+    @classmethod
+    def new(cls, embedding_model: str, chunk_size: int, chunk_overlap: int) -> "IndexSpec":
+        """Crea una nuova versione: l'id combina timestamp e impronta dei parametri."""
+        fingerprint = hashlib.sha1(
+            f"{embedding_model}|{chunk_size}|{chunk_overlap}".encode("utf-8")
+        ).hexdigest()[:8]
+        return cls(embedding_model, chunk_size, chunk_overlap, f"v{int(time.time())}_{fingerprint}")
+
+    @classmethod
+    def from_dict(cls, d: Optional[dict]) -> Optional["IndexSpec"]:
+        return cls(**d) if d else None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def same_params(self, other: "IndexSpec") -> bool:
+        return (self.embedding_model, self.chunk_size, self.chunk_overlap) == \
+            (other.embedding_model, other.chunk_size, other.chunk_overlap)
+
+    @property
+    def root(self) -> str:
+        """Cartella radice dei vectorstore di questa versione."""
+        if self.version == LEGACY_VERSION:
+            return CHROMA_DIR
+        return os.path.join(CHROMA_DIR, VERSIONS_DIR_NAME, self.version)
+
+
+def _manifest_path() -> str:
+    return os.path.join(CHROMA_DIR, MANIFEST_NAME)
+
+
+def read_manifest() -> dict:
+    """
+    Legge il manifest delle versioni (active, building, retired).
+    Il contenuto è messo in cache finché il file non cambia.
+    """
+    path = _manifest_path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return {"active": None, "building": None, "retired": []}
+
+    with _lock:
+        if _cache["mtime"] != mtime:
+            with open(path, encoding="utf-8") as f:
+                _cache["manifest"] = json.load(f)
+            _cache["mtime"] = mtime
+        return dict(_cache["manifest"])
+
+
+def write_manifest(manifest: dict) -> None:
+    """Scrittura atomica: i lettori vedono sempre il manifest vecchio o quello nuovo."""
+    os.makedirs(CHROMA_DIR, exist_ok=True)
+    path = _manifest_path()
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def active_spec() -> IndexSpec:
+    """Versione da cui vengono servite le query."""
+    return IndexSpec.from_dict(read_manifest().get("active")) or IndexSpec()
+
+
+def building_spec() -> Optional[IndexSpec]:
+    """Versione in costruzione, se c'è un re-indexing in corso."""
+    return IndexSpec.from_dict(read_manifest().get("building"))
+
+
+def write_specs() -> List[IndexSpec]:
+    """Versioni che devono ricevere i nuovi documenti (attiva + in costruzione)."""
+    specs = [active_spec()]
+    building = building_spec()
+    if building is not None:
+        specs.append(building)
+    return specs
+
+
+def start_build(spec: IndexSpec) -> None:
+    manifest = read_manifest()
+    manifest["active"] = active_spec().to_dict()
+    manifest["building"] = spec.to_dict()
+    write_manifest(manifest)
+
+
+def abort_build() -> Optional[IndexSpec]:
+    manifest = read_manifest()
+    building = IndexSpec.from_dict(manifest.get("building"))
+    manifest["building"] = None
+    write_manifest(manifest)
+    return building
+
+
+def promote(spec: IndexSpec) -> IndexSpec:
+    """Rende attiva la versione costruita e ritira la precedente. Ritorna la versione ritirata."""
+    manifest = read_manifest()
+    old = active_spec()
+    manifest["active"] = spec.to_dict()
+    manifest["building"] = None
+    manifest["retired"] = list(manifest.get("retired") or []) + [old.to_dict()]
+    write_manifest(manifest)
+    return old
+
+
+def garbage_collect(spec: IndexSpec) -> None:
+    """Cancella dal disco i vectorstore di una versione ritirata."""
+    if spec.version == active_spec().version:
+        raise RuntimeError("Impossibile cancellare la versione attiva dell'indice.")
+
+    if spec.version == LEGACY_VERSION:
+        # la versione legacy vive direttamente in CHROMA_DIR, accanto a manifest e _versions
+        for name in os.listdir(CHROMA_DIR):
+            if name in (VERSIONS_DIR_NAME, MANIFEST_NAME) or name.endswith(".tmp"):
+                continue
+            path = os.path.join(CHROMA_DIR, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+    else:
+        shutil.rmtree(spec.root, ignore_errors=True)
+
+    manifest = read_manifest()
+    manifest["retired"] = [r for r in manifest.get("retired") or [] if r["version"] != spec.version]
+    write_manifest(manifest)
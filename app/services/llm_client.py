@@ -0,0 +1,97 @@
+import math
+import time
+from functools import lru_cache
+from typing import Dict, Iterator, Optional, Tuple
+
+import httpx
+import ollama
+
+from app.config import LLM_SCHEDULER_ENABLED, OLLAMA_BASE_URL
+from app.services.deadline import BudgetExceeded, Deadline
+from app.services.llm_scheduler import PRIORITY_INTERACTIVE, get_scheduler
+
+
+@lru_cache(maxsize=64)
+def get_client(timeout: Optional[float] = None) -> ollama.Client:
+    """Client Ollama condiviso (uno per timeout), puntato su OLLAMA_BASE_URL."""
+    return ollama.Client(host=OLLAMA_BASE_URL, timeout=timeout)
+
+
+def _chat(model: str, messages: list, timeout: Optional[float], deadline: Optional[Deadline], **kwargs):
+    if deadline is None:
+        return get_client(timeout).chat(model=model, messages=messages, **kwargs)
+
+    # arrotondato al secondo: i client restano pochi e riusano le connessioni
+    client = get_client(float(math.ceil(deadline.timeout(timeout))))
+    try:
+        return client.chat(model=model, messages=messages, **kwargs)
+    except httpx.TimeoutException as e:
+        raise BudgetExceeded(f"{model}: timeout ({e})") from e
+
+
+def _stream_then_release(parts: Iterator, model: str) -> Iterator:
+    """Con stream=True lo slot resta occupato finché la risposta non è stata letta tutta."""
+    try:
+        yield from parts
+    except httpx.TimeoutException as e:
+        raise BudgetExceeded(f"{model}: timeout ({e})") from e
+    finally:
+        get_scheduler().release(model)
+
+
+def chat(model: str, messages: list, timeout: Optional[float] = None,
+         deadline: Optional[Deadline] = None, priority: int = PRIORITY_INTERACTIVE, **kwargs):
+    """
+    Punto unico di accesso a Ollama per tutte le chiamate LLM dell'applicazione.
+    Con deadline il timeout è il budget residuo della richiesta (timeout fa da tetto)
+    e un timeout della chiamata diventa BudgetExceeded, che il chiamante gestisce col suo fallback.
+    Le chiamate passano dallo scheduler (classe priority, utente del contesto corrente):
+    anche l'attesa di uno slot consuma il budget.
+    """
+    if not LLM_SCHEDULER_ENABLED:
+        return _chat(model, messages, timeout, deadline, **kwargs)
+
+    scheduler = get_scheduler()
+    if deadline is None:
+        scheduler.acquire(model, priority)
+    else:
+        # una richiesta annullata esce subito dalla coda
+        scheduler.acquire(model, priority, timeout=deadline.remaining(), abort=deadline.cancel_event)
+    try:
+        response = _chat(model, messages, timeout, deadline, **kwargs)
+    except BaseException:
+        scheduler.release(model)
+        raise
+    if kwargs.get("stream"):
+        return _stream_then_release(response, model)
+    scheduler.release(model)
+    return response
+
+
+DIGEST_TTL = 600.0
+DIGEST_TIMEOUT = 5.0
+_digests: Dict[str, Tuple[float, str]] = {}
+
+
+def model_digest(model: str, deadline: Optional[Deadline] = None) -> str:
+    """
+    Digest del modello installato su Ollama (cambia quando il modello viene aggiornato),
+    memorizzato per DIGEST_TTL secondi; "unknown" se Ollama non risponde entro
+    DIGEST_TIMEOUT secondi (o entro il budget residuo di deadline, se minore).
+    """
+    name = model if ":" in model else f"{model}:latest"
+    cached = _digests.get(name)
+    if cached and time.monotonic() - cached[0] < DIGEST_TTL:
+        return cached[1]
+    try:
+        timeout = DIGEST_TIMEOUT if deadline is None else deadline.timeout(DIGEST_TIMEOUT)
+        digest = "missing"
+        # arrotondato al secondo, come in _chat
+        for m in get_client(float(math.ceil(timeout))).list()["models"]:
+            if (m.get("model") or m.get("name")) == name:
+                digest = m.get("digest") or "missing"
+                break
+    except Exception:
+        return "unknown"
+    _digests[name] = (time.monotonic(), digest)
+    return digest
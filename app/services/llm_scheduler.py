@@ -0,0 +1,228 @@
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Optional, Tuple
+
+from app.config import LLM_DEFAULT_CONCURRENCY, LLM_MODEL_CONCURRENCY, LLM_SCHEDULER_AGING
+from app.services.deadline import BudgetExceeded
+
+# Classi di priorità (valore più basso = servita prima)
+PRIORITY_GUARD = 0          # controlli interattivi: sanificazione, terapie
+PRIORITY_INTERACTIVE = 1    # generazione della risposta in chat
+PRIORITY_BACKGROUND = 2     # classificazione dei documenti caricati
+
+PRIORITY_NAMES = {PRIORITY_GUARD: "guardia", PRIORITY_INTERACTIVE: "interattiva", PRIORITY_BACKGROUND: "background"}
+
+ANONYMOUS = "anonimo"
+ABORT_POLL = 0.25  # secondi tra due controlli di annullamento durante l'attesa in coda
+
+# Utente (e ruolo) per cui vengono fatte le chiamate LLM del thread/contesto corrente
+# (equità tra utenti, limiti di richieste)
+_current_user: contextvars.ContextVar[str] = contextvars.ContextVar("llm_user", default=ANONYMOUS)
+_current_role: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("llm_role", default=None)
+
+
+def parse_limits(spec: str) -> Dict[str, int]:
+    """Interpreta LLM_MODEL_CONCURRENCY ("modello=n,modello=n")."""
+    limits = {}
+    for item in filter(None, (x.strip() for x in spec.split(","))):
+        model, sep, value = item.rpartition("=")
+        if not sep or not model or not value.isdigit() or int(value) < 1:
+            raise RuntimeError(f"LLM_MODEL_CONCURRENCY non valida: {item!r}")
+        limits[model.strip()] = int(value)
+    return limits
+
+
+@contextmanager
+def for_user(user: Optional[str], role: Optional[str] = None):
+    """Attribuisce all'utente (con il suo ruolo, se noto) le chiamate LLM fatte nel blocco."""
+    token = _current_user.set(user or ANONYMOUS)
+    role_token = _current_role.set(role)
+    try:
+        yield
+    finally:
+        _current_role.reset(role_token)
+        _current_user.reset(token)
+
+
+def current_user() -> Tuple[str, Optional[str]]:
+    """Utente e ruolo a cui sono attribuite le chiamate del contesto corrente."""
+    return _current_user.get(), _current_role.get()
+
+
+class _Waiter:
+    __slots__ = ("priority", "user", "enqueued", "granted")
+
+    def __init__(self, priority: int, user: str):
+        self.priority = priority
+        self.user = user
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+
+class _ClassStats:
+    __slots__ = ("served", "wait_total", "wait_max", "timeouts")
+
+    def __init__(self):
+        self.served = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+
+
+class LLMScheduler:
+    """
+    Coda davanti a Ollama: ogni modello ha un numero massimo di chiamate in corso e
+    le richieste in attesa vengono servite per classe di priorità (guardia, interattiva,
+    background) e, dentro la stessa classe, a turno tra gli utenti, così chi invia molte
+    richieste non ferma gli altri. Una richiesta che attende più di aging secondi sale
+    di una classe, quindi anche il background prima o poi viene servito.
+    """
+
+    def __init__(self, limits: Dict[str, int], default_limit: int = 1, aging: float = 30.0):
+        self.limits = dict(limits)
+        self.default_limit = default_limit
+        self.aging = aging
+        self._cond = threading.Condition()
+        self._running: Dict[str, int] = {}
+        # modello -> priorità -> utente -> richieste in attesa (in ordine di arrivo)
+        self._queues: Dict[str, Dict[int, "OrderedDict[str, Deque[_Waiter]]"]] = {}
+        self._stats: Dict[int, _ClassStats] = {p: _ClassStats() for p in PRIORITY_NAMES}
+
+    def limit(self, model: str) -> int:
+        return self.limits.get(model, self.default_limit)
+
+    def _waiting(self, model: str) -> int:
+        return sum(len(q) for users in self._queues.get(model, {}).values() for q in users.values())
+
+    def _effective_priority(self, waiter: _Waiter, now: float) -> int:
+        if self.aging <= 0:
+            return waiter.priority
+        return max(PRIORITY_GUARD, waiter.priority - int((now - waiter.enqueued) / self.aging))
+
+    def _next(self, model: str) -> Optional[_Waiter]:
+        """Prossima richiesta da servire: classe effettiva migliore, poi il primo utente del turno."""
+        now = time.monotonic()
+        best = None
+        for priority, users in self._queues.get(model, {}).items():
+            if not users:
+                continue
+            oldest = min(q[0].enqueued for q in users.values())
+            rank = (min(self._effective_priority(q[0], now) for q in users.values()), oldest)
+            if best is None or rank < best[0]:
+                best = (rank, priority)
+        if best is None:
+            return None
+
+        users = self._queues[model][best[1]]
+        user, queue = next(iter(users.items()))
+        waiter = queue.popleft()
+        # l'utente servito passa in fondo al turno
+        del users[user]
+        if queue:
+            users[user] = queue
+        return waiter
+
+    def _dispatch(self, model: str) -> None:
+        granted = False
+        while self._running.get(model, 0) < self.limit(model):
+            waiter = self._next(model)
+            if waiter is None:
+                break
+            waiter.granted = True
+            self._running[model] = self._running.get(model, 0) + 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _remove(self, model: str, waiter: _Waiter) -> None:
+        users = self._queues[model][waiter.priority]
+        queue = users.get(waiter.user)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del users[waiter.user]
+
+    def acquire(self, model: str, priority: int, user: Optional[str] = None,
+                timeout: Optional[float] = None, abort: Optional[threading.Event] = None) -> float:
+        """
+        Attende uno slot per model e ritorna i secondi di attesa.
+        Se lo slot non arriva entro timeout, o abort viene impostato, solleva BudgetExceeded.
+        """
+        user = user or _current_user.get()
+        waiter = _Waiter(priority, user)
+        with self._cond:
+            users = self._queues.setdefault(model, {}).setdefault(priority, OrderedDict())
+            users.setdefault(user, deque()).append(waiter)
+            self._dispatch(model)
+
+            expires = None if timeout is None else waiter.enqueued + timeout
+            while not waiter.granted:
+                if abort is not None and abort.is_set():
+                    self._remove(model, waiter)
+                    raise BudgetExceeded(f"{model}: richiesta annullata in coda")
+                remaining = None if expires is None else expires - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._remove(model, waiter)
+                    self._stats[priority].timeouts += 1
+                    raise BudgetExceeded(f"{model}: nessuno slot libero entro {timeout:.1f} s")
+                if abort is not None:
+                    # l'annullamento non notifica la condition: si ricontrolla a intervalli
+                    remaining = ABORT_POLL if remaining is None else min(remaining, ABORT_POLL)
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - waiter.enqueued
+            stats = self._stats[priority]
+            stats.served += 1
+            stats.wait_total += waited
+            stats.wait_max = max(stats.wait_max, waited)
+            return waited
+
+    def release(self, model: str) -> None:
+        with self._cond:
+            self._running[model] = max(0, self._running.get(model, 0) - 1)
+            self._dispatch(model)
+
+    @contextmanager
+    def slot(self, model: str, priority: int, user: Optional[str] = None, timeout: Optional[float] = None):
+        self.acquire(model, priority, user, timeout)
+        try:
+            yield
+        finally:
+            self.release(model)
+
+    def stats(self) -> dict:
+        """Code e chiamate in corso per modello, attese (ms) e timeout per classe di priorità."""
+        with self._cond:
+            return {
+                "in_coda": {m: self._waiting(m) for m in self._queues if self._waiting(m)},
+                "in_corso": {m: n for m, n in self._running.items() if n},
+                "classi": {
+                    PRIORITY_NAMES[p]: {
+                        "servite": s.served,
+                        "attesa_media_ms": round(s.wait_total / s.served * 1000, 1) if s.served else 0.0,
+                        "attesa_max_ms": round(s.wait_max * 1000, 1),
+                        "timeout": s.timeouts,
+                    }
+                    for p, s in self._stats.items()
+                },
+            }
+
+
+_scheduler: Optional[LLMScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler(parse_limits(LLM_MODEL_CONCURRENCY), LLM_DEFAULT_CONCURRENCY,
+                                      LLM_SCHEDULER_AGING)
+        return _scheduler
+
+
+def scheduler_stats() -> dict:
+    return get_scheduler().stats() if _scheduler is not None else {}
@@ -0,0 +1,30 @@
+import logging
+import threading
+import time
+
+
+class ThrottledErrors:
+    """
+    Errori ripetuti di un worker in background (es. database non raggiungibile): nel log
+    finisce al massimo un errore, con il traceback, ogni `interval` secondi; quelli
+    tralasciati nel frattempo vengono contati e riportati col successivo.
+    """
+
+    def __init__(self, logger: logging.Logger, interval: float = 60.0):
+        self.logger = logger
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._last = float("-inf")
+        self._suppressed = 0
+
+    def exception(self, msg: str, *args) -> None:
+        """Da chiamare in un blocco except, come Logger.exception."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last < self.interval:
+                self._suppressed += 1
+                return
+            suppressed, self._suppressed, self._last = self._suppressed, 0, now
+        if suppressed:
+            msg += f" (altri {suppressed} errori non riportati)"
+        self.logger.exception(msg, *args)
@@ -0,0 +1,196 @@
+import difflib
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict, defaultdict
+from dataclasses import dataclass
+from itertools import product
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from app.models.user_record import UserRecord
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+MIN_FUZZY_TOKEN = 3         # token più corti si confrontano solo esattamente
+TOKEN_CUTOFF = 0.75         # somiglianza minima tra un token della domanda e uno del nome
+NAME_CUTOFF = 0.85          # somiglianza media minima per accettare un nome approssimato
+MAX_TOKEN_CANDIDATES = 5    # token del nome considerati per ogni token della domanda
+MAX_CACHED_INDEXES = 64
+
+
+def normalize(text: str) -> List[str]:
+    """Token minuscoli senza accenti: "D'Angelò Niccolò" -> ["d", "angelo", "niccolo"]."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return TOKEN_RE.findall(text)
+
+
+def _trigrams(token: str) -> Set[str]:
+    padded = f"^{token}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+@dataclass
+class NameMatch:
+    """Nome trovato nella domanda; più pazienti = omonimi da distinguere."""
+    mention: str
+    pazienti: List[UserRecord]
+    exact: bool
+
+    @property
+    def ambiguous(self) -> bool:
+        return len(self.pazienti) > 1
+
+
+class PatientNameIndex:
+    """
+    Indice dei nomi degli assistiti di un medico, costruito una volta per elenco di pazienti.
+    I nomi completi (nome cognome e cognome nome) sono tuple di token in un dizionario,
+    quindi le menzioni esatte si trovano con una lookup per finestra di token della domanda;
+    per quelle approssimate un indice di trigrammi restringe i token candidati prima del
+    confronto con difflib, senza scorrere tutto l'elenco.
+    """
+
+    def __init__(self, pazienti: Sequence):
+        self.names: Dict[Tuple[str, ...], List[UserRecord]] = defaultdict(list)
+        self._trigram_tokens: Dict[str, Set[str]] = defaultdict(set)
+        for p in pazienti:
+            record = UserRecord.from_user(p)
+            nome, cognome = normalize(record.nome), normalize(record.cognome)
+            if not nome or not cognome:
+                continue
+            for key in {tuple(nome + cognome), tuple(cognome + nome)}:
+                self.names[key].append(record)
+            for token in nome + cognome:
+                if len(token) >= MIN_FUZZY_TOKEN:
+                    for tri in _trigrams(token):
+                        self._trigram_tokens[tri].add(token)
+        self.lengths = sorted({len(k) for k in self.names}, reverse=True)
+
+    def _token_candidates(self, token: str) -> List[Tuple[str, float]]:
+        """Token dei nomi simili a token, con la loro somiglianza (il token stesso vale 1)."""
+        if len(token) < MIN_FUZZY_TOKEN:
+            return [(token, 1.0)]
+        trigrams = _trigrams(token)
+        shared = Counter()
+        for tri in trigrams:
+            shared.update(self._trigram_tokens.get(tri, ()))
+        scored = []
+        # solo i token con più trigrammi in comune passano al confronto completo
+        for candidate, _ in shared.most_common(MAX_TOKEN_CANDIDATES * 4):
+            if abs(len(candidate) - len(token)) > 2:
+                continue
+            ratio = 1.0 if candidate == token else difflib.SequenceMatcher(None, token, candidate).ratio()
+            if ratio >= TOKEN_CUTOFF:
+                scored.append((candidate, ratio))
+        scored.sort(key=lambda c: -c[1])
+        return scored[:MAX_TOKEN_CANDIDATES]
+
+    def _fuzzy_at(self, tokens: List[str], start: int, length: int) -> Optional[Tuple[float, Tuple[str, ...]]]:
+        candidates = [self._token_candidates(t) for t in tokens[start:start + length]]
+        best = None
+        for combo in product(*candidates):
+            key = tuple(c[0] for c in combo)
+            if key in self.names:
+                score = sum(c[1] for c in combo) / length
+                if score >= NAME_CUTOFF and (best is None or score > best[0]):
+                    best = (score, key)
+        return best
+
+    def resolve(self, query: str) -> List[NameMatch]:
+        """
+        Nomi di assistiti citati nella domanda, nell'ordine in cui compaiono.
+        Prima le menzioni esatte; solo se non ce ne sono, quelle approssimate (errori di battitura).
+        """
+        tokens = normalize(query)
+        matches = self._scan(tokens, exact=True)
+        return matches or self._scan(tokens, exact=False)
+
+    def _scan(self, tokens: List[str], exact: bool) -> List[NameMatch]:
+        found: List[Tuple[int, NameMatch]] = []
+        used = [False] * len(tokens)
+        # finestre più lunghe prima, così "de luca mario" non viene letto come "luca mario"
+        for length in self.lengths:
+            for start in range(len(tokens) - length + 1):
+                if any(used[start:start + length]):
+                    continue
+                if exact:
+                    key = tuple(tokens[start:start + length])
+                    if key not in self.names:
+                        continue
+                else:
+                    hit = self._fuzzy_at(tokens, start, length)
+                    if hit is None:
+                        continue
+                    key = hit[1]
+                for i in range(start, start + length):
+                    used[i] = True
+                found.append((start, NameMatch(" ".join(tokens[start:start + length]),
+                                               list(self.names[key]), exact)))
+        return [m for _, m in sorted(found, key=lambda f: f[0])]
+
+
+_indexes: "OrderedDict[int, PatientNameIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _fingerprint(pazienti: Sequence) -> int:
+    # cambia se un assistito viene aggiunto, tolto o rinominato
+    return hash(frozenset((p.email, p.nome, p.cognome) for p in pazienti))
+
+
+def get_name_index(pazienti: Sequence) -> PatientNameIndex:
+    """Indice dei nomi per l'elenco di assistiti, riusato finché l'elenco non cambia."""
+    key = _fingerprint(pazienti)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    index = PatientNameIndex(pazienti)
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def _birth_date_forms(record: UserRecord) -> List[str]:
+    d = record.data_nascita
+    if d is None:
+        return []
+    return [d.strftime("%d/%m/%Y"), d.strftime("%d-%m-%Y"), d.isoformat()]
+
+
+def disambiguate(match: NameMatch, text: str) -> NameMatch:
+    """Tra omonimi tiene quello di cui la domanda riporta l'email o la data di nascita."""
+    if not match.ambiguous:
+        return match
+    lowered = (text or "").lower()
+    chosen = [p for p in match.pazienti
+              if (p.email and p.email.lower() in lowered) or any(f in lowered for f in _birth_date_forms(p))]
+    return NameMatch(match.mention, chosen, match.exact) if chosen else match
+
+
+def resolve_pazienti(query: str, pazienti: Sequence, hint_text: Optional[str] = None) -> List[NameMatch]:
+    """
+    Assistiti citati nella domanda; hint_text (di norma la domanda originale, prima
+    dell'oscuramento dei dati personali) serve a distinguere gli omonimi.
+    """
+    matches = get_name_index(pazienti).resolve(query)
+    return [disambiguate(m, hint_text or query) for m in matches]
+
+
+def homonym_message(matches: Sequence[NameMatch]) -> str:
+    lines = []
+    for m in matches:
+        candidates = "; ".join(
+            f"{p.nome} {p.cognome} ({p.email}"
+            + (f", nato/a il {p.data_nascita.strftime('%d/%m/%Y')})" if p.data_nascita else ")")
+            for p in m.pazienti
+        )
+        lines.append(f"- '{m.mention}': {candidates}")
+    return (
+        "Tra i tuoi assistiti ci sono più pazienti con lo stesso nome:\n"
+        + "\n".join(lines)
+        + "\nIndica la data di nascita o l'email del paziente a cui ti riferisci."
+    )
@@ -0,0 +1,209 @@
+import io
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, List, Optional
+
+from PyPDF2 import PdfReader
+
+from app.config import (
+    PDF_EXTRACT_WORKERS,
+    PDF_MAX_TEXT_CHARS,
+    PDF_PAGE_TIMEOUT,
+    PDF_WORKER_MEMORY_MB,
+)
+
+# Sotto questa soglia di pagine il process pool costa più di quanto fa risparmiare
+PARALLEL_MIN_PAGES = 16
+PAGES_PER_TASK = 4
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+class _PageTimeout(Exception):
+    pass
+
+
+def _on_alarm(signum, frame):
+    raise _PageTimeout()
+
+
+def _init_worker(memory_mb: int) -> None:
+    """Limite di memoria del processo worker: una pagina patologica fallisce invece di saturare la RAM."""
+    if memory_mb > 0:
+        try:
+            import resource
+            limit = memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError):
+            pass
+
+
+def _can_alarm() -> bool:
+    # SIGALRM si può usare solo nel thread principale (worker del pool, script)
+    return hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+
+
+def _timed_pages(reader: PdfReader, start: int, end: int, page_timeout: float) -> Iterator[Optional[str]]:
+    """
+    Testo delle pagine [start, end); con page_timeout > 0 ogni pagina ha un timeout
+    (SIGALRM, da chiamare nel thread principale). Una pagina scaduta o fallita vale None.
+    """
+    use_alarm = page_timeout > 0 and _can_alarm()
+    previous = signal.signal(signal.SIGALRM, _on_alarm) if use_alarm else None
+    try:
+        for i in range(start, end):
+            try:
+                if use_alarm:
+                    signal.setitimer(signal.ITIMER_REAL, page_timeout)
+                text = reader.pages[i].extract_text() or ""
+            except Exception:
+                # _PageTimeout, MemoryError (limite del worker) o pagina malformata
+                text = None
+            finally:
+                if use_alarm:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+            yield text
+    finally:
+        if use_alarm:
+            signal.signal(signal.SIGALRM, previous)
+
+
+def _extract_range(path: str, start: int, end: int, page_timeout: float) -> List[Optional[str]]:
+    """Worker: estrae le pagine [start, end) del PDF salvato in path (vedi _timed_pages)."""
+    return list(_timed_pages(PdfReader(path), start, end, page_timeout))
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(PDF_WORKER_MEMORY_MB,),
+            )
+            _pool_workers = workers
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    """Un pool "rotto" (worker terminato dal sistema) non accetta più lavoro: il prossimo _get_pool ne crea uno nuovo."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _count(stats: Optional[dict], key: str, n: int = 1) -> None:
+    if stats is not None:
+        stats[key] = stats.get(key, 0) + n
+
+
+def iter_pages(pdf_bytes: bytes,
+               workers: Optional[int] = None,
+               page_timeout: float = PDF_PAGE_TIMEOUT,
+               max_chars: int = PDF_MAX_TEXT_CHARS,
+               stats: Optional[dict] = None) -> Iterator[str]:
+    """
+    Testo delle pagine del PDF, in ordine e man mano che è disponibile.
+
+    I documenti lunghi vengono divisi in intervalli di PAGES_PER_TASK pagine ed estratti
+    da un process pool; restano in volo al massimo due intervalli per worker, così la
+    memoria non cresce con la lunghezza del documento. Le pagine scadute (page_timeout)
+    o fallite vengono saltate; raggiunti max_chars caratteri l'estrazione si ferma.
+    In stats (se passato) vengono accumulati pages, skipped_pages e truncated.
+    Il timeout per pagina vale anche per i documenti brevi: sono estratti in questo processo
+    se il thread può usare SIGALRM (script, worker di bulk_import), altrimenti (pagine
+    Streamlit, thread di servizio) dal pool in un solo intervallo.
+    Chi smette di leggere le pagine (chiudendo il generatore) annulla gli intervalli in volo.
+    """
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    n_pages = len(reader.pages)
+    workers = workers or PDF_EXTRACT_WORKERS
+    _count(stats, "pages", n_pages)
+
+    short = workers <= 1 or n_pages < PARALLEL_MIN_PAGES
+    # nei processi figli (es. worker di bulk_import) non si apre un altro pool
+    if multiprocessing.parent_process() is not None or (short and (page_timeout <= 0 or _can_alarm())):
+        yield from _capped(_timed_pages(reader, 0, n_pages, page_timeout), max_chars, stats)
+        return
+
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(pdf_bytes)
+        pages_per_task = max(n_pages, 1) if short else PAGES_PER_TASK
+        pages = _parallel_pages(path, n_pages, max(workers, 1), page_timeout, pages_per_task)
+        yield from _capped(pages, max_chars, stats)
+    finally:
+        os.remove(path)
+
+
+def _parallel_pages(path: str, n_pages: int, workers: int, page_timeout: float,
+                    pages_per_task: int = PAGES_PER_TASK) -> Iterator[Optional[str]]:
+    ranges = deque((s, min(s + pages_per_task, n_pages)) for s in range(0, n_pages, pages_per_task))
+    in_flight = deque()
+    try:
+        while ranges or in_flight:
+            while ranges and len(in_flight) < workers * 2:
+                start, end = ranges.popleft()
+                pool = _get_pool(workers)
+                try:
+                    future = pool.submit(_extract_range, path, start, end, page_timeout)
+                except BrokenProcessPool:
+                    _discard_pool(pool)
+                    pool = _get_pool(workers)
+                    future = pool.submit(_extract_range, path, start, end, page_timeout)
+                in_flight.append((end - start, pool, future))
+            size, pool, future = in_flight.popleft()
+            try:
+                # margine oltre ai timeout di pagina per l'avvio del worker e la lettura del file
+                texts = future.result(timeout=page_timeout * size + 30 if page_timeout > 0 else None)
+            except BrokenProcessPool:
+                # worker terminato (es. limite di memoria): pagine saltate, il pool va ricreato
+                _discard_pool(pool)
+                texts = [None] * size
+            except (FutureTimeout, Exception):
+                # intervallo scaduto o pagina non estraibile: pagine saltate
+                texts = [None] * size
+            yield from texts
+    finally:
+        for _, _, future in in_flight:
+            future.cancel()
+
+
+def _capped(pages: Iterator[Optional[str]], max_chars: int, stats: Optional[dict]) -> Iterator[str]:
+    total = 0
+    for text in pages:
+        if text is None:
+            _count(stats, "skipped_pages")
+            continue
+        if max_chars and total + len(text) > max_chars:
+            yield text[:max_chars - total]
+            _count(stats, "truncated")
+            return
+        total += len(text)
+        yield text
+
+
+def extract_pages(pdf_bytes: bytes, **kwargs) -> List[str]:
+    """Testo di tutte le pagine del PDF (vedi iter_pages)."""
+    return list(iter_pages(pdf_bytes, **kwargs))
+
+
+def extract_text(pdf_bytes: bytes) -> str:
+    """Estrae il testo di tutte le pagine di un PDF."""
+    return "".join(iter_pages(pdf_bytes))
@@ -0,0 +1,224 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Optional
+
+from sqlalchemy import event
+
+from app.config import APP_RELEASE, PROFILING, PROFILING_DIR
+
+SAMPLE_INTERVAL = 0.005
+HOTSPOTS_TOP = 15
+
+_local = threading.local()
+_recent_profiles = deque(maxlen=200)
+_dump_lock = threading.Lock()
+_hooks_installed = {"done": False}
+
+
+class RenderProfile:
+    """Misure di una singola esecuzione di una pagina Streamlit."""
+
+    def __init__(self, page: str):
+        self.page = page
+        self.started_at = time.time()
+        self.wall_ms = 0.0
+        self.components = {}
+        self.sql_statements = 0
+        self.sql_ms = 0.0
+        self.rows_loaded = 0
+        self.bytes_loaded = 0
+        self.self_samples = Counter()
+        self.cum_samples = Counter()
+        self.total_samples = 0
+
+    def add_component(self, name: str, elapsed_ms: float) -> None:
+        count, total = self.components.get(name, (0, 0.0))
+        self.components[name] = (count + 1, total + elapsed_ms)
+
+    def hotspots(self, top: int = HOTSPOTS_TOP):
+        """Funzioni più campionate: (funzione, % self, % cumulativo)."""
+        n = max(self.total_samples, 1)
+        return [
+            (func, 100.0 * self.self_samples[func] / n, 100.0 * cum / n)
+            for func, cum in self.cum_samples.most_common(top)
+        ]
+
+    def to_dict(self) -> dict:
+        return {
+            "release": APP_RELEASE,
+            "page": self.page,
+            "ts": self.started_at,
+            "wall_ms": round(self.wall_ms, 3),
+            "components": {
+                name: {"count": count, "total_ms": round(total, 3)}
+                for name, (count, total) in self.components.items()
+            },
+            "sql": {
+                "statements": self.sql_statements,
+                "time_ms": round(self.sql_ms, 3),
+                "rows_loaded": self.rows_loaded,
+                "bytes_loaded": self.bytes_loaded,
+            },
+            "hotspots": [[f, round(s, 2), round(c, 2)] for f, s, c in self.hotspots()],
+        }
+
+
+class _Sampler(threading.Thread):
+    """Campiona periodicamente lo stack del thread che esegue la pagina."""
+
+    def __init__(self, target_thread_id: int, profile: RenderProfile):
+        super().__init__(daemon=True)
+        self.target = target_thread_id
+        self.profile = profile
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.target)
+            if frame is None:
+                continue
+            self.profile.total_samples += 1
+            seen = set()
+            top = True
+            while frame is not None:
+                code = frame.f_code
+                func = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+                if top:
+                    self.profile.self_samples[func] += 1
+                    top = False
+                if func not in seen:
+                    self.profile.cum_samples[func] += 1
+                    seen.add(func)
+                frame = frame.f_back
+
+
+def current_profile() -> Optional[RenderProfile]:
+    return getattr(_local, "profile", None)
+
+
+def recent_profiles():
+    return list(_recent_profiles)
+
+
+def _estimate_size(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    return 8
+
+
+def _on_load(target, context):
+    profile = current_profile()
+    if profile is None:
+        return
+    profile.rows_loaded += 1
+    state = target.__dict__
+    profile.bytes_loaded += sum(
+        _estimate_size(state.get(attr.key)) for attr in target.__mapper__.column_attrs
+    )
+
+
+def install_sql_hooks() -> None:
+    """Registra gli hook SQLAlchemy che contano query e dati caricati (una sola volta)."""
+    if _hooks_installed["done"]:
+        return
+    from app.database.postgres import Base, engine
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("profiler_t0", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        t0 = conn.info["profiler_t0"].pop()
+        profile = current_profile()
+        if profile is not None:
+            profile.sql_statements += 1
+            profile.sql_ms += (time.perf_counter() - t0) * 1000
+
+    event.listen(Base, "load", _on_load, propagate=True)
+    _hooks_installed["done"] = True
+
+
+def _dump(profile: RenderProfile) -> None:
+    os.makedirs(PROFILING_DIR, exist_ok=True)
+    path = os.path.join(PROFILING_DIR, f"profile_{APP_RELEASE}.jsonl")
+    with _dump_lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(profile.to_dict()) + "\n")
+
+
+@contextmanager
+def profile_component(name: str):
+    """Misura il tempo di un componente all'interno della pagina in profilazione."""
+    profile = current_profile()
+    if profile is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_component(name, (time.perf_counter() - t0) * 1000)
+
+
+def profiled_component(name: str):
+    """Decoratore equivalente a profile_component."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profile_component(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def profiled_page(name: str):
+    """
+    Decoratore per le pagine: con PROFILING=1 misura tempo totale, componenti,
+    query SQL e campioni CPU, salva il profilo su file e mostra il pannello di debug.
+    Una pagina chiamata da un'altra pagina viene misurata come componente.
+    """
+    def decorator(func):
+        if not PROFILING:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if current_profile() is not None:
+                with profile_component(f"page:{name}"):
+                    return func(*args, **kwargs)
+
+            install_sql_hooks()
+            profile = RenderProfile(name)
+            _local.profile = profile
+            sampler = _Sampler(threading.get_ident(), profile)
+            sampler.start()
+            t0 = time.perf_counter()
+            completed = False
+            try:
+                result = func(*args, **kwargs)
+                completed = True
+                return result
+            finally:
+                profile.wall_ms = (time.perf_counter() - t0) * 1000
+                sampler.stopped.set()
+                sampler.join()
+                _local.profile = None
+                _recent_profiles.append(profile)
+                _dump(profile)
+                if completed:
+                    # import locale: il pannello usa streamlit, il profiler no
+                    from app.components.debug_panel import debug_panel
+                    debug_panel(profile)
+        return wrapper
+    return decorator
@@ -0,0 +1,47 @@
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Fallback applicati dall'avvio del processo, per fase ed esito (es. "sanificazione:solo_regex")
+_fallback_counts = Counter()
+_fallback_lock = threading.Lock()
+
+
+def fallback_stats() -> Dict[str, int]:
+    with _fallback_lock:
+        return dict(_fallback_counts)
+
+
+class RequestTrace:
+    """Tempi per fase ed esiti dei controlli di una singola richiesta."""
+
+    def __init__(self, user_email: Optional[str] = None, role: Optional[str] = None):
+        self.user_email = user_email
+        self.role = role
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.verdicts: Dict[str, object] = {}
+        self.fallbacks: Dict[str, str] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - t0) * 1000
+
+    def verdict(self, name: str, value) -> None:
+        self.verdicts[name] = value
+
+    def fallback(self, name: str, outcome: str) -> None:
+        """Registra che il controllo name ha esaurito il budget e si è usato il fallback outcome."""
+        self.fallbacks[name] = outcome
+        with _fallback_lock:
+            _fallback_counts[f"{name}:{outcome}"] += 1
+
+    @property
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
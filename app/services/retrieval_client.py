@@ -0,0 +1,77 @@
+import http.client
+import json
+import socket
+from typing import List, Optional, Sequence
+from urllib.parse import urlparse
+
+from langchain_core.documents import Document
+
+from app.config import RETRIEVAL_SERVICE_URL, RETRIEVAL_SERVICE_TIMEOUT
+from app.services.deadline import BudgetExceeded
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """Connessione HTTP su socket Unix (il servizio gira sulla stessa macchina)."""
+
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def _connection(url: str, timeout: float) -> http.client.HTTPConnection:
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        return _UnixHTTPConnection(parsed.path, timeout)
+    return http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=timeout)
+
+
+def _call(method: str, path: str, payload: Optional[dict] = None, url: str = RETRIEVAL_SERVICE_URL,
+          timeout: Optional[float] = None):
+    """
+    Chiamata al servizio di retrieval. Un timeout o un servizio irraggiungibile diventano
+    BudgetExceeded, che il chiamante gestisce col suo fallback.
+    """
+    conn = _connection(url, min(timeout, RETRIEVAL_SERVICE_TIMEOUT) if timeout else RETRIEVAL_SERVICE_TIMEOUT)
+    try:
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        try:
+            conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+            resp = conn.getresponse()
+            data = json.loads(resp.read() or b"{}")
+        except OSError as e:
+            # socket.timeout è TimeoutError, sottoclasse di OSError come ConnectionRefusedError
+            raise BudgetExceeded(f"servizio di retrieval {path}: {e}") from e
+        if resp.status != 200:
+            raise RuntimeError(f"Servizio di retrieval: {data.get('error', resp.reason)}")
+        return data
+    finally:
+        conn.close()
+
+
+def retrieve(email_paziente: str, query: str, k: int = 3,
+             timeout: Optional[float] = None) -> Optional[List[Document]]:
+    data = _call("POST", "/retrieve", {"email": email_paziente, "query": query, "k": k}, timeout=timeout)
+    if data["documents"] is None:
+        return None
+    return [Document(page_content=d["page_content"], metadata=d["metadata"]) for d in data["documents"]]
+
+
+def index_document(email_paziente: str, text: str, content_hash: str, metadata: dict,
+                   timeout: Optional[float] = None) -> int:
+    data = _call("POST", "/index", {
+        "email": email_paziente, "text": text, "content_hash": content_hash, "metadata": metadata,
+    }, timeout=timeout)
+    return data["n_chunks"]
+
+
+def embed_texts(texts: Sequence[str]) -> List[List[float]]:
+    return _call("POST", "/embed", {"texts": list(texts)})["vectors"]
+
+
+def health(url: str = RETRIEVAL_SERVICE_URL) -> dict:
+    return _call("GET", "/health", url=url)
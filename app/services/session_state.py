@@ -0,0 +1,36 @@
+import sys
+from typing import List, Tuple
+
+
+def deep_sizeof(obj, _seen=None) -> int:
+    """Stima della memoria occupata da un oggetto e da tutto ciò che referenzia."""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, _seen) + deep_sizeof(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)) or hasattr(obj, "__iter__") and hasattr(obj, "__len__"):
+        try:
+            size += sum(deep_sizeof(item, _seen) for item in obj)
+        except TypeError:
+            pass
+    if hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), _seen)
+    for slot in getattr(type(obj), "__slots__", ()):
+        if slot != "__weakref__" and hasattr(obj, slot):
+            size += deep_sizeof(getattr(obj, slot), _seen)
+    return size
+
+
+def session_memory_report(state) -> Tuple[int, List[Tuple[str, int]]]:
+    """Memoria stimata per ogni chiave di st.session_state, in ordine decrescente, e totale."""
+    seen = set()
+    entries = [(str(key), deep_sizeof(state[key], seen)) for key in list(state.keys())]
+    entries.sort(key=lambda e: e[1], reverse=True)
+    return sum(size for _, size in entries), entries
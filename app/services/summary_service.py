@@ -0,0 +1,214 @@
+import logging
+import queue
+import re
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.config import SUMMARY_LLM_TIMEOUT, SUMMARY_MAX_DOC_CHARS, SUMMARY_QUEUE_SIZE
+from app.database.postgres import SessionLocal
+from app.models.doc import Doc
+from app.models.patient_summary import PatientSummary
+from app.services.llm_client import chat
+from app.services.llm_scheduler import PRIORITY_BACKGROUND, for_user
+from app.services.log_throttle import ThrottledErrors
+
+logger = logging.getLogger(__name__)
+_update_errors = ThrottledErrors(logger)
+
+SUMMARY_MODEL = "mistral"
+
+# Domande a cui si risponde col riassunto già pronto invece che con retrieval e generazione
+SUMMARY_QUESTION_RE = re.compile(
+    r"\b(riassum\w*|riepilog\w*|sintesi|sintetizz\w*|panoramica|quadro\s+clinico|"
+    r"situazione\s+clinica|storia\s+clinica|stato\s+di\s+salute)\b",
+    re.IGNORECASE,
+)
+
+UPDATE_PROMPT = """Sei un infermiere virtuale che mantiene il riepilogo clinico di un paziente per il suo medico.
+
+Riepilogo attuale:
+{summary}
+
+Nuovo estratto dal documento "{filename}":
+{text}
+
+Aggiorna il riepilogo integrando le informazioni nuove dell'estratto:
+- conserva le informazioni del riepilogo attuale, correggendole solo se l'estratto le aggiorna;
+- riporta diagnosi, esami con data ed esito, visite e controlli programmati;
+- riporta terapie e farmaci solo se presenti nei documenti, indicandone la fonte;
+- non aggiungere informazioni esterne ai documenti;
+- massimo 300 parole, elenco puntato per argomento.
+Rispondi solo con il riepilogo aggiornato."""
+
+
+def is_summary_question(query: str) -> bool:
+    return bool(SUMMARY_QUESTION_RE.search(query or ""))
+
+
+def _pieces(text: str) -> List[str]:
+    text = (text or "").strip()
+    return [text[i:i + SUMMARY_MAX_DOC_CHARS] for i in range(0, len(text), SUMMARY_MAX_DOC_CHARS)]
+
+
+def _integrate(summary: str, filename: str, text: str) -> str:
+    """Aggiorna il riassunto con un documento: al modello vanno solo riassunto attuale e testo nuovo."""
+    for piece in _pieces(text):
+        prompt = UPDATE_PROMPT.format(summary=summary or "(nessuno: primo documento)", filename=filename, text=piece)
+        resp = chat(model=SUMMARY_MODEL, messages=[{"role": "user", "content": prompt}],
+                    timeout=SUMMARY_LLM_TIMEOUT, priority=PRIORITY_BACKGROUND)
+        summary = resp["message"]["content"].strip() or summary
+    return summary
+
+
+def update_summary(email: str, known_texts: Optional[Dict[int, str]] = None) -> int:
+    """
+    Integra nel riassunto del paziente i documenti non ancora riassunti e ritorna quanti
+    ne ha integrati. Il testo viene preso da known_texts (già estratto all'upload) oppure
+    estratto dal PDF salvato. Se un documento è stato rimosso il riassunto riparte da zero.
+    Il riassunto viene salvato dopo ogni documento, così un errore non fa perdere il lavoro fatto.
+    """
+    # import locali: estrazione PDF e Presidio servono solo nel worker
+    from app.security_components.pii_index import detect_pii_terms
+    from app.services.pdf_extraction import extract_text
+
+    known_texts = known_texts or {}
+    db = SessionLocal()
+    try:
+        docs = db.query(Doc.id, Doc.filename).filter(Doc.paziente_email == email).order_by(Doc.id).all()
+        row = db.get(PatientSummary, email)
+        if row is None:
+            row = PatientSummary(paziente_email=email, summary="", doc_ids=[], pii_terms=[], model=SUMMARY_MODEL)
+            db.add(row)
+        done = set(row.doc_ids or [])
+        if done - {d.id for d in docs}:
+            row.summary, done = "", set()
+
+        integrated = 0
+        for doc_id, filename in docs:
+            if doc_id in done:
+                continue
+            text = known_texts.get(doc_id)
+            if text is None:
+                text = extract_text(db.get(Doc, doc_id).file_data)
+            with for_user(email):
+                row.summary = _integrate(row.summary, filename, text)
+            done.add(doc_id)
+            row.doc_ids = sorted(done)
+            row.pii_terms = detect_pii_terms(row.summary)
+            row.model = SUMMARY_MODEL
+            row.updated_at = datetime.now(timezone.utc).replace(tzinfo=None)
+            db.commit()
+            integrated += 1
+        return integrated
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class SummaryUpdater:
+    """
+    Aggiorna i riassunti in un thread in background, un paziente alla volta (due upload
+    ravvicinati dello stesso paziente non si sovrappongono). In coda c'è al massimo una
+    voce per paziente: i documenti arrivati nel frattempo vengono integrati insieme.
+    Con la coda piena l'aggiornamento viene scartato; il riassunto resta indietro e viene
+    completato al prossimo aggiornamento (le risposte non usano riassunti non aggiornati).
+    """
+
+    def __init__(self, queue_size: int = SUMMARY_QUEUE_SIZE):
+        self.stats = Counter()
+        self._queue: "queue.Queue[str]" = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Dict[int, str]] = {}
+        self._thread = threading.Thread(target=self._run, name="summary-updater", daemon=True)
+        self._thread.start()
+
+    def submit(self, email: str, doc_id: Optional[int] = None, text: Optional[str] = None) -> None:
+        with self._lock:
+            queued = email in self._pending
+            texts = self._pending.setdefault(email, {})
+            if doc_id is not None and text is not None:
+                texts[doc_id] = text
+            if queued:
+                self.stats["accorpati"] += 1
+                return
+            try:
+                self._queue.put_nowait(email)
+                self.stats["accodati"] += 1
+            except queue.Full:
+                del self._pending[email]
+                self.stats["scartati"] += 1
+
+    def _run(self) -> None:
+        while True:
+            email = self._queue.get()
+            with self._lock:
+                texts = self._pending.pop(email, {})
+            try:
+                self.stats["documenti"] += update_summary(email, texts)
+                self.stats["aggiornati"] += 1
+            except Exception:
+                self.stats["errori"] += 1
+                _update_errors.exception("aggiornamento del riassunto di %s fallito", email)
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+
+_updater: Optional[SummaryUpdater] = None
+_updater_lock = threading.Lock()
+
+
+def get_updater() -> SummaryUpdater:
+    global _updater
+    with _updater_lock:
+        if _updater is None:
+            _updater = SummaryUpdater()
+        return _updater
+
+
+def schedule_summary_update(email: str, doc_id: Optional[int] = None, text: Optional[str] = None) -> None:
+    """Accoda l'aggiornamento del riassunto del paziente (text: testo del documento appena caricato)."""
+    get_updater().submit(email, doc_id, text)
+
+
+def summary_stats() -> Dict[str, int]:
+    if _updater is None:
+        return {}
+    return dict(_updater.stats, in_coda=_updater.pending)
+
+
+def load_summary(email: str) -> Tuple[Optional[PatientSummary], bool]:
+    """
+    Riassunto salvato del paziente e se è aggiornato (comprende tutti i suoi documenti).
+    Un riassunto non aggiornato viene rimesso in coda.
+    """
+    db = SessionLocal()
+    try:
+        row = db.get(PatientSummary, email)
+        doc_ids = {d for (d,) in db.query(Doc.id).filter(Doc.paziente_email == email)}
+        if row is not None:
+            db.expunge(row)
+    finally:
+        db.close()
+    fresh = row is not None and bool(doc_ids) and set(row.doc_ids or []) == doc_ids
+    if doc_ids and not fresh:
+        schedule_summary_update(email)
+    return row, fresh
+
+
+def summary_answer(email: str, query_terms: Iterable[str] = ()) -> Optional[str]:
+    """Risposta col riassunto aggiornato del paziente (PII oscurati), oppure None se non è pronto."""
+    from app.security_components.PII_obfuscation import REDACTED_PLACEHOLDER
+    from app.security_components.pii_index import redact_terms
+
+    row, fresh = load_summary(email)
+    if not fresh:
+        return None
+    text = redact_terms(row.summary, set(row.pii_terms or []) | set(query_terms), REDACTED_PLACEHOLDER)
+    return (f"📋 Riepilogo clinico aggiornato al {row.updated_at:%d/%m/%Y %H:%M} "
+            f"({len(row.doc_ids)} documenti):\n\n{text}")
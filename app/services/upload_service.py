@@ -0,0 +1,137 @@
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from app.config import (
+    RETRIEVAL_SERVICE_URL,
+    SUMMARY_ENABLED,
+    UPLOAD_LATENCY_BUDGET,
+    UPLOAD_STAGED_INDEXING,
+    UPLOAD_STAGING_WORKERS,
+)
+from app.models.doc import Doc
+from app.security_components.doc_validation import extract_checked_pages
+from app.services.deadline import Deadline
+from app.services.llm_scheduler import for_user
+from app.services.request_trace import RequestTrace
+from app.services.summary_service import schedule_summary_update
+from app.services.validation_cache import validate_pdf_cached
+from app.services.vectorstore_service import commit_staged, index_document, stage_document
+
+_staging_pool: Optional[ThreadPoolExecutor] = None
+_staging_lock = threading.Lock()
+
+
+@dataclass
+class UploadResult:
+    """Esito del caricamento di un referto."""
+    valid: bool
+    message: str
+    doc: Optional[Doc] = None
+    n_chunks: int = 0
+    index_error: Optional[str] = None
+    trace: RequestTrace = field(default_factory=RequestTrace)
+
+
+def _get_staging_pool() -> ThreadPoolExecutor:
+    global _staging_pool
+    with _staging_lock:
+        if _staging_pool is None:
+            _staging_pool = ThreadPoolExecutor(max_workers=UPLOAD_STAGING_WORKERS, thread_name_prefix="upload-staging")
+        return _staging_pool
+
+
+def _start_staging(paziente_email: str, filename: str, text: str, content_hash: str,
+                   abort: threading.Event) -> Optional[Future]:
+    """
+    Avvia chunking, PII ed embedding del documento mentre la validazione è ancora in corso.
+    Niente viene scritto nel vectorstore finché il documento non è valido e salvato.
+    Con il servizio di retrieval condiviso l'embedding avviene nel servizio: niente anticipo.
+    """
+    if not UPLOAD_STAGED_INDEXING or RETRIEVAL_SERVICE_URL:
+        return None
+    return _get_staging_pool().submit(stage_document, paziente_email, text, content_hash,
+                                      {"filename": filename}, abort=abort)
+
+
+def ingest_document(db: Session, paziente_email: str, filename: str, file_bytes: bytes,
+                    trace: Optional[RequestTrace] = None,
+                    deadline: Optional[Deadline] = None, uploader=None) -> UploadResult:
+    """
+    Valida il PDF, lo salva su PostgreSQL e lo indicizza nel vector store.
+    Gli embedding vengono calcolati in parallelo alla validazione e scritti solo se il
+    documento è valido (altrimenti vengono scartati): il tempo dell'upload è circa il
+    maggiore dei due invece della somma.
+    Un errore di indicizzazione non annulla il salvataggio: viene riportato in index_error.
+    Il riassunto clinico del paziente viene aggiornato in background col testo già estratto.
+    La validazione deve concludersi entro UPLOAD_LATENCY_BUDGET, altrimenti il documento è rifiutato.
+    Le chiamate LLM della validazione sono attribuite a uploader (chi carica), se indicato,
+    altrimenti al paziente.
+    """
+    trace = trace or RequestTrace()
+    deadline = deadline or Deadline(UPLOAD_LATENCY_BUDGET)
+
+    # il testo viene estratto una sola volta e serve sia alla validazione sia all'indicizzazione
+    # i contatori dell'estrazione (pagine saltate, testo troncato) servono alla validazione;
+    # le pagine sono controllate man mano e una pagina sospetta ferma subito l'estrazione
+    stats = {}
+    with trace.stage("estrazione"):
+        pages, rejection = extract_checked_pages(file_bytes, stats)
+    if rejection:
+        trace.verdict("validazione", False)
+        return UploadResult(False, rejection, trace=trace)
+    text = "".join(pages)
+    content_hash = hashlib.sha256(file_bytes).hexdigest()
+
+    abort = threading.Event()
+    staging = _start_staging(paziente_email, filename, text, content_hash, abort)
+    trace.verdict("indicizzazione_anticipata", staging is not None)
+    try:
+        email, role = (uploader.email, uploader.role) if uploader is not None else (paziente_email, None)
+        with trace.stage("validazione"), for_user(email, role):
+            valid, message, from_cache = validate_pdf_cached(db, file_bytes, pages, deadline, stats)
+        if stats.get("budget_exhausted"):
+            trace.fallback("validazione", "rifiuto")
+        trace.verdict("validazione", valid)
+        trace.verdict("validazione_da_cache", from_cache)
+        if not valid:
+            return UploadResult(False, message, trace=trace)
+
+        with trace.stage("salvataggio"):
+            new_doc = Doc(
+                filename=filename,
+                paziente_email=paziente_email,
+                file_data=file_bytes
+            )
+            db.add(new_doc)
+            db.commit()
+
+        result = UploadResult(True, message, doc=new_doc, trace=trace)
+        try:
+            # con l'anticipo resta solo l'attesa degli embedding ancora in calcolo e la scrittura
+            with trace.stage("indicizzazione"):
+                staged = staging.result() if staging is not None else None
+                if staged is not None:
+                    result.n_chunks = commit_staged(staged, {"doc_id": new_doc.id})
+                else:
+                    result.n_chunks = index_document(
+                        paziente_email,
+                        text,
+                        content_hash=content_hash,
+                        metadata={"doc_id": new_doc.id, "filename": new_doc.filename},
+                        timeout=deadline.timeout()
+                    )
+        except Exception as e:
+            result.index_error = str(e)
+        if SUMMARY_ENABLED:
+            schedule_summary_update(paziente_email, new_doc.id, text)
+        return result
+    finally:
+        # documento rifiutato o errore: gli embedding in preparazione vengono scartati
+        abort.set()
+        if staging is not None:
+            staging.cancel()
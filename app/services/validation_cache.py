@@ -0,0 +1,59 @@
+import hashlib
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.models.validation_verdict import ValidationVerdict
+from app.security_components.doc_validation import (
+    CLASSIFIER_MODEL,
+    VALIDATOR_VERSION,
+    extraction_incomplete,
+    validate_pdf_content,
+)
+from app.security_components.medical_lexicon import LEXICON_VERSION
+from app.services.deadline import Deadline
+from app.services.llm_client import model_digest
+
+
+def validator_version(deadline: Optional[Deadline] = None) -> str:
+    """
+    Identifica euristiche, lessico e modello usati per validare: se uno di questi
+    cambia, i verdetti salvati con la versione precedente non vengono più usati.
+    Il digest del modello è letto entro il budget di deadline.
+    """
+    digest = model_digest(CLASSIFIER_MODEL, deadline)
+    return f"v{VALIDATOR_VERSION}-lex{LEXICON_VERSION}-{CLASSIFIER_MODEL}@{digest.split(':')[-1][:12]}"
+
+
+def validate_pdf_cached(db: Session, pdf_bytes: bytes,
+                        pages_texts: Optional[List[str]] = None,
+                        deadline: Optional[Deadline] = None,
+                        stats: Optional[dict] = None) -> Tuple[bool, str, bool]:
+    """
+    Come validate_pdf_content, ma riusa il verdetto già calcolato per lo stesso file
+    (SHA-256 dei byte) con la stessa versione del validatore. Ritorna (valido, messaggio, da_cache).
+    I verdetti ottenuti con errori del modello, a budget esaurito o con un'estrazione del
+    testo incompleta non vengono salvati. stats riceve anche i contatori dell'estrazione
+    che ha prodotto pages_texts (vedi validate_pdf_content).
+    """
+    sha = hashlib.sha256(pdf_bytes).hexdigest()
+    version = validator_version(deadline)
+
+    cached = db.get(ValidationVerdict, sha)
+    if cached is not None and cached.validator_version == version:
+        return cached.valid, cached.message, True
+
+    stats = {} if stats is None else stats
+    valid, message = validate_pdf_content(pdf_bytes, stats=stats, pages_texts=pages_texts, deadline=deadline)
+    if (stats.get("llm_errors", 0) == 0 and stats.get("budget_exhausted", 0) == 0
+            and not extraction_incomplete(stats) and not version.endswith("@unknown")):
+        db.merge(ValidationVerdict(
+            sha256=sha,
+            validator_version=version,
+            valid=valid,
+            message=message,
+            created_at=datetime.now(timezone.utc).replace(tzinfo=None),
+        ))
+        db.commit()
+    return valid, message, False
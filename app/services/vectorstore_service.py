@@ -0,0 +1,416 @@
+import os
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Sequence
+
+import chromadb
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_community.embeddings import DeterministicFakeEmbedding, HuggingFaceEmbeddings
+
+# Import corretto in base alla versione di LangChain
+try:
+    from langchain.text_splitters import CharacterTextSplitter
+except ModuleNotFoundError:
+    from langchain.text_splitter import CharacterTextSplitter
+
+from app.config import (
+    CHROMA_DIR,
+    VECTORSTORE_LAYOUT,
+    CHROMA_HNSW_M,
+    CHROMA_HNSW_CONSTRUCTION_EF,
+    CHROMA_HNSW_SEARCH_EF,
+    RETRIEVAL_SERVICE_URL,
+    VECTOR_BACKEND,
+    COMPACT_MAX_CHUNKS,
+    COMPACT_DTYPE,
+)
+from app.services.compact_store import CompactStore
+from app.services.index_versions import IndexSpec, active_spec, write_specs
+from app.security_components.pii_index import pii_metadata
+
+COLLECTION_NAME = "docs"
+EMBED_BATCH_SIZE = 64
+
+# Layout condiviso: una sola collection, i chunk sono filtrati per paziente_email
+SHARED_DIR_NAME = "_shared"
+SHARED_COLLECTION_NAME = "docs_all"
+
+_clients: Dict[str, "chromadb.api.ClientAPI"] = {}
+_last_active = {"version": None}
+# protegge _clients e _last_active (thread delle coorti, staging degli upload, servizio di retrieval)
+_clients_lock = threading.Lock()
+
+# Scritture per paziente: scelta tra store compatto e Chroma, promozione e upsert vanno
+# eseguite insieme. Un numero fisso di lock condivisi tra pazienti (per hash dell'email).
+_PATIENT_LOCKS = [threading.Lock() for _ in range(64)]
+
+
+def _patient_lock(email_paziente: str) -> threading.Lock:
+    return _PATIENT_LOCKS[hash(email_paziente) % len(_PATIENT_LOCKS)]
+
+
+@lru_cache(maxsize=4)
+def get_embeddings(model_name: str) -> Embeddings:
+    """Restituisce il modello di embedding, caricato una sola volta per processo."""
+    if model_name.startswith("fake:"):
+        # vettori deterministici derivati dal testo: per test di carico senza modello
+        return DeterministicFakeEmbedding(size=int(model_name.split(":", 1)[1]))
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        encode_kwargs={"normalize_embeddings": True, "batch_size": EMBED_BATCH_SIZE}
+    )
+
+
+@lru_cache(maxsize=4)
+def _get_text_splitter(chunk_size: int, chunk_overlap: int) -> CharacterTextSplitter:
+    return CharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def split_text(text: str, spec: Optional[IndexSpec] = None) -> List[str]:
+    """Divide il testo di un documento nei chunk da indicizzare, secondo il chunker della versione."""
+    spec = spec or active_spec()
+    return _get_text_splitter(spec.chunk_size, spec.chunk_overlap).split_text(text)
+
+
+def embed_texts(texts: Sequence[str],
+                batch_size: int = EMBED_BATCH_SIZE,
+                spec: Optional[IndexSpec] = None,
+                abort: Optional[threading.Event] = None) -> List[List[float]]:
+    """
+    Calcola gli embedding di una lista di testi a blocchi di batch_size.
+    Se abort viene impostato il calcolo si ferma al blocco successivo (vettori parziali).
+    """
+    embeddings = get_embeddings((spec or active_spec()).embedding_model)
+    vectors: List[List[float]] = []
+    for i in range(0, len(texts), batch_size):
+        if abort is not None and abort.is_set():
+            break
+        vectors.extend(embeddings.embed_documents(list(texts[i:i + batch_size])))
+    return vectors
+
+
+def embed_query(text: str, spec: Optional[IndexSpec] = None) -> List[float]:
+    return get_embeddings((spec or active_spec()).embedding_model).embed_query(text)
+
+
+def patient_persist_dir(email_paziente: str, root: str = CHROMA_DIR) -> str:
+    return os.path.join(root, email_paziente)
+
+
+def shared_persist_dir(root: str = CHROMA_DIR) -> str:
+    return os.path.join(root, SHARED_DIR_NAME)
+
+
+def shared_collection_metadata() -> dict:
+    """Parametri HNSW della collection condivisa (regolabili da variabili d'ambiente)."""
+    return {
+        "hnsw:space": "cosine",
+        "hnsw:M": CHROMA_HNSW_M,
+        "hnsw:construction_ef": CHROMA_HNSW_CONSTRUCTION_EF,
+        "hnsw:search_ef": CHROMA_HNSW_SEARCH_EF,
+    }
+
+
+def get_client(persist_dir: str):
+    with _clients_lock:
+        client = _clients.get(persist_dir)
+        if client is None:
+            os.makedirs(persist_dir, exist_ok=True)
+            client = chromadb.PersistentClient(path=persist_dir)
+            _clients[persist_dir] = client
+        return client
+
+
+def _resolve(spec: Optional[IndexSpec]) -> IndexSpec:
+    if spec is not None:
+        return spec
+    spec = active_spec()
+    with _clients_lock:
+        previous = _last_active["version"]
+        if previous is not None and previous != spec.version:
+            # la versione attiva è cambiata (re-indexing concluso): i vecchi client non servono più;
+            # chi li sta usando ne tiene il riferimento e finisce la sua operazione
+            for old_path in list(_clients):
+                if not old_path.startswith(os.path.join(spec.root, "")):
+                    del _clients[old_path]
+        _last_active["version"] = spec.version
+    return spec
+
+
+def current_spec() -> IndexSpec:
+    """Versione attiva dell'indice (rilascia i client delle versioni ritirate)."""
+    return _resolve(None)
+
+
+def get_shared_collection(root: str = CHROMA_DIR):
+    client = get_client(shared_persist_dir(root))
+    return client.get_or_create_collection(SHARED_COLLECTION_NAME, metadata=shared_collection_metadata())
+
+
+def get_collection(email_paziente: str, spec: Optional[IndexSpec] = None):
+    """
+    Restituisce (creandola se necessario) la collection che contiene i chunk del paziente:
+    la sua collection privata oppure quella condivisa, in base a VECTORSTORE_LAYOUT.
+    """
+    root = _resolve(spec).root
+    if VECTORSTORE_LAYOUT == "shared":
+        return get_shared_collection(root)
+    client = get_client(patient_persist_dir(email_paziente, root))
+    return client.get_or_create_collection(COLLECTION_NAME)
+
+
+def has_vectorstore(email_paziente: str, spec: Optional[IndexSpec] = None) -> bool:
+    spec = _resolve(spec)
+    if VECTORSTORE_LAYOUT == "shared":
+        if not os.path.exists(shared_persist_dir(spec.root)):
+            return False
+        found = get_shared_collection(spec.root).get(
+            where={"paziente_email": email_paziente}, limit=1, include=[]
+        )
+        return bool(found["ids"])
+    return (os.path.exists(patient_persist_dir(email_paziente, spec.root))
+            or compact_store(email_paziente, spec).exists())
+
+
+def compact_store(email_paziente: str, spec: Optional[IndexSpec] = None) -> CompactStore:
+    """Store compatto (vettori quantizzati, ricerca esatta) del paziente nella versione data."""
+    return CompactStore(email_paziente, _resolve(spec).root, COMPACT_DTYPE)
+
+
+def _compact_enabled() -> bool:
+    # nel layout condiviso non c'è un costo fisso per paziente da evitare
+    return VECTOR_BACKEND == "auto" and VECTORSTORE_LAYOUT == "per_patient"
+
+
+def search(email_paziente: str,
+           query_vector: Sequence[float],
+           k: int = 3,
+           spec: Optional[IndexSpec] = None) -> Optional[List[Document]]:
+    """I k chunk del paziente più vicini al vettore dato, oppure None se non ha documenti indicizzati."""
+    spec = _resolve(spec)
+    if not has_vectorstore(email_paziente, spec):
+        return None
+
+    store = compact_store(email_paziente, spec)
+    if store.exists():
+        if os.path.exists(patient_persist_dir(email_paziente, spec.root)):
+            # promozione a Chroma in corso: si attende che finisca, poi vale Chroma
+            with _patient_lock(email_paziente):
+                pass
+        else:
+            return [Document(page_content=text, metadata=meta or {})
+                    for text, meta, _ in store.query(query_vector, k)]
+
+    query_kwargs = {}
+    if VECTORSTORE_LAYOUT == "shared":
+        query_kwargs["where"] = {"paziente_email": email_paziente}
+
+    res = get_collection(email_paziente, spec).query(
+        query_embeddings=[list(query_vector)],
+        n_results=k,
+        include=["documents", "metadatas"],
+        **query_kwargs
+    )
+    documents = res["documents"][0] if res["documents"] else []
+    metadatas = res["metadatas"][0] if res["metadatas"] else [None] * len(documents)
+    return [Document(page_content=text, metadata=meta or {}) for text, meta in zip(documents, metadatas)]
+
+
+def retrieve(email_paziente: str, query: str, k: int = 3,
+             timeout: Optional[float] = None) -> Optional[List[Document]]:
+    """
+    Restituisce i k chunk del paziente più simili alla query,
+    oppure None se il paziente non ha documenti indicizzati.
+    Le query sono servite sempre dalla versione attiva dell'indice; se è configurato
+    RETRIEVAL_SERVICE_URL la ricerca avviene nel servizio di retrieval condiviso
+    (timeout limita l'attesa della risposta).
+    """
+    if RETRIEVAL_SERVICE_URL:
+        from app.services import retrieval_client
+        return retrieval_client.retrieve(email_paziente, query, k, timeout=timeout)
+
+    spec = current_spec()
+    if not has_vectorstore(email_paziente, spec):
+        return None
+    return search(email_paziente, embed_query(query, spec), k, spec)
+
+
+def add_chunks(email_paziente: str,
+               chunks: Sequence[str],
+               ids: Sequence[str],
+               metadatas: Optional[Sequence[dict]] = None,
+               vectors: Optional[Sequence[Sequence[float]]] = None,
+               spec: Optional[IndexSpec] = None) -> None:
+    """
+    Scrive i chunk nel vectorstore del paziente con una sola upsert.
+    Se vectors è None gli embedding vengono calcolati qui; gli id deterministici
+    rendono la scrittura idempotente (ripetere l'operazione non duplica i chunk).
+    """
+    if not chunks:
+        return
+    spec = _resolve(spec)
+    if vectors is None:
+        vectors = embed_texts(chunks, spec=spec)
+
+    metadatas = [dict(m) for m in metadatas] if metadatas else [{} for _ in chunks]
+    ids = list(ids)
+    if VECTORSTORE_LAYOUT == "shared":
+        # nella collection condivisa gli id devono essere unici tra pazienti diversi
+        ids = [f"{email_paziente}:{i}" for i in ids]
+    for m in metadatas:
+        m["paziente_email"] = email_paziente
+
+    if _compact_enabled():
+        # conteggio, promozione e upsert sotto lo stesso lock: una scrittura concorrente
+        # non può ricreare lo store compatto dopo che il paziente è passato a Chroma
+        with _patient_lock(email_paziente):
+            if not os.path.exists(patient_persist_dir(email_paziente, spec.root)):
+                store = compact_store(email_paziente, spec)
+                if store.count() + len(ids) <= COMPACT_MAX_CHUNKS:
+                    store.upsert(ids, vectors, chunks, metadatas)
+                    return
+                _promote_to_chroma(email_paziente, store, spec)
+            _upsert_chroma(email_paziente, ids, vectors, chunks, metadatas, spec)
+        return
+    _upsert_chroma(email_paziente, ids, vectors, chunks, metadatas, spec)
+
+
+def _upsert_chroma(email_paziente: str, ids: List[str], vectors: Sequence[Sequence[float]],
+                   chunks: Sequence[str], metadatas: List[dict], spec: IndexSpec) -> None:
+    get_collection(email_paziente, spec).upsert(
+        ids=ids,
+        embeddings=[list(v) for v in vectors],
+        documents=list(chunks),
+        metadatas=metadatas
+    )
+
+
+def _promote_to_chroma(email_paziente: str, store: CompactStore, spec: IndexSpec) -> None:
+    """
+    Il paziente ha superato COMPACT_MAX_CHUNKS: i suoi chunk passano dallo store compatto
+    a Chroma. Lo store compatto viene rimosso solo dopo la scrittura e le query attendono
+    la fine della promozione (vedi search), così trovano sempre un indice completo.
+    Va chiamata col lock del paziente.
+    """
+    ids, vectors, documents, metadatas = store.entries()
+    if ids:
+        get_collection(email_paziente, spec).upsert(
+            ids=ids,
+            embeddings=vectors.tolist(),
+            documents=documents,
+            metadatas=metadatas
+        )
+    store.drop()
+
+
+def index_document(email_paziente: str,
+                   text: str,
+                   content_hash: str,
+                   metadata: dict,
+                   specs: Optional[Sequence[IndexSpec]] = None,
+                   timeout: Optional[float] = None) -> int:
+    """
+    Indicizza il testo di un documento in tutte le versioni che ricevono scritture
+    (la attiva e, durante un re-indexing, quella in costruzione). Insieme a ogni chunk
+    vengono salvati i PII che contiene, così la risposta può essere oscurata senza
+    rianalizzarla. Ritorna il numero di chunk scritti nella prima versione.
+    Senza specs esplicite, se è configurato RETRIEVAL_SERVICE_URL la scrittura
+    è delegata al servizio di retrieval condiviso (timeout limita l'attesa della risposta).
+    """
+    if RETRIEVAL_SERVICE_URL and specs is None:
+        from app.services import retrieval_client
+        return retrieval_client.index_document(email_paziente, text, content_hash, metadata, timeout=timeout)
+    return index_document_with(email_paziente, text, content_hash, metadata, specs)
+
+
+def index_document_with(email_paziente: str,
+                        text: str,
+                        content_hash: str,
+                        metadata: dict,
+                        specs: Optional[Sequence[IndexSpec]] = None,
+                        embed: Optional[Callable[[Sequence[str], IndexSpec], List[List[float]]]] = None) -> int:
+    """Come index_document, sempre in questo processo; embed permette di sostituire il calcolo degli embedding."""
+    return commit_staged(stage_document(email_paziente, text, content_hash, metadata, specs, embed))
+
+
+@dataclass
+class _StagedBatch:
+    spec: IndexSpec
+    chunks: List[str]
+    ids: List[str]
+    metadatas: List[dict]
+    vectors: List[List[float]]
+
+
+@dataclass
+class StagedDocument:
+    """
+    Documento pronto per l'indicizzazione ma non ancora scritto: chunk, PII ed embedding
+    già calcolati per ogni versione dell'indice. Finché non viene passato a commit_staged
+    non è visibile alle ricerche; per scartarlo basta non usarlo.
+    """
+    email_paziente: str
+    batches: List[_StagedBatch] = field(default_factory=list)
+
+    @property
+    def n_chunks(self) -> int:
+        return len(self.batches[0].chunks) if self.batches else 0
+
+
+def stage_document(email_paziente: str,
+                   text: str,
+                   content_hash: str,
+                   metadata: dict,
+                   specs: Optional[Sequence[IndexSpec]] = None,
+                   embed: Optional[Callable[[Sequence[str], IndexSpec], List[List[float]]]] = None,
+                   abort: Optional[threading.Event] = None) -> Optional[StagedDocument]:
+    """
+    Prima metà di index_document_with: la parte costosa (chunking, PII, embedding), senza
+    scrivere nel vectorstore. Può quindi girare mentre il documento viene ancora validato.
+    Ritorna None se abort viene impostato prima della fine (documento scartato).
+    """
+    staged = StagedDocument(email_paziente)
+    for spec in specs or write_specs():
+        if abort is not None and abort.is_set():
+            return None
+        chunks = split_text(text, spec)
+        if embed and chunks:
+            vectors = embed(chunks, spec)
+        else:
+            vectors = embed_texts(chunks, spec=spec, abort=abort)
+        staged.batches.append(_StagedBatch(
+            spec=spec,
+            chunks=chunks,
+            ids=chunk_ids(content_hash, len(chunks)),
+            metadatas=[{**metadata, **pii} for pii in pii_metadata(chunks)],
+            vectors=vectors,
+        ))
+    if abort is not None and abort.is_set():
+        return None
+    return staged
+
+
+def commit_staged(staged: StagedDocument, metadata: Optional[dict] = None) -> int:
+    """
+    Scrive un documento preparato con stage_document: una sola upsert per versione
+    dell'indice, nessun embedding da calcolare. metadata si aggiunge a quelli di ogni
+    chunk (es. doc_id, noto solo dopo il salvataggio su Postgres).
+    Ritorna il numero di chunk scritti nella prima versione.
+    """
+    for batch in staged.batches:
+        add_chunks(
+            staged.email_paziente,
+            batch.chunks,
+            ids=batch.ids,
+            metadatas=[{**m, **(metadata or {})} for m in batch.metadatas],
+            vectors=batch.vectors,
+            spec=batch.spec
+        )
+    return staged.n_chunks
+
+
+def chunk_ids(content_hash: str, n_chunks: int) -> List[str]:
+    """Id dei chunk derivati dall'hash del file: stesso PDF -> stessi id."""
+    return [f"{content_hash[:32]}-{i}" for i in range(n_chunks)]
@@ -0,0 +1,108 @@
+"""
+Confronto tra classificazione documentale attuale (tutti i chunk a Ollama) e
+cascata (lessico locale + LLM con early stopping) su un corpus etichettato.
+
+Uso (dalla radice del progetto, con Ollama attivo):
+
+    python benchmarks/bench_doc_classifier.py --corpus corpus_validazione/
+    python benchmarks/bench_doc_classifier.py --corpus corpus_validazione/ --local-only
+
+Con --local-only non serve Ollama: si misurano solo le decisioni del lessico locale
+per chunk, in particolare i chunk di documenti MEDICO decisi NON_MEDICO senza modello
+(errori che la cascata non può più correggere). Conviene includere nel corpus
+specialità e lingue non coperte dal lessico.
+
+La cartella deve contenere labels.csv con colonne filename,label
+(label = MEDICO o NON_MEDICO) e i file indicati (.pdf o .txt).
+Il corpus non è distribuito con l'applicazione perché contiene referti reali.
+"""
+import argparse
+import contextlib
+import csv
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyPDF2 import PdfReader  # noqa: E402
+
+from app.security_components.doc_validation import chunk_text, classify_with_chunks  # noqa: E402
+from app.security_components.medical_lexicon import classify_locally  # noqa: E402
+
+
+def load_corpus(corpus_dir: str):
+    with open(os.path.join(corpus_dir, "labels.csv"), newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            path = os.path.join(corpus_dir, row["filename"])
+            if path.lower().endswith(".pdf"):
+                with open(path, "rb") as pdf:
+                    text = "\n".join(p.extract_text() or "" for p in PdfReader(io.BytesIO(pdf.read())).pages)
+            else:
+                with open(path, encoding="utf-8") as txt:
+                    text = txt.read()
+            yield row["filename"], text, row["label"].strip().upper() == "MEDICO"
+
+
+def run(corpus, cascade: bool) -> dict:
+    stats = {}
+    correct = 0
+    predictions = {}
+    t0 = time.perf_counter()
+    for name, text, expected in corpus:
+        with contextlib.redirect_stdout(io.StringIO()):
+            is_medical, _, _ = classify_with_chunks(text, cascade=cascade, stats=stats)
+        predictions[name] = is_medical
+        correct += is_medical == expected
+    return {
+        "accuracy": correct / max(len(corpus), 1),
+        "llm_calls": stats.get("llm_calls", 0),
+        "local": stats.get("local_decisions", 0),
+        "skipped": stats.get("skipped_chunks", 0),
+        "seconds": time.perf_counter() - t0,
+        "predictions": predictions,
+    }
+
+
+def run_local(corpus, chunk_size: int = 1500) -> None:
+    print(f"\n{'documento':<40}{'atteso':>8}{'chunk':>7}{'medici':>8}{'non medici':>12}{'al modello':>12}")
+    wrong = total = 0
+    for name, text, expected in corpus:
+        labels = [classify_locally(c)[0] for c in chunk_text(text, max_chunk_length=chunk_size)]
+        medici, non_medici = labels.count(True), labels.count(False)
+        total += len(labels)
+        wrong += non_medici if expected else medici
+        print(f"{name[:39]:<40}{'MEDICO' if expected else 'NON_MED':>8}{len(labels):>7}{medici:>8}"
+              f"{non_medici:>12}{labels.count(None):>12}")
+    print(f"\nChunk decisi in locale con l'etichetta sbagliata: {wrong} su {total}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark classificatore documentale a cascata.")
+    parser.add_argument("--corpus", required=True, help="cartella con labels.csv e i documenti")
+    parser.add_argument("--local-only", action="store_true", help="solo lessico locale, senza Ollama")
+    args = parser.parse_args()
+
+    corpus = list(load_corpus(args.corpus))
+    print(f"Corpus: {len(corpus)} documenti ({sum(1 for c in corpus if c[2])} medici)")
+    if args.local_only:
+        run_local(corpus)
+        return
+
+    baseline = run(corpus, cascade=False)
+    cascade = run(corpus, cascade=True)
+
+    print(f"\n{'modalità':<10}{'accuratezza':>13}{'chiamate LLM':>14}{'chunk locali':>14}{'chunk saltati':>15}{'tempo':>10}")
+    for name, r in (("attuale", baseline), ("cascata", cascade)):
+        print(f"{name:<10}{r['accuracy']:>12.1%}{r['llm_calls']:>14}{r['local']:>14}{r['skipped']:>15}{r['seconds']:>9.1f}s")
+
+    disagreements = [n for n in baseline["predictions"] if baseline["predictions"][n] != cascade["predictions"][n]]
+    if baseline["llm_calls"]:
+        print(f"\nChiamate LLM risparmiate: {1 - cascade['llm_calls'] / baseline['llm_calls']:.1%}")
+    if disagreements:
+        print(f"Documenti con esito diverso ({len(disagreements)}): {', '.join(disagreements)}")
+
+
+if __name__ == "__main__":
+    main()
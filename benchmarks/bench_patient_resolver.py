@@ -0,0 +1,139 @@
+"""
+Benchmark dell'individuazione dei pazienti citati nelle domande del medico.
+
+Uso (dalla radice del progetto):
+
+    python benchmarks/bench_patient_resolver.py
+    python benchmarks/bench_patient_resolver.py --patients 10000 --queries 300
+
+Su un elenco sintetico di assistiti (con omonimi) confronta la vecchia scansione
+lineare con difflib e l'indice dei nomi: tempo di costruzione dell'indice, latenza
+per domanda (p50/p95) e correttezza su menzioni esatte, con errori di battitura
+e senza nomi.
+"""
+import argparse
+import difflib
+import os
+import random
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.user_record import UserRecord  # noqa: E402
+from app.services.patient_resolver import PatientNameIndex, get_name_index, resolve_pazienti  # noqa: E402
+
+NOMI = ["Mario", "Luca", "Giulia", "Anna", "Marco", "Francesca", "Paolo", "Sara", "Andrea", "Elena",
+        "Giuseppe", "Chiara", "Matteo", "Laura", "Davide", "Martina", "Niccolò", "Federica", "Simone",
+        "Alessia", "Stefano", "Valentina", "Roberto", "Ilaria", "Antonio", "Silvia", "Gabriele", "Noemi"]
+COGNOMI = ["Rossi", "Bianchi", "Esposito", "Romano", "Colombo", "Ricci", "Marino", "Greco", "Bruno",
+           "Gallo", "Conti", "De Luca", "Costa", "Giordano", "Mancini", "Lombardi", "Moretti", "Barbieri",
+           "Fontana", "Santoro", "Mariani", "Rinaldi", "Caruso", "Ferrara", "Galli", "Martini", "Leone",
+           "Longo", "Gentile", "Martinelli", "Vitale", "Serra", "Coppola", "De Santis", "D'Angelo"]
+DOMANDE = ["Qual è l'esito dell'ultimo esame di {p}?", "Che terapia segue {p}?",
+           "Riassumi il referto di {p}", "Ci sono controlli programmati per {p}?"]
+SENZA_NOME = ["Quali pazienti hanno esami da rivedere?", "Riassumi le visite della settimana",
+              "Ci sono referti con valori fuori norma?"]
+
+
+def legacy_identify(query, pazienti):
+    """Implementazione precedente: sottostringa per ogni paziente, poi difflib su tutta la domanda."""
+    query_lower = query.lower()
+    found = []
+    for p in pazienti:
+        fullname = f"{p.nome.lower()} {p.cognome.lower()}"
+        if fullname in query_lower:
+            found.append(p)
+    if not found:
+        names = [f"{p.nome.lower()} {p.cognome.lower()}" for p in pazienti]
+        match = difflib.get_close_matches(query_lower, names, n=2, cutoff=0.6)
+        for m in match:
+            for p in pazienti:
+                if f"{p.nome.lower()} {p.cognome.lower()}" == m:
+                    found.append(p)
+    return list(set(found))
+
+
+def make_roster(n: int, rng: random.Random):
+    """Assistiti sintetici: cognomi con suffisso per avere nomi quasi tutti distinti, più alcuni omonimi."""
+    roster = []
+    for i in range(n):
+        nome = rng.choice(NOMI)
+        cognome = rng.choice(COGNOMI) + ("" if i % 50 == 0 else f"{chr(97 + i % 26)}{i // 26 % 26:02d}")
+        roster.append(UserRecord(email=f"p{i}@test.local", nome=nome, cognome=cognome, role="Paziente",
+                                 data_nascita=date(1940 + i % 60, 1 + i % 12, 1 + i % 28)))
+    return roster
+
+
+def typo(word: str, rng: random.Random) -> str:
+    if len(word) < 5:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1:]
+
+
+def make_queries(roster, n: int, rng: random.Random):
+    """(domanda, email attese, tipo): menzioni esatte, con un carattere mancante nel cognome, senza nomi."""
+    queries = []
+    for _ in range(n):
+        kind = rng.choice(["esatta", "esatta", "refuso", "senza nome"])
+        if kind == "senza nome":
+            queries.append((rng.choice(SENZA_NOME), set(), kind))
+            continue
+        p = rng.choice(roster)
+        cognome = typo(p.cognome, rng) if kind == "refuso" else p.cognome
+        queries.append((rng.choice(DOMANDE).format(p=f"{p.nome} {cognome}"), {p.email}, kind))
+    return queries
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run(label, fn, queries):
+    times, correct = [], {}
+    for query, expected, kind in queries:
+        t0 = time.perf_counter()
+        found = fn(query)
+        times.append((time.perf_counter() - t0) * 1000)
+        emails = {p.email for p in found}
+        ok = expected <= emails if expected else not emails
+        hit, total = correct.get(kind, (0, 0))
+        correct[kind] = (hit + ok, total + 1)
+    acc = ", ".join(f"{k} {h}/{t}" for k, (h, t) in sorted(correct.items()))
+    print(f"{label:<22}{_pct(times, 0.5):>10.3f}{_pct(times, 0.95):>10.3f}   {acc}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark individuazione pazienti nelle domande.")
+    parser.add_argument("--patients", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    roster = make_roster(args.patients, rng)
+    queries = make_queries(roster, args.queries, rng)
+    homonyms = sum(len(v) > 1 for v in PatientNameIndex(roster).names.values()) // 2
+
+    t0 = time.perf_counter()
+    get_name_index(roster)
+    build_ms = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    get_name_index(roster)
+    cached_ms = (time.perf_counter() - t0) * 1000
+    print(f"{args.patients} assistiti (circa {homonyms} nomi con omonimi), {len(queries)} domande")
+    print(f"Indice: costruzione {build_ms:.1f} ms, riuso dalla cache {cached_ms:.2f} ms (impronta dell'elenco)\n")
+
+    print(f"{'metodo':<22}{'p50 ms':>10}{'p95 ms':>10}   corrette per tipo")
+    index = get_name_index(roster)
+    run("indice (solo ricerca)", lambda q: [p for m in index.resolve(q) for p in m.pazienti], queries)
+    run("indice + cache", lambda q: [p for m in resolve_pazienti(q, roster) for p in m.pazienti], queries)
+    # la vecchia scansione è lenta: basta un campione per la latenza
+    run("scansione + difflib", lambda q: legacy_identify(q, roster), queries[:max(20, len(queries) // 10)])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Scalabilità dell'estrazione del testo per pagine in parallelo.
+
+Uso:
+
+    python benchmarks/bench_pdf_extraction.py --pages 200 --workers 1,2,4,8
+    python benchmarks/bench_pdf_extraction.py --pdf lettera_dimissione.pdf --workers 1,2,4
+
+Senza --pdf genera un documento sintetico di --pages pagine fitte di testo.
+Per ogni numero di worker misura il tempo totale, il tempo alla prima pagina
+(quando le fasi a valle possono iniziare) e lo speedup rispetto a un worker.
+La prima esecuzione con un nuovo pool include l'avvio dei processi: viene
+fatto un giro di riscaldamento prima della misura.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("POSTGRES_URL", "sqlite://")
+os.environ.setdefault("OLLAMA_BASE_URL", "http://127.0.0.1:11434")
+
+from app.services import pdf_extraction  # noqa: E402
+
+LINE = "Paziente in follow-up per ipertensione arteriosa, pressione 130/85 mmHg, glicemia 102 mg/dl."
+
+
+def make_pdf(pages: int, lines_per_page: int = 60) -> bytes:
+    """PDF sintetico con pagine di testo (Helvetica, una riga per Tj)."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for p in range(pages):
+        ops = ["BT", "/F1 8 Tf", "10 TL", "30 810 Td"]
+        ops += [f"(Pagina {p + 1} riga {i + 1}: {LINE}) Tj T*" for i in range(lines_per_page)]
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), pages)
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % i + obj + b"\nendobj\n")
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for off in offsets:
+        out.write(b"%010d 00000 n \n" % off)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def run(pdf_bytes: bytes, workers: int) -> dict:
+    stats = {}
+    t0 = time.perf_counter()
+    first = None
+    chars = 0
+    for text in pdf_extraction.iter_pages(pdf_bytes, workers=workers, stats=stats):
+        if first is None:
+            first = time.perf_counter() - t0
+        chars += len(text)
+    return {"total": time.perf_counter() - t0, "first": first or 0.0, "chars": chars, "stats": stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark estrazione PDF per pagine in parallelo")
+    parser.add_argument("--pdf", default=None, help="PDF da usare al posto di quello sintetico")
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--workers", default="1,2,4,8")
+    args = parser.parse_args()
+
+    if args.pdf:
+        with open(args.pdf, "rb") as f:
+            pdf_bytes = f.read()
+    else:
+        pdf_bytes = make_pdf(args.pages)
+    print(f"PDF di {len(pdf_bytes) / 1e6:.1f} MB, {os.cpu_count()} core disponibili")
+
+    baseline = None
+    print(f"{'worker':>7}{'totale':>10}{'1a pagina':>12}{'speedup':>9}{'pagine saltate':>16}")
+    for workers in [int(w) for w in args.workers.split(",")]:
+        run(pdf_bytes, workers)  # riscaldamento del pool
+        r = run(pdf_bytes, workers)
+        baseline = baseline or r["total"]
+        print(f"{workers:>7}{r['total']:>9.2f}s{r['first'] * 1000:>10.0f}ms{baseline / r['total']:>8.2f}x"
+              f"{r['stats'].get('skipped_pages', 0):>16}")
+
+
+if __name__ == "__main__":
+    main()
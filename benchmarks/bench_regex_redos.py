@@ -0,0 +1,160 @@
+"""
+Fuzzing delle regex dei filtri di sicurezza: latenza nel caso peggiore su input ostili.
+
+Uso (dalla radice del progetto):
+
+    python benchmarks/bench_regex_redos.py
+    python benchmarks/bench_regex_redos.py --fuzz 500 --length 2000 --doc-mb 4
+
+Per ogni pattern dei riconoscitori PII e del sanificatore confronta la versione
+precedente con quella attuale su input costruiti per il backtracking (prompt da
+--length caratteri) e su --fuzz stringhe casuali fatte coi caratteri "pericolosi"
+del pattern; riporta il tempo massimo per ricerca. Le versioni precedenti girano
+col modulo regex e un timeout di --legacy-timeout secondi, altrimenti il benchmark
+non terminerebbe. Infine misura le euristiche di doc_validation su testo da
+--doc-mb MB (referto normale e testo ostile) e sui pattern PII attuali alla stessa scala.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import regex
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("POSTGRES_URL", "sqlite://")
+os.environ.setdefault("OLLAMA_BASE_URL", "http://127.0.0.1:11434")
+
+from app.security_components import pii_patterns  # noqa: E402
+from app.security_components.doc_validation import heuristic_checks  # noqa: E402
+from app.security_components.prompt_sanitizer import PATTERNS as SANITIZER_PATTERNS  # noqa: E402
+
+# Flag globali con cui Presidio applica i pattern dei riconoscitori
+PRESIDIO_FLAGS = regex.DOTALL | regex.MULTILINE | regex.IGNORECASE
+SANITIZER_FLAGS = regex.IGNORECASE | regex.DOTALL
+
+# Versioni precedenti: nome -> (regex precedente, flag, regex attuale)
+LEGACY = {
+    "cc": (r"\b(?:\d[ -]*?){13,16}\b", PRESIDIO_FLAGS, pii_patterns.CC_REGEX),
+    "iban": (r"\b[A-Z]{2}\d{2}(?:[A-Z0-9\[\]\(\)\s\-/]{4,}){3,}\b", PRESIDIO_FLAGS, pii_patterns.IBAN_REGEX),
+    "email": (r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b", PRESIDIO_FLAGS, pii_patterns.EMAIL_REGEX),
+    "indirizzo": (r"\b(?:Via|Viale|Piazza|Corso|Largo|Strada|Contrada)\s+[A-Z][a-zàèéìòù’'\- ]+\s*(?:\d{1,3})?\b",
+                  PRESIDIO_FLAGS, pii_patterns.HOME_ADDRESS_REGEX),
+    "password": (r"(?i)\b(?:password|pwd|pass|pw|passphrase)\b[:=\s]*([^\s,;.:()]{6,})",
+                 PRESIDIO_FLAGS, pii_patterns.PASSWORD_REGEX),
+    "password_entropia": (r'(?<!\w)(?=.{6,})(?=.*[A-Za-z])(?=.*\d)(?=.*[^A-Za-z0-9])[A-Za-z\d[^A-Za-z0-9]]{6,}\b',
+                          PRESIDIO_FLAGS, pii_patterns.PASSWORD_ENTROPY_REGEX),
+    "script": (r"<\s*script.*?>.*?<\s*/\s*script\s*>", SANITIZER_FLAGS, SANITIZER_PATTERNS["script_html"][0]),
+    "on_evento": (r"on\w+\s*=", SANITIZER_FLAGS, SANITIZER_PATTERNS["script_html"][1]),
+    "iframe": (r"<\s*iframe.*?>", SANITIZER_FLAGS, SANITIZER_PATTERNS["script_html"][2]),
+    "img": (r"<\s*img.*?on\w+\s*=", SANITIZER_FLAGS, SANITIZER_PATTERNS["script_html"][3]),
+}
+
+
+def _fill(unit: str, length: int, tail: str = "") -> str:
+    return (unit * (length // len(unit) + 1))[:length - len(tail)] + tail
+
+
+# Input costruiti per il backtracking di ciascun pattern (lunghezza fissa)
+def adversarial(name: str, length: int):
+    return {
+        "cc": [_fill("1 -", length, "x"), "1" + _fill(" ", length - 2, "x")],
+        "iban": ["IT00" + _fill("A", length - 5, "à"), "IT00" + _fill("AB1 ", length - 5, "a")],
+        "email": [_fill("a.", length), "a@" + _fill("a.", length - 2), _fill("a@", length)],
+        "indirizzo": ["Via A" + _fill("a ", length - 6, "à"), _fill("Via Aa ", length)],
+        "password": ["password" + _fill("=", length - 9, " "), _fill("pw=", length)],
+        "password_entropia": [_fill("a1!", length, "é"), _fill("a", length - 1, "1")],
+        "script": [_fill("<script>", length), "<script>" + _fill("a>", length - 8)],
+        "on_evento": [_fill("on", length), "on" + _fill("a", length - 3, " ")],
+        "iframe": [_fill("<iframe", length)],
+        "img": [_fill("<img ", length), "<img" + _fill(" on", length - 4)],
+    }[name]
+
+
+# Caratteri usati per le stringhe casuali di ciascun pattern
+FUZZ_ALPHABET = {
+    "cc": "0123456789 -x",
+    "iban": "ITAB019 []()-/a",
+    "email": "a.@-_%+1 ",
+    "indirizzo": "Via Aa'- 12",
+    "password": "password=: x1",
+    "password_entropia": "aA1!. \n",
+    "script": "<script>/ a",
+    "on_evento": "on=a _",
+    "iframe": "<iframe> a",
+    "img": "<img on=> a",
+}
+
+
+def timed(pattern, text: str, timeout: float) -> float:
+    """Millisecondi per trovare tutte le occorrenze; inf se supera il timeout."""
+    t0 = time.perf_counter()
+    try:
+        list(pattern.finditer(text, timeout=timeout))
+    except TimeoutError:
+        return float("inf")
+    return (time.perf_counter() - t0) * 1000
+
+
+def _fmt(ms: float, timeout: float) -> str:
+    return f">{timeout * 1000:.0f} (timeout)" if ms == float("inf") else f"{ms:.2f}"
+
+
+def bench_patterns(length: int, fuzz: int, legacy_timeout: float, rng: random.Random) -> None:
+    print(f"Caso peggiore per ricerca, input da {length} caratteri (ms)\n")
+    print(f"{'pattern':<20}{'costruito prima':>18}{'dopo':>10}{'casuale prima':>18}{'dopo':>10}")
+    for name, (old, flags, new) in LEGACY.items():
+        old_re, new_re = regex.compile(old, flags), regex.compile(new, flags)
+        crafted = adversarial(name, length)
+        alphabet = FUZZ_ALPHABET[name]
+        randoms = ["".join(rng.choice(alphabet) for _ in range(length)) for _ in range(fuzz)]
+        old_crafted = max(timed(old_re, s, legacy_timeout) for s in crafted)
+        new_crafted = max(timed(new_re, s, legacy_timeout) for s in crafted)
+        old_random = max(timed(old_re, s, legacy_timeout) for s in randoms)
+        new_random = max(timed(new_re, s, legacy_timeout) for s in randoms)
+        print(f"{name:<20}{_fmt(old_crafted, legacy_timeout):>18}{_fmt(new_crafted, legacy_timeout):>10}"
+              f"{_fmt(old_random, legacy_timeout):>18}{_fmt(new_random, legacy_timeout):>10}")
+
+
+REPORT_LINE = "Esame emocromocitometrico del 12/03/2024: emoglobina 13,5 g/dl, valori nella norma.\n"
+
+
+def bench_documents(mb: float, legacy_timeout: float) -> None:
+    size = int(mb * 1_000_000)
+    docs = {
+        "referto": _fill(REPORT_LINE, size),
+        "base64 e simboli": _fill("QUJDREVGR0hJSktMTU5PUFFSU1RVVldYWVo0NTY3ODkwYWJjZGVm" * 4 + "\n"
+                                  + "var x = f(a); if (b) { c = d; } // import def\n", size),
+        "pii ostile": _fill("IT00 AB1 a.a.a@ 1 - 1 - Via Aa password== ", size),
+    }
+    print(f"\nEuristiche di doc_validation su {mb:g} MB di testo (ms)\n")
+    for label, text in docs.items():
+        t0 = time.perf_counter()
+        errors, score = heuristic_checks(text, b"", [text])
+        ms = (time.perf_counter() - t0) * 1000
+        print(f"{label:<20}{ms:>10.0f}   punteggio {score:.1f}, esiti: {len(errors)}")
+
+    print(f"\nPattern PII attuali su {mb:g} MB di testo ostile (ms; i precedenti non terminano a questa scala)\n")
+    text = docs["pii ostile"]
+    for name, (_, flags, new) in LEGACY.items():
+        if flags == PRESIDIO_FLAGS:
+            ms = timed(regex.compile(new, flags), text, max(legacy_timeout, 60))
+            print(f"{name:<20}{ms:>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuzzing ReDoS delle regex dei filtri di sicurezza.")
+    parser.add_argument("--length", type=int, default=2000, help="lunghezza dei prompt ostili")
+    parser.add_argument("--fuzz", type=int, default=200, help="stringhe casuali per pattern")
+    parser.add_argument("--doc-mb", type=float, default=2.0, help="dimensione del testo dei documenti (MB)")
+    parser.add_argument("--legacy-timeout", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    bench_patterns(args.length, args.fuzz, args.legacy_timeout, random.Random(args.seed))
+    bench_documents(args.doc_mb, args.legacy_timeout)
+
+
+if __name__ == "__main__":
+    main()
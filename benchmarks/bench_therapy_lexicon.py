@@ -0,0 +1,94 @@
+"""
+Benchmark del filtro lessicale davanti a is_therapy_related.
+
+Uso (dalla radice del progetto):
+
+    python benchmarks/bench_therapy_lexicon.py                 # solo lessico
+    python benchmarks/bench_therapy_lexicon.py --with-llm      # confronto con medllama2 (Ollama attivo)
+    python benchmarks/bench_therapy_lexicon.py --repeat 2000
+
+Su un insieme di frasi etichettate misura la latenza del matcher, la quota di
+testi decisi senza LLM, l'accuratezza sui casi decisi e, con --with-llm, la
+latenza e l'accuratezza del solo modello sugli stessi testi.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.security_components.therapy_lexicon import match_therapy  # noqa: E402
+
+SAMPLES = [
+    ("Terapia domiciliare: ramipril 5 mg 1 cpr al mattino, cardioaspirina 100 mg a pranzo.", True),
+    ("Si prescrive amoxicillina 1 g ogni 12 ore per 6 giorni.", True),
+    ("Tachipirina 1000 mg al bisogno, massimo 3 compresse al giorno.", True),
+    ("Proseguire metformina 850 mg dopo i pasti e controllare la glicemia.", True),
+    ("Iniziata terapia con enoxaparina 4000 UI sottocute una volta al giorno.", True),
+    ("Si consiglia di sospendere il warfarin 5 giorni prima dell'intervento.", True),
+    ("Salbutamolo spray 2 puff al bisogno.", True),
+    ("Posologia: 20 gocce la sera prima di coricarsi.", True),
+    ("In terapia con levotiroxina 50 mcg a digiuno.", True),
+    ("Quale dosaggio di furosemide assume la paziente?", True),
+    ("Ecografia addominale: fegato di dimensioni nei limiti, ecostruttura omogenea.", False),
+    ("Emocromo nella norma. Glicemia 98 mg/dl, creatinina 0.9 mg/dl.", False),
+    ("RX torace: non lesioni pleuroparenchimali in atto.", False),
+    ("Paziente vigile, orientato, collaborante. Parametri vitali stabili.", False),
+    ("Prossimo controllo cardiologico tra sei mesi con ECG.", False),
+    ("Quando è stata fatta l'ultima ecografia di Mario Rossi?", False),
+    ("Referto di visita oculistica: visus 10/10 in entrambi gli occhi.", False),
+    ("La paziente riferisce dolore lombare da circa due settimane.", False),
+    ("Nessuna terapia in atto al momento della visita.", False),
+    ("Il paziente segue un trattamento riabilitativo per il ginocchio.", True),
+    ("Quali farmaci prende attualmente la signora Bianchi?", True),
+    ("Esiti di frattura consolidata del radio distale.", False),
+]
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark matcher lessicale terapie.")
+    parser.add_argument("--repeat", type=int, default=500, help="ripetizioni per misurare la latenza")
+    parser.add_argument("--with-llm", action="store_true", help="confronta con medllama2")
+    args = parser.parse_args()
+
+    timings = []
+    for _ in range(args.repeat):
+        for text, _ in SAMPLES:
+            t0 = time.perf_counter()
+            match_therapy(text)
+            timings.append((time.perf_counter() - t0) * 1e6)
+
+    decided = correct = 0
+    for text, expected in SAMPLES:
+        decision, _, reason = match_therapy(text)
+        if decision is not None:
+            decided += 1
+            correct += decision == expected
+        print(f"  {'LLM ' if decision is None else ('TER ' if decision else 'NON ')}| {reason:<40} | {text[:60]}")
+
+    print(f"\nLessico: p50 {_pct(timings, .5):.1f} µs, p99 {_pct(timings, .99):.1f} µs per testo")
+    print(f"Decisi senza LLM: {decided}/{len(SAMPLES)} ({decided / len(SAMPLES):.0%}), "
+          f"accuratezza sui decisi {correct / max(decided, 1):.0%}")
+
+    if args.with_llm:
+        from app.security_components.check_therapy import classify_therapy_with_llm, is_therapy_related
+
+        for name, fn in (("solo LLM", classify_therapy_with_llm), ("lessico + LLM", is_therapy_related)):
+            latencies, ok = [], 0
+            for text, expected in SAMPLES:
+                t0 = time.perf_counter()
+                ok += fn(text) == expected
+                latencies.append(time.perf_counter() - t0)
+            print(f"{name:<14} accuratezza {ok / len(SAMPLES):.0%}, "
+                  f"latenza media {statistics.mean(latencies) * 1000:.0f} ms, p95 {_pct(latencies, .95) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
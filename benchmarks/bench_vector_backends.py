@@ -0,0 +1,146 @@
+"""
+Confronto tra Chroma e lo store compatto (float16 / int8 in memory map, ricerca
+esatta NumPy) per pazienti con pochi chunk, come avviene nel layout per paziente.
+
+Uso:
+
+    python benchmarks/bench_vector_backends.py --patients 200 --sizes 10,50,200,1000
+
+Per ogni dimensione del corpus del paziente misura: apertura a freddo + query,
+query a caldo (p50/p95), occupazione su disco, memoria residente aggiunta
+dall'apertura di tutti gli store e recall@k rispetto alla ricerca esatta in float32.
+Serve a scegliere COMPACT_MAX_CHUNKS.
+"""
+import argparse
+import gc
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import chromadb
+import numpy as np
+from chromadb.api.client import SharedSystemClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services import compact_store  # noqa: E402
+from app.services.compact_store import CompactStore  # noqa: E402
+
+DIM = 1024
+
+
+def _vectors(rng: np.random.Generator, n: int) -> np.ndarray:
+    v = rng.standard_normal((n, DIM)).astype(np.float32)
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def _disk_usage(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for f in filenames:
+            total += os.path.getsize(os.path.join(dirpath, f))
+    return total
+
+
+def _rss() -> int:
+    """Memoria residente del processo in byte (Linux), 0 se non disponibile."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def _pct(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] * 1000
+
+
+def build(root: str, backend: str, corpora: dict):
+    for email, vecs in corpora.items():
+        ids = [str(j) for j in range(len(vecs))]
+        docs = [f"chunk {j} di {email}" for j in ids]
+        metas = [{"paziente_email": email, "chunk": j} for j in range(len(vecs))]
+        if backend == "chroma":
+            client = chromadb.PersistentClient(path=os.path.join(root, email))
+            client.get_or_create_collection("docs").add(ids=ids, embeddings=vecs.tolist(), documents=docs,
+                                                        metadatas=metas)
+        else:
+            CompactStore(email, root, backend).upsert(ids, vecs, docs, metas)
+    SharedSystemClient.clear_system_cache()
+    compact_store._cache.clear()
+
+
+def measure(root: str, backend: str, corpora: dict, queries: list, k: int) -> dict:
+    emails = list(corpora)
+    exact_hits = total = 0
+    cold, warm = [], []
+
+    gc.collect()
+    rss0 = _rss()
+    handles = {}
+    for n, (email, q) in enumerate(queries):
+        t0 = time.perf_counter()
+        if backend == "chroma":
+            if email not in handles:
+                handles[email] = chromadb.PersistentClient(path=os.path.join(root, email)).get_collection("docs")
+            res = handles[email].query(query_embeddings=[q.tolist()], n_results=k)
+            found = [m["chunk"] for m in res["metadatas"][0]]
+        else:
+            store = handles.setdefault(email, CompactStore(email, root, backend))
+            found = [meta["chunk"] for _, meta, _ in store.query(q, k)]
+        elapsed = time.perf_counter() - t0
+        (cold if n < len(emails) else warm).append(elapsed)
+
+        expected = set(np.argsort(-(corpora[email] @ q))[:k].tolist())
+        exact_hits += len(expected & set(found))
+        total += k
+    gc.collect()
+    return {
+        "cold": cold,
+        "warm": warm,
+        "disk": _disk_usage(root),
+        "rss": max(0, _rss() - rss0),
+        "recall": exact_hits / max(total, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Chroma vs store compatto per paziente.")
+    parser.add_argument("--patients", type=int, default=100)
+    parser.add_argument("--sizes", default="10,50,200,1000", help="chunk per paziente, separati da virgola")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'chunk':>6} {'backend':<9}{'cold p50':>10}{'warm p50':>10}{'warm p95':>10}"
+          f"{'disco':>10}{'RSS':>10}{'recall@k':>10}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        rng = np.random.default_rng(args.seed)
+        corpora = {f"paziente{i}@example.com": _vectors(rng, size) for i in range(args.patients)}
+        emails = list(corpora)
+        picker = random.Random(args.seed)
+        # prima una query per paziente (a freddo), poi query casuali (a caldo)
+        queries = [(e, _vectors(rng, 1)[0]) for e in emails]
+        queries += [(picker.choice(emails), _vectors(rng, 1)[0]) for _ in range(args.queries)]
+
+        for backend in ("chroma", "float16", "int8"):
+            root = tempfile.mkdtemp(prefix="bench_vb_")
+            try:
+                build(root, backend, corpora)
+                r = measure(root, backend, corpora, queries, args.k)
+                print(f"{size:>6} {backend:<9}{_pct(r['cold'], .5):>8.2f}ms{_pct(r['warm'], .5):>8.2f}ms"
+                      f"{_pct(r['warm'], .95):>8.2f}ms{r['disk'] / 1e6:>8.1f}MB{r['rss'] / 1e6:>8.1f}MB"
+                      f"{r['recall']:>10.3f}")
+            finally:
+                SharedSystemClient.clear_system_cache()
+                compact_store._cache.clear()
+                shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Confronto tra layout per paziente (una cartella Chroma per paziente) e
+collection condivisa filtrata per paziente_email.
+
+Uso:
+
+    python benchmarks/bench_vectorstore_layout.py --patients 500 --chunks 20
+    python benchmarks/bench_vectorstore_layout.py --patients 2000 --hnsw-m 16 --search-ef 32
+
+Genera vettori sintetici normalizzati (dimensione di multilingual-e5-large),
+costruisce entrambi i layout in una cartella temporanea e misura:
+tempo di apertura a freddo, latenza di query (p50/p95) e occupazione su disco.
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+import chromadb
+import numpy as np
+from chromadb.api.client import SharedSystemClient
+
+DIM = 1024
+
+
+def _vectors(rng: np.random.Generator, n: int) -> np.ndarray:
+    v = rng.standard_normal((n, DIM)).astype(np.float32)
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def _disk_usage(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for f in filenames:
+            total += os.path.getsize(os.path.join(dirpath, f))
+    return total
+
+
+def _cold():
+    """Svuota la cache dei client Chroma per simulare un'apertura a freddo."""
+    SharedSystemClient.clear_system_cache()
+
+
+def build(root: str, patients: int, chunks: int, hnsw: dict, seed: int) -> list:
+    rng = np.random.default_rng(seed)
+    emails = [f"paziente{i}@example.com" for i in range(patients)]
+
+    shared_client = chromadb.PersistentClient(path=os.path.join(root, "shared"))
+    shared = shared_client.get_or_create_collection("docs_all", metadata=hnsw)
+
+    for email in emails:
+        vecs = _vectors(rng, chunks)
+        docs = [f"chunk {j} di {email}" for j in range(chunks)]
+        ids = [f"{j}" for j in range(chunks)]
+
+        client = chromadb.PersistentClient(path=os.path.join(root, "per_patient", email))
+        client.get_or_create_collection("docs").add(ids=ids, embeddings=vecs.tolist(), documents=docs)
+
+        shared.add(
+            ids=[f"{email}:{i}" for i in ids],
+            embeddings=vecs.tolist(),
+            documents=docs,
+            metadatas=[{"paziente_email": email}] * chunks
+        )
+    _cold()
+    return emails
+
+
+def measure(root: str, emails: list, queries: int, k: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed + 1)
+    sample = random.Random(seed).choices(emails, k=queries)
+    qvecs = _vectors(rng, queries).tolist()
+    results = {}
+
+    # --- per paziente: ogni domanda apre la cartella del paziente ---
+    open_t, query_t = [], []
+    for email, q in zip(sample, qvecs):
+        _cold()
+        t0 = time.perf_counter()
+        coll = chromadb.PersistentClient(path=os.path.join(root, "per_patient", email)).get_collection("docs")
+        t1 = time.perf_counter()
+        coll.query(query_embeddings=[q], n_results=k)
+        t2 = time.perf_counter()
+        open_t.append(t1 - t0)
+        query_t.append(t2 - t1)
+    results["per_patient"] = (open_t, query_t, _disk_usage(os.path.join(root, "per_patient")))
+
+    # --- condiviso: una sola apertura, poi query filtrate ---
+    _cold()
+    t0 = time.perf_counter()
+    shared = chromadb.PersistentClient(path=os.path.join(root, "shared")).get_collection("docs_all")
+    open_t = [time.perf_counter() - t0]
+    query_t = []
+    for email, q in zip(sample, qvecs):
+        t1 = time.perf_counter()
+        shared.query(query_embeddings=[q], n_results=k, where={"paziente_email": email})
+        query_t.append(time.perf_counter() - t1)
+    results["shared"] = (open_t, query_t, _disk_usage(os.path.join(root, "shared")))
+    return results
+
+
+def _pct(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark layout vectorstore per paziente vs condiviso.")
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--chunks", type=int, default=20, help="chunk per paziente")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--construction-ef", type=int, default=200)
+    parser.add_argument("--search-ef", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="non cancellare la cartella temporanea")
+    args = parser.parse_args()
+
+    hnsw = {
+        "hnsw:space": "cosine",
+        "hnsw:M": args.hnsw_m,
+        "hnsw:construction_ef": args.construction_ef,
+        "hnsw:search_ef": args.search_ef,
+    }
+    root = tempfile.mkdtemp(prefix="bench_vs_")
+    try:
+        print(f"Costruzione: {args.patients} pazienti x {args.chunks} chunk in {root}")
+        emails = build(root, args.patients, args.chunks, hnsw, args.seed)
+        results = measure(root, emails, args.queries, args.k, args.seed)
+
+        print(f"\n{'layout':<12}{'open p50':>11}{'open p95':>11}{'query p50':>11}{'query p95':>11}{'disco':>12}")
+        for layout, (open_t, query_t, disk) in results.items():
+            print(f"{layout:<12}{_pct(open_t, .5):>9.2f}ms{_pct(open_t, .95):>9.2f}ms"
+                  f"{_pct(query_t, .5):>9.2f}ms{_pct(query_t, .95):>9.2f}ms{disk / 1e6:>10.1f}MB")
+        print(f"\nlatenza media per domanda (apertura + query): "
+              f"per_patient {statistics.mean(results['per_patient'][0]) * 1000 + statistics.mean(results['per_patient'][1]) * 1000:.2f}ms, "
+              f"shared {statistics.mean(results['shared'][1]) * 1000:.2f}ms")
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Server HTTP che imita l'API di Ollama (/api/chat, /api/generate, /api/tags, /api/show)
+con latenze realistiche, per i test di carico senza GPU.
+
+La latenza di ogni risposta è: attesa in coda + prefill (token del prompt) + decodifica
+(token generati), con rumore log-normale. Ogni modello ha un numero limitato di slot
+paralleli come OLLAMA_NUM_PARALLEL: oltre quel limite le richieste si accodano.
+Come Ollama, ogni slot tiene in cache l'ultima conversazione: una richiesta /api/chat
+che ne prosegue una (stessi messaggi iniziali) paga il prefill solo dei messaggi nuovi.
+
+Uso autonomo:
+
+    python benchmarks/loadtest/fake_ollama.py --port 11435 --time-scale 0.2
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Profili di latenza indicativi su GPU consumer (ms per token, ms fissi, token generati)
+MODEL_PROFILES = {
+    "mistral": {"prefill_ms": 0.35, "decode_ms": 22.0, "base_ms": 60.0, "out_tokens": 180, "parallel": 2},
+    "llama-guard3:1b": {"prefill_ms": 0.08, "decode_ms": 6.0, "base_ms": 25.0, "out_tokens": 2, "parallel": 4},
+    "medllama2": {"prefill_ms": 0.3, "decode_ms": 20.0, "base_ms": 50.0, "out_tokens": 4, "parallel": 2},
+}
+DEFAULT_PROFILE = {"prefill_ms": 0.3, "decode_ms": 20.0, "base_ms": 50.0, "out_tokens": 100, "parallel": 2}
+JITTER_SIGMA = 0.25
+
+THERAPY_RE = re.compile(r"\b(mg|compress\w*|posologia|somministr\w*|terapia|farmac\w*)\b", re.IGNORECASE)
+
+CANNED_ANSWER = (
+    "Dai documenti disponibili risulta un controllo ambulatoriale con parametri nella norma. "
+    "Il referto indica pressione arteriosa stabile e si consiglia follow-up come da indicazione "
+    "del medico curante. Da referto del 12/03/2024."
+)
+
+
+def count_tokens(text: str) -> int:
+    # stima grossolana: ~4 caratteri per token
+    return max(1, len(text) // 4)
+
+
+class FakeOllama:
+    def __init__(self, time_scale: float = 1.0, seed: int = 0):
+        self.time_scale = time_scale
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._slots = {}
+        self._slots_lock = threading.Lock()
+        # modello -> conversazioni in cache (una per slot), come tuple di digest dei messaggi
+        self._prefixes = {}
+        self.requests = 0
+
+    def _slot(self, model: str) -> threading.Semaphore:
+        with self._slots_lock:
+            if model not in self._slots:
+                parallel = MODEL_PROFILES.get(model, DEFAULT_PROFILE)["parallel"]
+                self._slots[model] = threading.Semaphore(parallel)
+            return self._slots[model]
+
+    def cached_prefix(self, model: str, messages: list) -> int:
+        """Token dei messaggi iniziali già in cache in uno slot; aggiorna la cache con questa conversazione."""
+        digests = tuple(hashlib.sha1(f"{m.get('role')}:{m.get('content')}".encode()).hexdigest() for m in messages)
+        with self._slots_lock:
+            parallel = MODEL_PROFILES.get(model.split(":latest")[0], DEFAULT_PROFILE)["parallel"]
+            entries = self._prefixes.setdefault(model, deque(maxlen=parallel))
+            best, best_len = None, 0
+            for entry in entries:
+                n = 0
+                while n < min(len(entry), len(digests) - 1) and entry[n] == digests[n]:
+                    n += 1
+                if n > best_len:
+                    best, best_len = entry, n
+            if best is not None:
+                entries.remove(best)
+            entries.append(digests)
+        return sum(count_tokens(m.get("content", "")) for m in messages[:best_len]) if best_len else 0
+
+    def remember_reply(self, model: str, messages: list, content: str) -> None:
+        """La risposta generata resta nella cache dello slot, come il KV cache di Ollama."""
+        self.cached_prefix(model, messages + [{"role": "assistant", "content": content}])
+
+    def _jitter(self) -> float:
+        with self._rng_lock:
+            return self._rng.lognormvariate(0.0, JITTER_SIGMA)
+
+    def reply_for(self, model: str, prompt: str) -> str:
+        if model.startswith("llama-guard"):
+            # solo il testo analizzato: le istruzioni del classificatore contengono già "ignorare"
+            text = prompt.rsplit("Testo da analizzare:", 1)[-1].lower()
+            return "unsafe" if "ignora" in text and "istruzioni" in text else "safe"
+        if model.startswith("medllama2"):
+            text = prompt.rsplit("Ora classifica il seguente testo:", 1)[-1]
+            return "TERAPIA" if len(THERAPY_RE.findall(text)) >= 2 else "NON_TERAPIA"
+        if "classificatore di documenti clinici" in prompt:
+            return json.dumps({"label": "MEDICO", "confidence": 0.9, "reason": "referto clinico"})
+        return CANNED_ANSWER
+
+    def generate(self, model: str, prompt: str, cached_tokens: int = 0) -> dict:
+        profile = MODEL_PROFILES.get(model.split(":latest")[0], DEFAULT_PROFILE)
+        content = self.reply_for(model, prompt)
+        prompt_tokens = max(1, count_tokens(prompt) - cached_tokens)
+        out_tokens = max(count_tokens(content), profile["out_tokens"] if content == CANNED_ANSWER else 1)
+
+        t_queue = time.perf_counter()
+        with self._slot(model):
+            queued = time.perf_counter() - t_queue
+            prefill = (profile["base_ms"] + prompt_tokens * profile["prefill_ms"]) * self._jitter()
+            decode = out_tokens * profile["decode_ms"] * self._jitter()
+            time.sleep((prefill + decode) / 1000 * self.time_scale)
+        self.requests += 1
+
+        return {
+            "model": model,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "content": content,
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((queued * 1000 + prefill + decode) * 1e6),
+            "load_duration": 0,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prefill * 1e6),
+            "eval_count": out_tokens,
+            "eval_duration": int(decode * 1e6),
+        }
+
+
+def _pieces(content: str):
+    """Spezza la risposta in frammenti parola per parola, come lo streaming di Ollama."""
+    words = content.split(" ")
+    return [w if i == 0 else " " + w for i, w in enumerate(words)]
+
+
+def make_handler(fake: FakeOllama):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, payload, status=200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_stream(self, chunks):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for chunk in chunks:
+                line = (json.dumps(chunk) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                models = [{"name": f"{m}:latest" if ":" not in m else m,
+                           "model": f"{m}:latest" if ":" not in m else m,
+                           "digest": hashlib.sha256(m.encode()).hexdigest()} for m in MODEL_PROFILES]
+                return self._send({"models": models})
+            self._send({"error": "not found"}, 404)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            req = json.loads(self.rfile.read(length) or b"{}")
+            model = req.get("model", "")
+
+            if self.path == "/api/show":
+                return self._send({"modelfile": "", "parameters": "", "template": "", "details": {}})
+            cached = 0
+            if self.path == "/api/chat":
+                messages = req.get("messages", [])
+                prompt = "\n".join(m.get("content", "") for m in messages)
+                cached = fake.cached_prefix(model, messages)
+            elif self.path == "/api/generate":
+                prompt = req.get("prompt", "")
+            else:
+                return self._send({"error": "not found"}, 404)
+
+            result = fake.generate(model, prompt, cached)
+            content = result.pop("content")
+            if self.path == "/api/chat":
+                fake.remember_reply(model, messages, content)
+                message = {"role": "assistant", "content": content}
+                final = dict(result, message=message)
+                partial = {"model": model, "created_at": result["created_at"], "done": False}
+                chunks = [dict(partial, message={"role": "assistant", "content": w}) for w in _pieces(content)]
+                final_chunk = dict(result, message={"role": "assistant", "content": ""})
+            else:
+                final = dict(result, response=content)
+                partial = {"model": model, "created_at": result["created_at"], "done": False}
+                chunks = [dict(partial, response=w) for w in _pieces(content)]
+                final_chunk = dict(result, response="")
+
+            if req.get("stream", True):
+                self._send_stream(chunks + [final_chunk])
+            else:
+                self._send(final)
+
+    return Handler
+
+
+def start_server(port: int = 0, time_scale: float = 1.0, seed: int = 0):
+    """Avvia il server in un thread; ritorna (server, url, fake)."""
+    fake = FakeOllama(time_scale=time_scale, seed=seed)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", fake
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server Ollama finto con latenze realistiche")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="moltiplicatore delle latenze (0.1 = dieci volte più veloce)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server, url, _ = start_server(args.port, args.time_scale, args.seed)
+    print(f"Fake Ollama in ascolto su {url} (time scale {args.time_scale})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
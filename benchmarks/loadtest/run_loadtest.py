@@ -0,0 +1,378 @@
+"""
+Test di carico con sessioni concorrenti: medici e pazienti che chattano e caricano referti.
+
+Tutto gira in locale: Ollama è sostituito da fake_ollama (latenze realistiche e slot
+paralleli limitati), il database è SQLite (o un Postgres locale con --db-url), i vector
+store Chroma sono sintetici e gli embedding deterministici (EMBEDDING_MODEL=fake:<dim>),
+così il test misura la pipeline applicativa e le code, non la GPU.
+
+Per ogni livello di concorrenza riporta throughput, p50/p95/p99 per fase e per flusso
+e il punto di saturazione (il livello oltre il quale il throughput smette di crescere).
+
+    python benchmarks/loadtest/run_loadtest.py --levels 1,2,4,8,16 --duration 30 --time-scale 0.2
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_ollama import start_server  # noqa: E402
+
+NOMI = ["Mario", "Luca", "Giulia", "Anna", "Marco", "Francesca", "Paolo", "Sara", "Andrea", "Elena",
+        "Giuseppe", "Chiara", "Matteo", "Laura", "Davide", "Martina"]
+COGNOMI = ["Rossi", "Bianchi", "Esposito", "Romano", "Colombo", "Ricci", "Marino", "Greco", "Bruno",
+           "Gallo", "Conti", "De Luca", "Costa", "Giordano", "Mancini", "Lombardi"]
+ESAMI = ["emocromo", "glicemia", "creatinina", "colesterolo", "ecografia addominale", "ECG", "spirometria"]
+DIAGNOSI = ["ipertensione arteriosa", "diabete mellito tipo 2", "dislipidemia", "BPCO lieve",
+            "cardiopatia ischemica", "insufficienza renale cronica"]
+TERAPIE = ["ramipril 5 mg una compressa al giorno", "metformina 500 mg due volte al dì dopo i pasti",
+           "atorvastatina 20 mg una compressa la sera", "nessuna terapia in atto"]
+DOMANDE_PAZIENTE = ["Qual è l'esito del mio ultimo esame?", "Che terapia devo seguire?",
+                    "Quando è previsto il prossimo controllo?"]
+DOMANDE = ["Qual è l'esito dell'ultimo esame di {p}?", "Che terapia segue {p}?",
+           "Riassumi il referto di {p}", "Ci sono controlli programmati per {p}?"]
+
+SATURATION_GAIN = 1.10  # meno del 10% di throughput in più = saturazione
+
+
+def synthetic_report(rng: random.Random, nome: str) -> str:
+    lines = [
+        "REFERTO AMBULATORIALE",
+        f"Paziente: {nome}. Data: {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2024",
+        "Anamnesi: paziente con " + rng.choice(DIAGNOSI) + " in follow-up ambulatoriale.",
+        "Esame obiettivo: pressione arteriosa 130/85 mmHg, frequenza cardiaca 72 bpm, saturazione 98%.",
+    ]
+    for esame in rng.sample(ESAMI, 3):
+        lines.append(f"Esame {esame}: valori nella norma, glicemia {rng.randint(80, 140)} mg/dl.")
+    lines.append("Diagnosi: " + rng.choice(DIAGNOSI) + ".")
+    lines.append("Terapia: " + rng.choice(TERAPIE) + ".")
+    lines.append("Si consiglia controllo specialistico tra sei mesi con esami ematochimici.")
+    # testo discorsivo come nei referti reali (le sole righe di valori hanno entropia alta)
+    lines += [
+        "il paziente riferisce buone condizioni generali e una discreta tolleranza allo sforzo",
+        "non sono riferiti episodi di dolore toracico e la respirazione risulta regolare",
+        "si raccomanda di proseguire con la dieta indicata e con una regolare attivita fisica",
+        "il quadro clinico appare stabile rispetto alla precedente visita di controllo",
+    ]
+    return "\n".join(lines)
+
+
+def make_pdf(text: str) -> bytes:
+    """PDF minimale a una pagina con il testo dato (font Helvetica, una riga per Tj)."""
+    def esc(s: str) -> str:
+        return s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    ops = ["BT", "/F1 10 Tf", "12 TL", "40 800 Td"]
+    for line in text.splitlines():
+        ops.append(f"({esc(line.encode('latin-1', 'replace').decode('latin-1'))}) Tj T*")
+    ops.append("ET")
+    stream = "\n".join(ops).encode("latin-1", "replace")
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+        b"/Resources << /Font << /F1 5 0 R >> >> /Contents 4 0 R >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % i + obj + b"\nendobj\n")
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for off in offsets:
+        out.write(b"%010d 00000 n \n" % off)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+class Recorder:
+    """Raccoglie le misure dei flussi completati in un livello di concorrenza."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = defaultdict(list)   # flusso -> ms end-to-end
+        self.stages = defaultdict(list)   # (flusso, fase) -> ms
+        self.errors = defaultdict(int)
+        self.prefill = defaultdict(int)   # token di prompt elaborati / risparmiati dalla cache
+
+    def add(self, flow: str, trace):
+        with self.lock:
+            self.totals[flow].append(trace.total_ms)
+            for name, ms in trace.stages.items():
+                self.stages[(flow, name)].append(ms)
+            for key in ("prefill_token", "prefill_risparmiati"):
+                self.prefill[key] += trace.verdicts.get(key, 0)
+
+    def error(self, flow: str, exc: Exception):
+        with self.lock:
+            self.errors[f"{flow}: {type(exc).__name__}"] += 1
+
+    @property
+    def completed(self) -> int:
+        return sum(len(v) for v in self.totals.values())
+
+
+def seed_data(app, n_doctors: int, n_patients: int, docs_per_patient: int, rng: random.Random):
+    """Crea medici e pazienti e indicizza referti sintetici nei vector store."""
+    db = app["SessionLocal"]()
+    doctors, patients = [], defaultdict(list)
+    try:
+        for d in range(n_doctors):
+            doctor = app["User"](
+                username=f"medico{d}", email=f"medico{d}@test.local", hashed_password="x", role="Medico",
+                nome="Dott", cognome=f"Medico{d}", via="Via Roma", numero_civico="1", citta="Salerno",
+                cap="84100", data_nascita=date(1970, 1, 1), sesso="M",
+            )
+            db.add(doctor)
+            doctors.append(doctor)
+            for i in range(n_patients):
+                nome, cognome = NOMI[i % len(NOMI)], f"{COGNOMI[(i // len(NOMI)) % len(COGNOMI)]}{d}x{i}"
+                patient = app["User"](
+                    username=f"p{d}_{i}", email=f"p{d}_{i}@test.local", hashed_password="x", role="Paziente",
+                    nome=nome, cognome=cognome, via="Via Roma", numero_civico="1", citta="Salerno",
+                    cap="84100", data_nascita=date(1980, 1, 1), sesso="F", medicoAssociato=doctor.email,
+                )
+                db.add(patient)
+                patients[doctor.email].append(patient)
+        db.commit()
+
+        for doctor in doctors:
+            for patient in patients[doctor.email]:
+                for k in range(docs_per_patient):
+                    text = synthetic_report(rng, f"{patient.nome} {patient.cognome}")
+                    app["index_document"](patient.email, text, content_hash=hashlib.sha256(text.encode()).hexdigest(),
+                                          metadata={"doc_id": -1, "filename": f"seed_{k}.pdf"})
+        return [app["UserRecord"].from_user(d) for d in doctors], {
+            email: [app["UserRecord"].from_user(p) for p in ps] for email, ps in patients.items()
+        }
+    finally:
+        db.close()
+
+
+def session_loop(app, recorder: Recorder, stop: threading.Event, doctor, pazienti, args, seed: int):
+    rng = random.Random(seed)
+    state = {}  # come st.session_state: conversazione col modello del medico
+    last_patient = None
+    while not stop.is_set():
+        roll = rng.random()
+        if roll < args.upload_ratio:
+            flow = "upload"
+            patient = rng.choice(pazienti)
+            pdf = make_pdf(synthetic_report(rng, f"{patient.nome} {patient.cognome}"))
+            db = app["SessionLocal"]()
+            try:
+                trace = app["RequestTrace"](doctor.email, doctor.role)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    app["ingest_document"](db, patient.email, f"load_{rng.random():.8f}.pdf", pdf, trace=trace)
+                recorder.add(flow, trace)
+            except Exception as e:
+                recorder.error(flow, e)
+            finally:
+                db.close()
+        elif roll < args.upload_ratio + args.patient_ratio:
+            flow = "chat_paziente"
+            patient = rng.choice(pazienti)
+            try:
+                trace = app["RequestTrace"](patient.email, patient.role)
+                result = app["answer_question"](patient, [patient], rng.choice(DOMANDE_PAZIENTE), trace=trace)
+                app["record_request"](trace, result.query_redacted)
+                recorder.add(flow, trace)
+            except Exception as e:
+                recorder.error(flow, e)
+        else:
+            flow = "chat_medico"
+            # spesso il medico fa domande successive sullo stesso paziente
+            if last_patient is None or rng.random() >= args.followup_ratio:
+                last_patient = rng.choice(pazienti)
+            patient = last_patient
+            question = rng.choice(DOMANDE).format(p=f"{patient.nome} {patient.cognome}")
+            try:
+                trace = app["RequestTrace"](doctor.email, doctor.role)
+                result = app["answer_question"](doctor, pazienti, question, trace=trace,
+                                                conversation=app["get_chat_context"](state))
+                app["record_request"](trace, result.query_redacted)
+                recorder.add(flow, trace)
+            except Exception as e:
+                recorder.error(flow, e)
+        stop.wait(rng.expovariate(1000 / args.think_ms) if args.think_ms > 0 else 0)
+
+
+def run_level(app, concurrency: int, duration: float, doctors, patients, args) -> dict:
+    recorder = Recorder()
+    stop = threading.Event()
+    threads = []
+    for i in range(concurrency):
+        doctor = doctors[i % len(doctors)]
+        t = threading.Thread(target=session_loop, daemon=True, args=(
+            app, recorder, stop, doctor, patients[doctor.email], args, args.seed + i))
+        threads.append(t)
+
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    def summary(values):
+        return {"n": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95),
+                "p99": percentile(values, 99)}
+
+    return {
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "throughput": recorder.completed / elapsed,
+        "errors": dict(recorder.errors),
+        "prefill": dict(recorder.prefill),
+        "flows": {flow: summary(v) for flow, v in recorder.totals.items()},
+        "stages": {f"{flow}/{stage}": summary(v) for (flow, stage), v in sorted(recorder.stages.items())},
+    }
+
+
+def saturation_point(results):
+    """Primo livello oltre il quale il throughput non cresce più di SATURATION_GAIN."""
+    for prev, cur in zip(results, results[1:]):
+        if cur["throughput"] < prev["throughput"] * SATURATION_GAIN:
+            return prev["concurrency"]
+    return None
+
+
+def print_level(r):
+    print(f"\n=== Concorrenza {r['concurrency']}: {r['throughput']:.2f} richieste/s "
+          f"in {r['seconds']:.1f}s ===")
+    if r["errors"]:
+        print("  errori:", ", ".join(f"{k} x{v}" for k, v in r["errors"].items()))
+    prefill = r.get("prefill") or {}
+    if prefill.get("prefill_token") or prefill.get("prefill_risparmiati"):
+        done, saved = prefill.get("prefill_token", 0), prefill.get("prefill_risparmiati", 0)
+        print(f"  token di prefill: {done} elaborati, {saved} risparmiati dalla cache "
+              f"({saved / max(1, done + saved):.0%})")
+    print(f"  {'flusso / fase':<42}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, s in list(r["flows"].items()) + list(r["stages"].items()):
+        print(f"  {name:<42}{s['n']:>6}{s['p50']:>10.1f}{s['p95']:>10.1f}{s['p99']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test di carico con sessioni concorrenti")
+    parser.add_argument("--levels", default="1,2,4,8,16", help="livelli di concorrenza, separati da virgola")
+    parser.add_argument("--duration", type=float, default=30.0, help="secondi per livello")
+    parser.add_argument("--doctors", type=int, default=4)
+    parser.add_argument("--patients", type=int, default=20, help="pazienti per medico")
+    parser.add_argument("--docs", type=int, default=3, help="referti sintetici per paziente")
+    parser.add_argument("--upload-ratio", type=float, default=0.1, help="quota di flussi di upload")
+    parser.add_argument("--patient-ratio", type=float, default=0.3, help="quota di chat dei pazienti")
+    parser.add_argument("--think-ms", type=float, default=500.0, help="pausa media tra due richieste")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="scala delle latenze del finto Ollama")
+    parser.add_argument("--ollama-url", default=None, help="usa un Ollama (anche finto) già avviato")
+    parser.add_argument("--db-url", default=None, help="database di test (default: SQLite temporaneo)")
+    parser.add_argument("--embedding", default="fake:1024", help="modello di embedding per i vector store")
+    parser.add_argument("--layout", default="per_patient", choices=["per_patient", "shared"])
+    parser.add_argument("--chat-budget", type=float, default=None,
+                        help="budget di latenza per turno di chat in secondi (CHAT_LATENCY_BUDGET)")
+    parser.add_argument("--followup-ratio", type=float, default=0.6,
+                        help="probabilità che il medico chieda ancora dello stesso paziente")
+    parser.add_argument("--no-context-reuse", action="store_true",
+                        help="ogni turno riparte da una conversazione vuota (CHAT_CONTEXT_REUSE=0)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="salva i risultati in questo file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="mynurseai_load_")
+    if args.ollama_url:
+        ollama_url = args.ollama_url
+    else:
+        _, ollama_url, _ = start_server(time_scale=args.time_scale, seed=args.seed)
+
+    # la configurazione dell'app va impostata prima di importarla
+    os.environ.update({
+        "POSTGRES_URL": args.db_url or f"sqlite:///{os.path.join(workdir, 'load.db')}",
+        "OLLAMA_BASE_URL": ollama_url,
+        "CHROMA_DIR": os.path.join(workdir, "chroma"),
+        "EMBEDDING_MODEL": args.embedding,
+        "VECTORSTORE_LAYOUT": args.layout,
+    })
+    if args.no_context_reuse:
+        os.environ["CHAT_CONTEXT_REUSE"] = "0"
+    if args.chat_budget is not None:
+        os.environ["CHAT_LATENCY_BUDGET"] = str(args.chat_budget)
+
+    from app.database.postgres import SessionLocal, init_db
+    from app.models.user import User
+    from app.models.user_record import UserRecord
+    from app.services.audit_log import audit_stats, record_request
+    from app.services.llm_scheduler import scheduler_stats
+    from app.services.chat_context import get_chat_context
+    from app.services.chat_service import answer_question
+    from app.services.request_trace import RequestTrace, fallback_stats
+    from app.services.upload_service import ingest_document
+    from app.services.vectorstore_service import index_document
+
+    init_db()
+    app = {
+        "SessionLocal": SessionLocal, "User": User, "UserRecord": UserRecord, "RequestTrace": RequestTrace,
+        "answer_question": answer_question, "record_request": record_request,
+        "get_chat_context": get_chat_context,
+        "ingest_document": ingest_document, "index_document": index_document,
+    }
+
+    print(f"Dati di prova in {workdir}, Ollama su {ollama_url}")
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        doctors, patients = seed_data(app, args.doctors, args.patients, args.docs, random.Random(args.seed))
+    print(f"Seed: {args.doctors} medici, {args.doctors * args.patients} pazienti, "
+          f"{args.doctors * args.patients * args.docs} referti in {time.perf_counter() - t0:.1f}s")
+
+    results = []
+    for level in [int(x) for x in args.levels.split(",") if x.strip()]:
+        result = run_level(app, level, args.duration, doctors, patients, args)
+        print_level(result)
+        results.append(result)
+
+    print(f"\nAudit log: {audit_stats()}")
+    print(f"Fallback per budget esaurito: {fallback_stats() or 'nessuno'}")
+    print(f"Scheduler LLM: {scheduler_stats()}")
+    sat = saturation_point(results)
+    print("\n=== Riepilogo ===")
+    for r in results:
+        print(f"  concorrenza {r['concurrency']:>3}: {r['throughput']:.2f} req/s")
+    if sat is None:
+        print("Nessuna saturazione nei livelli provati: aumentare --levels.")
+    else:
+        print(f"Saturazione a concorrenza {sat}: oltre, il throughput cresce meno del "
+              f"{(SATURATION_GAIN - 1) * 100:.0f}% e aumentano solo le attese.")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "levels": results, "saturation": sat}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()